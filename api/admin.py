@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import (Address, Gender, Message, Notification, Plan, Profile,
-                     Review, Tag, TalkRoom, User)
+from .models import (Address, Gender, ImageJob, Message, Notification,
+                     OutgoingEmail, Plan, Profile, Review, Tag, TalkRoom,
+                     TalkRoomMember, User)
 
 # Register your models here.
 
@@ -14,4 +15,7 @@ admin.site.register(Tag)
 admin.site.register(Address)
 admin.site.register(Gender)
 admin.site.register(TalkRoom)
+admin.site.register(TalkRoomMember)
 admin.site.register(Notification)
+admin.site.register(OutgoingEmail)
+admin.site.register(ImageJob)
@@ -0,0 +1,165 @@
+import asyncio
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.http import HttpResponse
+from graphene_django.views import HttpError
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from .profiling import is_debug_requested, should_profile
+from .response_cache import get_auth_scope, get_cacheable_document
+from .views import CachedGraphQLView
+
+# ORMを実行するスレッド数（=ASGIのプロセスあたりのDB接続数の上限）
+ORM_THREADS = 8
+
+_orm_executor = None
+
+
+def get_orm_executor():
+    global _orm_executor
+    if _orm_executor is None:
+        _orm_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'GRAPHQL_ORM_THREADS', ORM_THREADS),
+            thread_name_prefix='graphql-orm')
+    return _orm_executor
+
+
+def shutdown_orm_executor():
+    global _orm_executor
+    if _orm_executor is not None:
+        _orm_executor.shutdown()
+        _orm_executor = None
+
+
+def call_with_connections(fn, *args):
+    # スレッドごとのDB接続は、リクエストの前後と同じように期限切れのものを閉じる
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+# 同期の処理（ORMを含む）を上限付きのスレッドプールで実行し、イベントループは止めない
+async def run_in_orm_thread(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_orm_executor(), call_with_connections, fn, *args)
+
+
+# クエリのルートフィールドを1つずつ含むドキュメントに分ける（フラグメントはそのまま含める）
+# ルートにフラグメントがある場合は分けない
+def split_root_fields(document_ast, operation):
+    selections = operation.selection_set.selections
+    if not all(isinstance(selection, ast.Field) for selection in selections):
+        return None
+    fragments = [definition for definition in document_ast.definitions
+                 if isinstance(definition, ast.FragmentDefinition)]
+    documents = []
+    for selection in selections:
+        root = copy.copy(operation)
+        root.selection_set = ast.SelectionSet(selections=[selection])
+        documents.append(ast.Document(definitions=[root] + fragments))
+    return documents
+
+
+def merge_results(results):
+    data = {}
+    errors = []
+    for result in results:
+        errors.extend(result.errors or [])
+        if result.data is None:
+            # nullにできないルートフィールドのエラーは全体をnullにする
+            data = None
+        elif data is not None:
+            data.update(result.data)
+    return ExecutionResult(data=data, errors=errors or None)
+
+
+# ASGIで動かすGraphQLのビュー
+# ルートフィールドが複数あるクエリは、ルートフィールドごとにORM用のスレッドで並行して実行する
+# それ以外（ミューテーション、キャッシュする公開クエリ、アップロードなど）は
+# 同期のビューをそのままORM用のスレッドで実行する
+class AsyncGraphQLView(CachedGraphQLView):
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.dispatch_async(request, *args, **kwargs)
+
+        view.csrf_exempt = True
+        # ATOMIC_REQUESTSは非同期のビューに使えないので、同期で実行するときに適用する
+        return transaction.non_atomic_requests(view)
+
+    async def dispatch_async(self, request, *args, **kwargs):
+        try:
+            operation = await run_in_orm_thread(self.get_concurrent_operation, request)
+        except HttpError:
+            operation = None
+        if operation is None:
+            return await run_in_orm_thread(self.dispatch_atomic, request, *args, **kwargs)
+
+        documents, variables, operation_name = operation
+        results = await asyncio.gather(*[
+            run_in_orm_thread(self.execute_root_field, request, document, variables,
+                              operation_name)
+            for document in documents])
+        result = merge_results(results)
+        response = {'data': result.data}
+        if result.errors:
+            response['errors'] = [self.format_error(e) for e in result.errors]
+        return HttpResponse(self.json_encode(request, response),
+                            status=200, content_type='application/json')
+
+    def dispatch_atomic(self, request, *args, **kwargs):
+        atomic = transaction.atomic if connection.settings_dict['ATOMIC_REQUESTS'] \
+            else nullcontext
+        with atomic():
+            return self.dispatch(request, *args, **kwargs)
+
+    # ルートフィールドごとに分けて実行できるクエリなら (ドキュメント, 変数, 操作名) を返す
+    def get_concurrent_operation(self, request):
+        if request.method != 'POST' or self.get_content_type(request) != 'application/json':
+            return None
+        if is_debug_requested(request) or should_profile(request):
+            return None
+        data = self.parse_body(request)
+        if not isinstance(data, dict):
+            return None
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        if not query:
+            return None
+        # レスポンスをキャッシュする公開クエリは同期のビューで処理する
+        if get_auth_scope(request) and \
+                get_cacheable_document(self.schema, query, operation_name) is not None:
+            return None
+        document = self.get_backend(request).document_from_string(self.schema, query)
+        if document.errors:
+            return None
+        operation = get_operation_ast(document.document_ast, operation_name)
+        if operation is None or operation.operation != 'query' or \
+                len(operation.selection_set.selections) < 2:
+            return None
+        documents = split_root_fields(document.document_ast, operation)
+        if documents is None:
+            return None
+        self.record_cost(request, document, operation_name)
+        return documents, variables, operation_name
+
+    def execute_root_field(self, request, document, variables, operation_name):
+        # DataLoaderはスレッドをまたいで使えないので、ルートフィールドごとに作る
+        context = copy.copy(request)
+        context.dataloaders = None
+        return execute(
+            self.schema, document,
+            context_value=context,
+            variable_values=variables,
+            operation_name=operation_name,
+            middleware=self.get_middleware(request),
+        )
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+from graphql_jwt import exceptions
+from graphql_jwt.decorators import context
+from graphql_jwt.utils import get_credentials, get_payload, get_user_by_payload
+
+# トークンとユーザーの対応を保持する秒数（この間は無効化したユーザーも認証される）
+TOKEN_USER_CACHE_TTL = 60
+# 保持するトークンの件数
+TOKEN_USER_CACHE_SIZE = 10000
+
+
+# トークンからユーザーIDへの対応を短時間保持するキャッシュ（ワーカーごと）
+class TokenUserCache:
+    def __init__(self, ttl=TOKEN_USER_CACHE_TTL, max_size=TOKEN_USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._user_ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            item = self._user_ids.get(token)
+            if item is None:
+                return None
+            user_id, expires_at = item
+            if expires_at <= time.time():
+                del self._user_ids[token]
+                return None
+            self._user_ids.move_to_end(token)
+            return user_id
+
+    # トークンの有効期限を過ぎて保持しないようにする
+    def set(self, token, user_id, exp=None):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._user_ids[token] = (user_id, expires_at)
+            self._user_ids.move_to_end(token)
+            while len(self._user_ids) > self.max_size:
+                self._user_ids.popitem(last=False)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for token in [token for token, (cached_id, _) in self._user_ids.items()
+                          if cached_id == user_id]:
+                del self._user_ids[token]
+
+    def clear(self):
+        with self._lock:
+            self._user_ids.clear()
+
+
+_token_user_cache = None
+
+
+def get_token_user_cache():
+    global _token_user_cache
+    if _token_user_cache is None:
+        _token_user_cache = TokenUserCache(
+            ttl=getattr(settings, 'JWT_USER_CACHE_TTL', TOKEN_USER_CACHE_TTL))
+    return _token_user_cache
+
+
+# idだけを使う間はusersテーブルを参照しない認証済みユーザー
+# id/pk以外の属性を参照したときに初めてユーザーを取得する
+class LazyUser(SimpleLazyObject):
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, user=None):
+        super().__init__(lambda: get_user_model()._default_manager.get(pk=user_id))
+        self.__dict__['id'] = self.__dict__['pk'] = user_id
+        if user is not None:
+            self._wrapped = user
+
+
+# トークンを検証してユーザーを返す（期限切れ・不正なトークンは JSONWebTokenError）
+def get_user_by_token(token, request=None):
+    cache = get_token_user_cache()
+    user_id = cache.get(token)
+    if user_id is not None:
+        return LazyUser(user_id)
+
+    payload = get_payload(token, request)
+    user = get_user_by_payload(payload)
+    if user is None:
+        return None
+    cache.set(token, user.pk, payload.get('exp'))
+    return LazyUser(user.pk, user)
+
+
+# リクエストごとに1回だけJWTで認証するDjangoのミドルウェア
+# graphql_jwtのミドルウェア（フィールドごとに実行される）の代わりに使う
+class JSONWebTokenMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        token = get_credentials(request)
+        if token is None:
+            return
+        try:
+            user = get_user_by_token(token, request)
+        except exceptions.JSONWebTokenError as e:
+            user = None
+            # ログインが必要なフィールドでエラーとして返す
+            request.jwt_error = e
+        request.user = user if user is not None else AnonymousUser()
+
+
+# graphql_jwtのlogin_requiredと同じだが、トークンが期限切れなどで認証できなかった場合は
+# 権限エラーの代わりにその理由を返す（クライアントはトークンを更新して再送する）
+def login_required(f):
+    @wraps(f)
+    @context(f)
+    def wrapper(context, *args, **kwargs):
+        if context.user.is_authenticated:
+            return f(*args, **kwargs)
+        raise getattr(context, 'jwt_error', None) or exceptions.PermissionDenied()
+    return wrapper
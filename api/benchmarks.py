@@ -0,0 +1,339 @@
+import asyncio
+import json
+import math
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import RequestFactory, override_settings
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from .async_views import AsyncGraphQLView, shutdown_orm_executor
+from .auth import JSONWebTokenMiddleware
+from .documents import get_document_backend
+from .models import (Message, Notification, Plan, Profile, Review, TalkRoom,
+                     User)
+from .views import CachedGraphQLView
+
+# フロントエンドで実際に使っている操作
+# user は実行するユーザー（get_benchmark_context() のキー）、variables は変数を返す関数
+OPERATIONS = [
+    {
+        'name': 'landing',
+        'user': None,
+        'query': '''query Landing {
+            collegeProfiles(first: 12, orderBy: "-averageStars") {
+                edges { node {
+                    id profileName profileImage schoolName averageStars reviewCount
+                    selectedAddress { addressName }
+                    selectedGender { genderName }
+                    tags { edges { node { tagName } } }
+                } }
+            }
+            allProfilesCount
+        }''',
+    },
+    {
+        'name': 'published_plans',
+        'user': None,
+        'query': '''query PublishedPlans {
+            allPlans(isPublished: true, first: 20) {
+                edges { node {
+                    id title content price publishedAt
+                    planAuthor { email targetUser { profileName profileImage } }
+                } }
+            }
+        }''',
+    },
+    {
+        'name': 'profile_detail',
+        'user': None,
+        'query': '''query ProfileDetail($id: ID!) {
+            profile(id: $id) {
+                id profileName profileText schoolName undergraduate department
+                clubActivities admissionFormat favoriteSubject wantHear problem
+                averageStars reviewCount starsHistogram
+                selectedAddress { addressName }
+                tags { edges { node { tagName } } }
+                followingUsers { edges { node { email } } }
+            }
+        }''',
+        'variables': lambda context: {
+            'id': to_global_id('ProfileNode', context['profile'].id)},
+    },
+    {
+        'name': 'search_profiles',
+        'user': None,
+        'query': '''query SearchProfiles($query: String!) {
+            searchProfiles(query: $query, first: 20) {
+                edges { node { id profileName schoolName tags { edges { node { tagName } } } } }
+            }
+        }''',
+        'variables': lambda context: {'query': '大学生活 相談'},
+    },
+    {
+        'name': 'login_user_talk_rooms',
+        'user': 'student',
+        'query': '''query LoginUserTalkRooms {
+            loginUserTalkRooms(first: 20) {
+                edges { node {
+                    id isApprove unreadCount lastMessageAt lastMessagePreview
+                    selectedPlan { title planAuthor { targetUser { profileName } } }
+                    opponentUser { targetUser { profileName profileImage } }
+                } }
+            }
+            unreadMessageTotal
+        }''',
+    },
+    {
+        'name': 'talk_room_messages',
+        'user': 'student',
+        'query': '''query TalkRoomMessages($id: ID!) {
+            talkRoom(id: $id) {
+                id unreadCount
+                messages(last: 30) {
+                    edges { node { id text isViewed createdAt sender { id email } } }
+                    pageInfo { hasPreviousPage startCursor }
+                }
+            }
+        }''',
+        'variables': lambda context: {
+            'id': to_global_id('TalkRoomNode', context['large_room'].id)},
+    },
+    {
+        'name': 'login_user_notifications',
+        'user': 'student',
+        'query': '''query LoginUserNotifications {
+            loginUserNotifications(first: 20) {
+                edges { node {
+                    id notificationType isChecked createdAt
+                    notificator { targetUser { profileName profileImage } }
+                } }
+            }
+            unreadNotificationCount
+        }''',
+    },
+]
+
+
+# 操作で使うユーザーやIDを選ぶ（最もメッセージの多いトークルームとその大学生）
+def get_benchmark_context():
+    large_room = TalkRoom.objects.annotate(
+        message_count=Count('talking_room')).order_by('-message_count').first()
+    if large_room is None or large_room.selected_plan is None:
+        raise ValueError('ベンチマーク用のデータがありません（manage.py seed_scale で作成してください）')
+    return {
+        'student': large_room.selected_plan.plan_author,
+        'large_room': large_room,
+        'profile': Profile.objects.filter(is_college_student=True).order_by('id').first(),
+    }
+
+
+def get_dataset_size():
+    return {model.__name__: model.objects.count()
+            for model in [User, Profile, Plan, TalkRoom, Message, Review, Notification]}
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[max(math.ceil(ratio * len(values)) - 1, 0)]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def execute_operation(schema, operation, context):
+    request = RequestFactory().post('/graphql/')
+    user = operation.get('user')
+    request.user = context[user] if user else AnonymousUser()
+    variables = operation.get('variables')
+    result = schema.execute(
+        operation['query'],
+        context_value=request,
+        variables=variables(context) if variables else None,
+        backend=get_document_backend(),
+    )
+    if result.errors:
+        raise ValueError('{}: {}'.format(operation['name'], result.errors))
+    return result
+
+
+# 操作ごとに実行時間のp50/p95、SQLの数、メモリ使用量のピークを計測する
+def run_operation(schema, operation, context, iterations=20, warmup=2):
+    for _ in range(warmup):
+        execute_operation(schema, operation, context)
+
+    durations = []
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        for _ in range(iterations):
+            started_at = time.perf_counter()
+            execute_operation(schema, operation, context)
+            durations.append((time.perf_counter() - started_at) * 1000)
+
+    # tracemallocは実行時間に影響するので別に1回だけ実行する
+    tracemalloc.start()
+    try:
+        execute_operation(schema, operation, context)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(durations, 0.5), 3),
+        'p95_ms': round(percentile(durations, 0.95), 3),
+        'mean_ms': round(statistics.mean(durations), 3),
+        'queries': counter.count // iterations,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(schema, names=None, iterations=20, warmup=2):
+    context = get_benchmark_context()
+    return {
+        operation['name']: run_operation(schema, operation, context, iterations, warmup)
+        for operation in OPERATIONS if not names or operation['name'] in names
+    }
+
+
+# 基準の結果と比べて、許容範囲を超えて悪化した項目を返す
+def find_regressions(baseline, results, tolerance=0.2):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('operations', {}).get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append((name, 'queries', base['queries'], result['queries']))
+        for key in ('p50_ms', 'p95_ms', 'peak_memory_kb'):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append((name, key, base[key], result[key]))
+    return regressions
+
+
+# 各スレッドのDB接続でSQLごとに待機し、ネットワーク越しのDBの遅延を再現する
+@contextmanager
+def simulated_latency(seconds):
+    def wait(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def add_wrapper(connection, **kwargs):
+        connection.execute_wrappers.append(wait)
+
+    if not seconds:
+        yield
+        return
+    connection.execute_wrappers.append(wait)
+    connection_created.connect(add_wrapper)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_wrapper)
+        connection.execute_wrappers.remove(wait)
+
+
+def build_requests(schema, names, context, total):
+    operations = [operation for operation in OPERATIONS
+                  if not names or operation['name'] in names]
+    tokens = {}
+    requests = []
+    for index in range(total):
+        operation = operations[index % len(operations)]
+        variables = operation.get('variables')
+        body = json.dumps({'query': operation['query'],
+                           'variables': variables(context) if variables else None})
+        extra = {}
+        user = operation.get('user')
+        if user:
+            if user not in tokens:
+                tokens[user] = get_token(context[user])
+            extra['HTTP_AUTHORIZATION'] = 'JWT ' + tokens[user]
+        request = RequestFactory().post(
+            '/graphql/', body, content_type='application/json', **extra)
+        # トークンがあれば JSONWebTokenMiddleware が置き換える
+        request.user = AnonymousUser()
+        requests.append(request)
+    return requests
+
+
+def check_response(response):
+    if response.status_code != 200 or 'errors' in json.loads(response.content):
+        raise ValueError('リクエストが失敗しました: {}'.format(response.content[:200]))
+
+
+def summarize_throughput(durations, elapsed):
+    return {
+        'requests': len(durations),
+        'requests_per_second': round(len(durations) / elapsed, 1),
+        'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+    }
+
+
+# WSGI（同期ワーカー）: 同時に処理できるリクエストはワーカー数まで
+def run_wsgi_throughput(schema, requests, workers):
+    handler = JSONWebTokenMiddleware(CachedGraphQLView.as_view(schema=schema))
+
+    def handle(request):
+        started_at = time.perf_counter()
+        check_response(handler(request))
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        durations = list(executor.map(handle, requests))
+    return summarize_throughput(durations, time.perf_counter() - started_at)
+
+
+# ASGI: イベントループで同時に concurrency 件まで受け付け、ORMは orm_threads のスレッドで実行する
+def run_asgi_throughput(schema, requests, concurrency, orm_threads):
+    handler = JSONWebTokenMiddleware(AsyncGraphQLView.as_async_view(schema=schema))
+
+    async def handle(request, semaphore):
+        async with semaphore:
+            started_at = time.perf_counter()
+            check_response(await handler(request))
+            return time.perf_counter() - started_at
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[handle(request, semaphore) for request in requests])
+
+    with override_settings(GRAPHQL_ORM_THREADS=orm_threads):
+        shutdown_orm_executor()
+        try:
+            started_at = time.perf_counter()
+            durations = asyncio.run(run())
+            elapsed = time.perf_counter() - started_at
+        finally:
+            shutdown_orm_executor()
+    return summarize_throughput(durations, elapsed)
+
+
+# 同じスレッド数（=DB接続数）でWSGIとASGIのスループットを比べる
+# 同期ワーカーはプロセスごとにメモリを使うので、ASGI側はメモリが少ない条件での比較になる
+def run_throughput(schema, names=None, total=200, workers=4, concurrency=32,
+                   orm_threads=None, latency=0):
+    context = get_benchmark_context()
+    results = {}
+    with simulated_latency(latency):
+        results['wsgi'] = run_wsgi_throughput(
+            schema, build_requests(schema, names, context, total), workers)
+        results['asgi'] = run_asgi_throughput(
+            schema, build_requests(schema, names, context, total), concurrency,
+            orm_threads or workers)
+    return results
@@ -0,0 +1,17 @@
+from django.db import router, transaction
+
+
+# bulk_createで作成し、主キーの設定されたインスタンスを返す（トランザクション内で呼ぶ）
+# PostgreSQLなど INSERT ... RETURNING で主キーを返せるデータベースではそのまま返す
+# SQLiteではbulk_createで主キーが設定されないので、作成した件数だけ主キーの降順に取得し直す
+# （SQLiteは最初の書き込みからコミットまでデータベース全体の書き込みロックを保持するので、
+#  同じトランザクション内で続けて取得すれば他の接続の行が混ざることはない。
+#  取得し直すまでの間に同じトランザクションで同じテーブルに書き込まないこと）
+def bulk_create(model, objects, batch_size=None):
+    using = router.db_for_write(model)
+    created = model.objects.using(using).bulk_create(objects, batch_size=batch_size)
+    if not created or created[0].pk is not None:
+        return created
+    if not transaction.get_connection(using).in_atomic_block:
+        raise RuntimeError('bulk_create() must be called inside transaction.atomic()')
+    return list(model.objects.using(using).order_by('-pk')[:len(created)])[::-1]
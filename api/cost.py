@@ -0,0 +1,133 @@
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import (GraphQLInterfaceType, GraphQLObjectType,
+                                     get_named_type)
+from graphql.validation.rules.base import ValidationRule
+
+# 1回のクエリで許可するコストとフィールドの深さの上限
+MAX_QUERY_COST = 100000
+MAX_QUERY_DEPTH = 15
+# first/lastの指定がないconnectionで返す件数
+DEFAULT_PAGE_SIZE = 100
+
+
+def get_max_query_cost():
+    return getattr(settings, 'GRAPHQL_MAX_QUERY_COST', MAX_QUERY_COST)
+
+
+def get_max_query_depth():
+    return getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', MAX_QUERY_DEPTH)
+
+
+def get_default_page_size():
+    return getattr(settings, 'GRAPHQL_DEFAULT_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def get_max_page_size():
+    return graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+
+
+# クエリの静的なコストを計算する
+# フィールド1つにつき1、connectionの中身は first/last の件数倍で数える
+class CostCalculator:
+    def __init__(self, schema, document):
+        self.schema = schema
+        self.fragments = {
+            definition.name.value: definition for definition in document.definitions
+            if isinstance(definition, ast.FragmentDefinition)}
+
+    def get_root_type(self, operation):
+        if operation.operation == 'mutation':
+            return self.schema.get_mutation_type()
+        if operation.operation == 'subscription':
+            return self.schema.get_subscription_type()
+        return self.schema.get_query_type()
+
+    # (コスト, 深さ) を返す
+    def calculate(self, operation):
+        return self.selection_set_cost(
+            self.get_root_type(operation), operation.selection_set, set())
+
+    def selection_set_cost(self, parent_type, selection_set, visited):
+        cost = 0
+        depth = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                field_cost, field_depth = self.field_cost(parent_type, selection, visited)
+            elif isinstance(selection, ast.InlineFragment):
+                field_cost, field_depth = self.selection_set_cost(
+                    self.get_condition_type(selection, parent_type),
+                    selection.selection_set, visited)
+            else:
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                # 存在しない・循環しているフラグメントは他の検証ルールでエラーになる
+                if fragment is None or name in visited:
+                    continue
+                field_cost, field_depth = self.selection_set_cost(
+                    self.get_condition_type(fragment, parent_type),
+                    fragment.selection_set, visited | {name})
+            cost += field_cost
+            depth = max(depth, field_depth)
+        return cost, depth
+
+    def get_condition_type(self, fragment, parent_type):
+        if fragment.type_condition is None:
+            return parent_type
+        return self.schema.get_type(fragment.type_condition.name.value) or parent_type
+
+    def field_cost(self, parent_type, field, visited):
+        field_def = None
+        if isinstance(parent_type, (GraphQLObjectType, GraphQLInterfaceType)):
+            field_def = parent_type.fields.get(field.name.value)
+        if field.selection_set is None or field_def is None:
+            return 1, 1
+
+        cost, depth = self.selection_set_cost(
+            get_named_type(field_def.type), field.selection_set, visited)
+        if 'first' in field_def.args or 'last' in field_def.args:
+            cost *= self.get_page_size(field)
+        return 1 + cost, 1 + depth
+
+    def get_page_size(self, field):
+        sizes = []
+        for argument in field.arguments or []:
+            if argument.name.value not in ('first', 'last'):
+                continue
+            value = argument.value
+            # 変数の値は検証時にはわからない（検証済みのドキュメントは変数によらずキャッシュされる）
+            # ので、既定値があっても上限の件数で数える
+            if isinstance(value, ast.IntValue):
+                sizes.append(int(value.value))
+            else:
+                sizes.append(get_max_page_size())
+        return min(sizes) if sizes else get_default_page_size()
+
+
+# コストまたは深さが上限を超える操作をエラーにする検証ルール
+# on_cost を渡すと {操作名: コスト} を受け取れる
+class QueryCostRule(ValidationRule):
+    def __init__(self, context, on_cost=None):
+        super().__init__(context)
+        self.on_cost = on_cost
+
+    def enter_Document(self, node, *args):
+        calculator = CostCalculator(self.context.get_schema(), node)
+        costs = {}
+        for definition in node.definitions:
+            if not isinstance(definition, ast.OperationDefinition):
+                continue
+            cost, depth = calculator.calculate(definition)
+            costs[definition.name.value if definition.name else None] = cost
+            if cost > get_max_query_cost():
+                self.context.report_error(GraphQLError(
+                    'クエリのコスト（{}）が上限（{}）を超えています'.format(
+                        cost, get_max_query_cost()), [definition]))
+            if depth > get_max_query_depth():
+                self.context.report_error(GraphQLError(
+                    'クエリの深さ（{}）が上限（{}）を超えています'.format(
+                        depth, get_max_query_depth()), [definition]))
+        if self.on_cost is not None:
+            self.on_cost(costs)
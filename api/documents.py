@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from graphql import parse
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.validation import validate
+from graphql.validation.rules import specified_rules
+
+from .cost import QueryCostRule
+
+# キャッシュする検証済みクエリの件数
+DOCUMENT_CACHE_SIZE = 500
+
+
+def get_document_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def return_errors(errors, *args, **kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+# 構文解析と検証（コストの上限の確認を含む）が済んだクエリをLRUで保持するバックエンド
+# キャッシュにあるクエリはparseとvalidateを行わずに実行する
+class CachedDocumentBackend(GraphQLCoreBackend):
+    def __init__(self, executor=None, max_size=DOCUMENT_CACHE_SIZE):
+        super().__init__(executor=executor)
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        key = (id(schema), get_document_hash(document_string))
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        document_ast = parse(document_string)
+        costs = {}
+        errors = validate(schema, document_ast, specified_rules + [
+            partial(QueryCostRule, on_cost=costs.update)])
+        if errors:
+            # 不正なクエリはキャッシュしない
+            execute_document = partial(return_errors, errors)
+        else:
+            execute_document = partial(
+                execute, schema, document_ast, **self.execute_params)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=execute_document,
+        )
+        # 操作ごとのコスト（{操作名: コスト}）
+        document.costs = costs
+        document.errors = errors
+        if errors:
+            return document
+
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+
+_document_backend = None
+
+
+def get_document_backend():
+    global _document_backend
+    if _document_backend is None:
+        _document_backend = CachedDocumentBackend(max_size=getattr(
+            settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', DOCUMENT_CACHE_SIZE))
+    return _document_backend
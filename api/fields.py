@@ -0,0 +1,169 @@
+import json
+from functools import partial
+
+from django.db.models import Q
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql_relay.utils import base64, unbase64
+from promise import Promise
+
+from .cost import get_default_page_size
+from .optimizer import optimize_connection_queryset
+
+
+# DjangoFilterConnectionFieldの拡張
+# クエリで選択された関連フィールドに合わせてselect_related/prefetch_relatedを付与し、
+# リゾルバーがDataLoaderのPromiseやリストを返した場合もそのまま扱えるようにする
+class FilterConnectionField(DjangoFilterConnectionField):
+    def __init__(self, type, *args, **kwargs):
+        # 並び順（例: ('-created_at', '-id')）
+        self.ordering = tuple(kwargs.pop('ordering', ()))
+        super(FilterConnectionField, self).__init__(type, *args, **kwargs)
+
+    @classmethod
+    def connection_resolver(
+        cls, resolver, connection, default_manager, queryset_resolver,
+        max_limit, enforce_first_or_last, root, info, **args
+    ):
+        # first/lastの指定がなければ既定の件数だけ返す
+        if args.get('first') is None and args.get('last') is None:
+            page_size = get_default_page_size()
+            args['first'] = min(page_size, max_limit) if max_limit else page_size
+        return super(FilterConnectionField, cls).connection_resolver(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args)
+
+    @classmethod
+    def resolve_queryset(
+        cls, connection, iterable, info, args, filtering_args, filterset_class,
+        ordering=()
+    ):
+        resolve = super(FilterConnectionField, cls).resolve_queryset
+
+        def resolve_and_optimize(queryset):
+            queryset = resolve(connection, queryset, info, args,
+                               filtering_args, filterset_class)
+            queryset = optimize_connection_queryset(
+                queryset, info,
+                extra_fields=[name.lstrip('-') for name in ordering])
+            if ordering:
+                queryset = queryset.order_by(*ordering)
+            return queryset
+
+        if not Promise.is_thenable(iterable) and not isinstance(iterable, list):
+            return resolve_and_optimize(iterable)
+
+        # フィルターの指定がなければDataLoaderの結果をそのまま返す
+        if not any(key in filtering_args for key in args):
+            return iterable
+
+        # フィルターの指定がある場合は取得済みの主キーで絞り込んでからフィルタリングする
+        def filter_loaded(objects):
+            model = connection._meta.node._meta.model
+            return resolve_and_optimize(model._default_manager.filter(
+                pk__in=[obj.pk for obj in objects]))
+
+        return Promise.resolve(iterable).then(filter_loaded)
+
+    def get_queryset_resolver(self):
+        return partial(
+            self.resolve_queryset,
+            filterset_class=self.filterset_class,
+            filtering_args=self.filtering_args,
+            ordering=self.ordering,
+        )
+
+
+# 最後に取得した行の並び替えキーをカーソルにするconnection
+# COUNT(*)とOFFSETを使わないので、どのページも先頭ページと同じコストで取得できる
+class KeysetConnectionField(FilterConnectionField):
+    cursor_prefix = 'keyset:'
+
+    def __init__(self, type, *args, **kwargs):
+        kwargs.setdefault('ordering', ('id',))
+        super(KeysetConnectionField, self).__init__(type, *args, **kwargs)
+        # OFFSETでのページングはできないので引数から外す
+        self._base_args.pop('offset', None)
+
+    @classmethod
+    def encode_cursor(cls, obj, ordering):
+        values = []
+        for name in ordering:
+            field = obj._meta.get_field(name.lstrip('-'))
+            values.append(field.value_to_string(obj))
+        return base64(cls.cursor_prefix + json.dumps(values))
+
+    @classmethod
+    def decode_cursor(cls, cursor, model, ordering):
+        try:
+            payload = unbase64(cursor)
+            if not payload.startswith(cls.cursor_prefix):
+                raise ValueError
+            values = json.loads(payload[len(cls.cursor_prefix):])
+            if len(values) != len(ordering):
+                raise ValueError
+            return [model._meta.get_field(name.lstrip('-')).to_python(value)
+                    for name, value in zip(ordering, values)]
+        except Exception:
+            raise ValueError('カーソルが不正です: {}'.format(cursor))
+
+    # カーソルより後ろ（backwardの場合は前）の行を表す条件
+    @staticmethod
+    def keyset_filter(ordering, values, backward=False):
+        condition = Q()
+        equals = {}
+        for name, value in zip(ordering, values):
+            field_name = name.lstrip('-')
+            descending = name.startswith('-')
+            lookup = 'lt' if descending != backward else 'gt'
+            condition |= Q(**equals, **{field_name + '__' + lookup: value})
+            equals[field_name] = value
+        return condition
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        queryset = iterable
+        ordering = queryset.query.order_by
+        first = args.get('first')
+        last = args.get('last')
+        after = args.get('after')
+        before = args.get('before')
+
+        if after:
+            queryset = queryset.filter(cls.keyset_filter(
+                ordering, cls.decode_cursor(after, queryset.model, ordering)))
+        if before:
+            queryset = queryset.filter(cls.keyset_filter(
+                ordering, cls.decode_cursor(before, queryset.model, ordering),
+                backward=True))
+
+        if last is not None and first is None:
+            # 後ろから取得する場合は逆順に1件多く取得して次のページの有無を判定する
+            items = list(queryset.reverse()[:last + 1])
+            has_previous_page = len(items) > last
+            items = items[:last][::-1]
+            has_next_page = bool(before)
+        else:
+            if first is None:
+                first = max_limit
+            items = list(queryset[:first + 1]) if first is not None else list(queryset)
+            has_next_page = first is not None and len(items) > first
+            items = items[:first]
+            has_previous_page = bool(after)
+            if last is not None:
+                has_previous_page = has_previous_page or len(items) > last
+                items = items[-last:] if last else []
+
+        edges = [
+            connection.Edge(node=item, cursor=cls.encode_cursor(item, ordering))
+            for item in items
+        ]
+        page_info = PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        )
+        result = connection(edges=edges, page_info=page_info)
+        result.iterable = iterable
+        return result
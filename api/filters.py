@@ -0,0 +1,62 @@
+import django_filters
+
+from .models import Profile, TalkRoom
+
+
+# 並び替えの指定があれば、同じ値の行の順番が変わらないようにIDでも並べる
+class StableOrderingFilter(django_filters.OrderingFilter):
+    def filter(self, qs, value):
+        qs = super().filter(qs, value)
+        if value:
+            qs = qs.order_by(*qs.query.order_by, 'id')
+        return qs
+
+
+class ProfileFilter(django_filters.FilterSet):
+    # 評価の平均やレビュー数で並び替え（例: orderBy: "-averageStars"）
+    order_by = StableOrderingFilter(fields=(
+        ('average_stars', 'average_stars'),
+        ('review_count', 'review_count'),
+        ('created_at', 'created_at'),
+    ))
+
+    class Meta:
+        model = Profile
+        fields = {
+            # 本人確認が済んでいるユーザーをフィルタリング
+            'target_user__is_active': ['exact'],
+
+            'profile_name': ['exact', 'icontains'],
+            'profile_text': ['exact', 'icontains'],
+            'age': ['exact'],
+            'is_college_student': ['exact'],
+            'school_name': ['exact', 'icontains'],
+
+            'undergraduate': ['exact', 'icontains'],
+            'department': ['exact', 'icontains'],
+            'club_activities': ['exact', 'icontains'],
+            'admission_format': ['exact', 'icontains'],
+            'favorite_subject': ['exact', 'icontains'],
+            'want_hear': ['exact', 'icontains'],
+            'problem': ['exact', 'icontains'],
+
+            'selected_address': ['exact'],
+            'selected_gender': ['exact'],
+
+            # 評価の平均とレビュー数での絞り込み
+            'average_stars': ['gte', 'lte'],
+            'review_count': ['gte'],
+        }
+
+
+class TalkRoomFilter(django_filters.FilterSet):
+    # 最後にやりとりした日時で並び替え（例: orderBy: "lastActivityAt"）
+    order_by = StableOrderingFilter(fields=(
+        ('last_activity_at', 'last_activity_at'),
+    ))
+
+    class Meta:
+        model = TalkRoom
+        fields = {
+            'selected_plan': ['exact'],
+        }
@@ -0,0 +1,202 @@
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, get_storage_class
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .mail import get_retry_delay
+from .models import ImageJob
+
+# 加工後の画像の最大の幅・高さ
+MAX_IMAGE_SIZE = 1600
+# 生成するサムネイルの大きさ（px）
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+# 生成する形式と拡張子
+IMAGE_FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# 加工を諦めるまでの回数
+MAX_ATTEMPTS = 5
+
+# サムネイルを正方形に切り抜くフィールド（アバターなど）
+SQUARE_FIELDS = {('api.Profile', 'profile_image')}
+
+
+# 元の画像を加工まで一時保存するストレージ
+# Webとワーカーは別のサーバー（Herokuのdyno）で動きファイルシステムを共有しないので、
+# 既定では画像のフィールドと同じストレージ（本番ではCloudinary）の pending/ 以下に保存する
+# 別のストレージを使う場合は settings.IMAGE_PENDING_STORAGE に指定する
+def get_pending_storage():
+    backend = getattr(settings, 'IMAGE_PENDING_STORAGE', None)
+    if backend:
+        return get_storage_class(backend)()
+    return default_storage
+
+
+def get_variants_field_name(field_name):
+    return field_name + '_variants'
+
+
+# アップロードされた画像を加工待ちにする（呼び出し元のトランザクションに含まれる）
+# 受信時に計算したハッシュがあれば、クライアントが付けたファイル名の代わりに使う
+def queue_image(instance, field_name, upload):
+    file_name = os.path.basename(upload.name)
+    sha256 = getattr(upload, 'sha256', None)
+    if sha256:
+        file_name = sha256 + os.path.splitext(file_name)[1].lower()
+    name = get_pending_storage().save(
+        'pending/{}/{}/{}'.format(instance._meta.model_name, instance.pk, file_name), upload)
+    return ImageJob.objects.create(
+        model_label=instance._meta.label,
+        object_id=instance.pk,
+        field_name=field_name,
+        source_name=name,
+    )
+
+
+# 画像を読み込み、EXIFの向きを反映したRGBの画像にする（保存し直すことでEXIFは削除される）
+def open_image(file):
+    image = Image.open(file)
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode_image(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY,
+                   optimize=True, progressive=True)
+    return ContentFile(buffer.getvalue())
+
+
+def resize_image(image, size, square=False):
+    if square:
+        return ImageOps.fit(image, (size, size), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+# 元の画像を加工し、(元の大きさのJPEGのファイル名, {大きさ: {形式: ファイル名}}) を返す
+def render_variants(instance, field_name, file):
+    field = instance._meta.get_field(field_name)
+    storage = field.storage
+    square = (instance._meta.label, field_name) in SQUARE_FIELDS
+    base = os.path.splitext(field.generate_filename(instance, 'image.jpg'))[0]
+
+    image = open_image(file)
+    image = resize_image(image, MAX_IMAGE_SIZE)
+    variants = {'original': {}}
+    for image_format, ext in IMAGE_FORMATS.items():
+        variants['original'][image_format] = storage.save(
+            '{}.{}'.format(base, ext), encode_image(image, image_format))
+    for size in THUMBNAIL_SIZES:
+        thumbnail = resize_image(image, size, square)
+        variants[str(size)] = {
+            image_format: storage.save('{}_{}.{}'.format(base, size, ext),
+                                       encode_image(thumbnail, image_format))
+            for image_format, ext in IMAGE_FORMATS.items()
+        }
+    return variants['original']['jpeg'], variants
+
+
+def delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            pass
+
+
+def get_variant_names(variants):
+    return [name for formats in variants.values() for name in formats.values()]
+
+
+def process_job(job):
+    model = apps.get_model(job.model_label)
+    instance = model._default_manager.filter(pk=job.object_id).first()
+    # 同じ画像に新しい加工待ちがあれば、古いものは加工しない
+    newer = ImageJob.objects.filter(
+        model_label=job.model_label, object_id=job.object_id,
+        field_name=job.field_name, id__gt=job.id).exists()
+    source_storage = get_pending_storage() if job.source_pending else \
+        model._meta.get_field(job.field_name).storage
+
+    if instance is not None and not newer:
+        variants_field_name = get_variants_field_name(job.field_name)
+        with source_storage.open(job.source_name, 'rb') as file:
+            name, variants = render_variants(instance, job.field_name, file)
+
+        # 以前の画像と加工した画像は置き換えた後に削除する
+        old_file = getattr(instance, job.field_name)
+        old_names = get_variant_names(getattr(instance, variants_field_name) or {})
+        if old_file:
+            old_names.append(old_file.name)
+
+        setattr(instance, job.field_name, name)
+        setattr(instance, variants_field_name, variants)
+        instance.save(update_fields=[job.field_name, variants_field_name])
+        new_names = get_variant_names(variants)
+        delete_files(model._meta.get_field(job.field_name).storage,
+                     [old for old in old_names if old not in new_names])
+
+    if job.source_pending:
+        delete_files(source_storage, [job.source_name])
+    job.processed_at = timezone.now()
+    job.attempts += 1
+    job.save(update_fields=['processed_at', 'attempts'])
+
+
+# 加工の時刻になった画像をまとめて加工し、加工できた件数を返す
+def process_queued_images(batch_size=10, max_attempts=MAX_ATTEMPTS):
+    processed = 0
+    with transaction.atomic():
+        # 複数のワーカーが同時に動いても同じ画像を加工しないようにロックする
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, attempts__lt=max_attempts,
+                    next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for job in jobs:
+            try:
+                with transaction.atomic():
+                    process_job(job)
+            except Exception as error:
+                mark_failed(job, error)
+            else:
+                processed += 1
+    return processed
+
+
+def mark_failed(job, error):
+    job.attempts += 1
+    job.next_attempt_at = timezone.now() + get_retry_delay(job.attempts)
+    job.last_error = repr(error)
+    job.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
+
+
+# 加工した画像のうち、指定した大きさ以上で最も小さいもののURLを返す
+# 加工前の場合は元の画像のURLを返す
+def get_thumbnail_url(instance, field_name, size, image_format='webp'):
+    file = getattr(instance, field_name)
+    variants = getattr(instance, get_variants_field_name(field_name)) or {}
+    sizes = sorted(int(key) for key in variants if key != 'original')
+    if sizes:
+        key = next((str(value) for value in sizes if value >= size), 'original')
+        name = variants[key].get(image_format)
+        if name:
+            return file.storage.url(name)
+    return file.url if file else None
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.db.models import F
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+# 主キー（またはユニークなフィールド）でまとめてモデルを取得するDataLoader
+class ModelLoader(DataLoader):
+    def __init__(self, model, field_name='pk', **kwargs):
+        self.model = model
+        self.field_name = field_name
+        super().__init__(**kwargs)
+
+    def batch_load_fn(self, keys):
+        # IN (...) の1クエリで取得
+        objects = self.model._default_manager.in_bulk(
+            set(keys), field_name=self.field_name)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+# ManyToManyFieldの関連先を、元のモデルの主キーごとにまとめて取得するDataLoader
+class ManyToManyLoader(DataLoader):
+    def __init__(self, model, field_name, **kwargs):
+        self.field = model._meta.get_field(field_name)
+        super().__init__(**kwargs)
+
+    def batch_load_fn(self, keys):
+        query_name = self.field.related_query_name()
+        related_objects = self.field.related_model._default_manager.filter(
+            **{query_name + '__in': set(keys)}
+        ).annotate(_loader_key=F(query_name)).order_by('pk')
+
+        grouped = defaultdict(list)
+        for related_object in related_objects:
+            grouped[related_object._loader_key].append(related_object)
+        return Promise.resolve([grouped[key] for key in keys])
+
+
+# トークルームごとの参加者を {ユーザーID: 参加者} の形で1クエリで取得するDataLoader
+# 既読の位置と未読数の参照に使う
+class TalkRoomMembersLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        from .models import TalkRoomMember
+
+        grouped = defaultdict(dict)
+        for member in TalkRoomMember.objects.filter(talk_room_id__in=set(keys)):
+            grouped[member.talk_room_id][member.user_id] = member
+        return Promise.resolve([grouped[key] for key in keys])
+
+
+# リクエストごとにDataLoaderを保持する（キャッシュがリクエストをまたがないように）
+def get_loaders(info):
+    loaders = getattr(info.context, 'dataloaders', None)
+    if loaders is None:
+        loaders = {}
+        info.context.dataloaders = loaders
+    return loaders
+
+
+def get_model_loader(info, model, field_name='pk'):
+    loaders = get_loaders(info)
+    key = (model, field_name)
+    if key not in loaders:
+        loaders[key] = ModelLoader(model, field_name)
+    return loaders[key]
+
+
+def get_many_to_many_loader(info, model, field_name):
+    loaders = get_loaders(info)
+    key = (model, 'm2m:' + field_name)
+    if key not in loaders:
+        loaders[key] = ManyToManyLoader(model, field_name)
+    return loaders[key]
+
+
+def get_talk_room_members_loader(info):
+    loaders = get_loaders(info)
+    key = 'talk_room_members'
+    if key not in loaders:
+        loaders[key] = TalkRoomMembersLoader()
+    return loaders[key]
+
+
+# モデルインスタンスの関連フィールドをDataLoader経由で解決する
+def load_related(info, instance, field_name):
+    field = instance._meta.get_field(field_name)
+
+    if field.many_to_many:
+        # prefetch_related済みであればそのまま使う
+        prefetched = getattr(instance, '_prefetched_objects_cache', {})
+        if field_name in prefetched:
+            return list(prefetched[field_name])
+        return get_many_to_many_loader(
+            info, type(instance), field_name).load(instance.pk)
+
+    # 逆方向のOneToOne（User.target_user -> Profileなど）
+    if field.one_to_one and field.auto_created:
+        if field.is_cached(instance):
+            return getattr(instance, field.get_accessor_name(), None)
+        return get_model_loader(
+            info, field.related_model, field.field.attname).load(instance.pk)
+
+    # select_related済みであればそのまま使う
+    if field.is_cached(instance):
+        return getattr(instance, field_name)
+    key = getattr(instance, field.attname)
+    if key is None:
+        return None
+    return get_model_loader(info, field.related_model).load(key)
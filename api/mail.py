@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+# 再送までの待ち時間（秒）の基準値と上限。失敗するたびに2倍にする
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 60 * 60 * 6
+# 送信を諦めるまでの回数
+MAX_ATTEMPTS = 8
+
+
+# メールを送信待ちとして保存する（呼び出し元のトランザクションに含まれる）
+def queue_mail(subject, message, recipient_list, from_email=None,
+               html_message=None):
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        message=message,
+        html_message=html_message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipient_list=list(recipient_list),
+    )
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+                                 RETRY_MAX_SECONDS))
+
+
+# 送信時刻になった送信待ちのメールをまとめて送信し、送信できた件数を返す
+# SMTPの接続はバッチ全体で使い回す
+def send_queued_mail(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    sent = 0
+    with transaction.atomic():
+        # 複数のワーカーが同時に動いても同じメールを送信しないようにロックする
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, attempts__lt=max_attempts,
+                    next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if not emails:
+            return 0
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            for email in emails:
+                mark_failed(email, error)
+            return 0
+
+        try:
+            for email in emails:
+                message = EmailMultiAlternatives(
+                    subject=email.subject, body=email.message,
+                    from_email=email.from_email, to=email.recipient_list,
+                    connection=connection)
+                if email.html_message:
+                    message.attach_alternative(email.html_message, 'text/html')
+                try:
+                    message.send()
+                except Exception as error:
+                    mark_failed(email, error)
+                else:
+                    email.sent_at = timezone.now()
+                    email.attempts += 1
+                    email.save(update_fields=['sent_at', 'attempts'])
+                    sent += 1
+        finally:
+            connection.close()
+    return sent
+
+
+def mark_failed(email, error):
+    email.attempts += 1
+    email.next_attempt_at = timezone.now() + get_retry_delay(email.attempts)
+    email.last_error = repr(error)
+    email.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
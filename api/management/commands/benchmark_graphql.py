@@ -0,0 +1,72 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.benchmarks import (OPERATIONS, find_regressions, get_dataset_size,
+                            run_benchmarks)
+from harusmile.schema import schema
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# フロントエンドの操作をスキーマで実行して性能を計測する
+# 例: python manage.py benchmark_graphql --output benchmark.json --compare baseline.json
+class Command(BaseCommand):
+    help = 'GraphQLの主要な操作の実行時間・SQLの数・メモリ使用量を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--operation', action='append', dest='operations',
+                            choices=[operation['name'] for operation in OPERATIONS],
+                            help='計測する操作（複数指定可、省略時はすべて）')
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+        parser.add_argument('--compare', help='比較する基準の結果のJSONファイル')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='悪化とみなす割合（0.2なら20%%）')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmarks(schema, options['operations'],
+                                     options['iterations'], options['warmup'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('{:<28}{:>10}{:>10}{:>9}{:>12}'.format(
+            'operation', 'p50(ms)', 'p95(ms)', 'queries', 'memory(KB)'))
+        for name, result in results.items():
+            self.stdout.write('{:<28}{:>10}{:>10}{:>9}{:>12}'.format(
+                name, result['p50_ms'], result['p95_ms'], result['queries'],
+                result['peak_memory_kb']))
+
+        if options['output']:
+            report = {
+                'commit': get_git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'dataset': get_dataset_size(),
+                'operations': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = find_regressions(baseline, results, options['tolerance'])
+            for name, key, before, after in regressions:
+                self.stdout.write('{} の {} が悪化しました: {} -> {}'.format(
+                    name, key, before, after))
+            if regressions:
+                raise CommandError('基準の結果（{}）より悪化しています'.format(
+                    baseline.get('commit')))
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import OPERATIONS, run_throughput
+from harusmile.schema import schema
+
+
+# WSGI（同期のビュー）とASGI（非同期のビュー）で同じリクエストを処理し、スループットを比べる
+# 例: python manage.py benchmark_throughput --requests 500 --workers 4 --latency-ms 2
+class Command(BaseCommand):
+    help = 'WSGIとASGIでGraphQLのスループットを比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='WSGIの同期ワーカー数')
+        parser.add_argument('--orm-threads', type=int,
+                            help='ASGIでORMを実行するスレッド数（省略時はワーカー数と同じ）')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='ASGIで同時に受け付けるリクエスト数')
+        parser.add_argument('--latency-ms', type=float, default=0,
+                            help='SQLごとに加える待機時間（ネットワーク越しのDBを再現する）')
+        parser.add_argument('--operation', action='append', dest='operations',
+                            choices=[operation['name'] for operation in OPERATIONS])
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_throughput(
+                schema, options['operations'], options['requests'], options['workers'],
+                options['concurrency'], options['orm_threads'], options['latency_ms'] / 1000)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('{:<8}{:>12}{:>10}{:>10}'.format('mode', 'req/s', 'p50(ms)', 'p95(ms)'))
+        for mode, result in results.items():
+            self.stdout.write('{:<8}{:>12}{:>10}{:>10}'.format(
+                mode, result['requests_per_second'], result['p50_ms'], result['p95_ms']))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
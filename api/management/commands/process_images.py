@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.images import (MAX_ATTEMPTS, get_variants_field_name,
+                        process_queued_images)
+from api.models import ImageJob, Plan, Profile
+
+# 加工の対象になる画像のフィールド
+IMAGE_FIELDS = [(Profile, 'profile_image'), (Plan, 'plan_image')]
+
+
+# アップロードされた画像を加工するワーカー
+# python manage.py process_images --loop で常駐させる
+class Command(BaseCommand):
+    help = '加工待ちの画像からサムネイルを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true',
+                            help='終了せずに加工待ちの画像を監視し続ける')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='--loop時に加工待ちがなかった場合の待機秒数')
+        parser.add_argument('--backfill', action='store_true',
+                            help='まだ加工していない既存の画像を加工待ちにする')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill()
+        while True:
+            total = 0
+            while True:
+                processed = process_queued_images(options['batch_size'],
+                                                  options['max_attempts'])
+                total += processed
+                if processed < options['batch_size']:
+                    break
+            if total:
+                self.stdout.write('{}件の画像を加工しました'.format(total))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def backfill(self):
+        for model, field_name in IMAGE_FIELDS:
+            objects = model.objects.exclude(**{field_name: ''}).filter(
+                **{get_variants_field_name(field_name): {}}).values_list('id', field_name)
+            jobs = ImageJob.objects.bulk_create([
+                ImageJob(model_label=model._meta.label, object_id=object_id,
+                         field_name=field_name, source_name=name, source_pending=False)
+                for object_id, name in objects])
+            self.stdout.write('{}.{}: {}件を加工待ちにしました'.format(
+                model.__name__, field_name, len(jobs)))
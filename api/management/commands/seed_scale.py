@@ -0,0 +1,225 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.bulk import bulk_create
+from api.models import (Address, Gender, Message, Notification, Plan, Profile,
+                        Review, Tag, TalkRoom, TalkRoomMember, User)
+from api.response_cache import invalidate_model
+from api.search import rebuild_search_index, set_search_text
+
+PREFECTURES = [
+    '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
+    '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
+    '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
+    '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
+    '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
+    '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
+    '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県',
+]
+GENDERS = ['男性', '女性', 'その他']
+SCHOOLS = ['東京大学', '京都大学', '大阪大学', '早稲田大学', '慶應義塾大学',
+           '東北大学', '名古屋大学', '九州大学', '北海道大学', '神戸大学']
+UNDERGRADUATES = ['法学部', '経済学部', '文学部', '理学部', '工学部', '医学部', '教育学部']
+SUBJECTS = ['数学', '英語', '国語', '物理', '化学', '生物', '日本史', '世界史']
+CLUBS = ['サッカー部', 'テニスサークル', '軽音楽部', '写真部', 'ボランティアサークル']
+ADMISSIONS = ['一般入試', '推薦入試', 'AO入試']
+WORDS = ['受験', '勉強法', '相談', '大学生活', '志望校', '模試', '面接',
+         '小論文', '部活', '両立', '英検', '過去問', 'オンライン', '進路']
+NOTIFICATION_TYPES = ['message', 'review', 'follow', 'talk_room']
+
+
+# 大量のデータで性能を確認するためのデータを作成する
+# 例: python manage.py seed_scale --users 100000 --large-room-messages 10000
+class Command(BaseCommand):
+    help = '性能確認用の大量のデータを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='作成するユーザー数（半数が大学生）')
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--tags-per-profile', type=int, default=5)
+        parser.add_argument('--following-per-profile', type=int, default=5)
+        parser.add_argument('--plans-per-student', type=int, default=2)
+        parser.add_argument('--rooms-per-user', type=int, default=2,
+                            help='高校生1人あたりのトークルーム数')
+        parser.add_argument('--messages-per-room', type=int, default=20)
+        parser.add_argument('--large-rooms', type=int, default=1,
+                            help='メッセージの多いトークルームの数')
+        parser.add_argument('--large-room-messages', type=int, default=10000)
+        parser.add_argument('--reviews-per-student', type=int, default=5)
+        parser.add_argument('--notifications-per-user', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            self.seed(options)
+        # bulk_createではシグナルが送られないので、レスポンスのキャッシュを直接無効にする
+        for model in [User, Profile, Tag, Plan, TalkRoom, TalkRoomMember, Message, Review,
+                      Notification]:
+            invalidate_model(model)
+
+    def bulk_create(self, model, objects):
+        created = bulk_create(model, objects, batch_size=self.batch_size)
+        self.stdout.write('{}: {}件'.format(model.__name__, len(created)))
+        return created
+
+    # メッセージをバッチの件数ごとに保存する（引数なしで呼ぶと残りを保存する）
+    def add_message(self, message=None):
+        if message is not None:
+            self.messages.append(message)
+            if len(self.messages) < self.batch_size:
+                return
+        self.count += len(Message.objects.bulk_create(self.messages))
+        self.messages = []
+
+    def sentence(self, words=8):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def seed(self, options):
+        rand = self.random
+        addresses = [Address.objects.get_or_create(address_name=name)[0]
+                     for name in PREFECTURES]
+        genders = [Gender.objects.get_or_create(gender_name=name)[0] for name in GENDERS]
+        start = Tag.objects.count()
+        tags = self.bulk_create(Tag, [
+            Tag(tag_name='タグ{}'.format(start + i)) for i in range(options['tags'])])
+
+        # パスワードのハッシュ化は重いので全員同じものを使う
+        password = make_password('password')
+        start = User.objects.count()
+        users = self.bulk_create(User, [
+            User(email='scale{}@example.com'.format(start + i), password=password,
+                 is_active=True)
+            for i in range(options['users'])])
+        students = users[::2]
+        high_school_students = users[1::2]
+
+        profiles = []
+        for index, user in enumerate(users):
+            is_college_student = index % 2 == 0
+            profile = Profile(
+                target_user=user,
+                profile_name='ユーザー{}'.format(user.id),
+                profile_text=self.sentence(20),
+                is_college_student=is_college_student,
+                school_name=rand.choice(SCHOOLS) if is_college_student else '',
+                age=rand.randint(18, 24) if is_college_student else rand.randint(15, 18),
+                undergraduate=rand.choice(UNDERGRADUATES) if is_college_student else '',
+                club_activities=rand.choice(CLUBS),
+                admission_format=rand.choice(ADMISSIONS),
+                favorite_subject=rand.choice(SUBJECTS),
+                want_hear=self.sentence(),
+                problem=self.sentence(),
+                selected_address=rand.choice(addresses),
+                selected_gender=rand.choice(genders),
+            )
+            set_search_text(profile)
+            profiles.append(profile)
+        profiles = self.bulk_create(Profile, profiles)
+
+        tag_links = []
+        follow_links = []
+        for profile in profiles:
+            for tag in rand.sample(tags, min(options['tags_per_profile'], len(tags))):
+                tag_links.append(Profile.tags.through(profile_id=profile.id, tag_id=tag.id))
+            for user in rand.sample(users, min(options['following_per_profile'], len(users))):
+                follow_links.append(Profile.following_users.through(
+                    profile_id=profile.id, user_id=user.id))
+        self.bulk_create(Profile.tags.through, tag_links)
+        self.bulk_create(Profile.following_users.through, follow_links)
+
+        plans = []
+        for user in students:
+            for i in range(options['plans_per_student']):
+                plan = Plan(plan_author=user, title='{}の相談'.format(rand.choice(WORDS)),
+                            content=self.sentence(30), is_published=rand.random() < 0.8,
+                            price=rand.choice([0, 500, 1000, 3000]))
+                set_search_text(plan)
+                plans.append(plan)
+        plans = self.bulk_create(Plan, plans)
+        rebuild_search_index(Profile)
+        rebuild_search_index(Plan)
+        if not plans:
+            return
+
+        rooms = []
+        for user in high_school_students:
+            for plan in rand.sample(plans, min(options['rooms_per_user'], len(plans))):
+                rooms.append(TalkRoom(selected_plan=plan, opponent_user=user,
+                                      talk_room_description=self.sentence(4),
+                                      is_approve=rand.random() < 0.5))
+        rooms = self.bulk_create(TalkRoom, rooms)
+        # 作成したトークルームは連番なので範囲で指定する
+        seeded_rooms = TalkRoom.objects.none()
+        if rooms:
+            seeded_rooms = TalkRoom.objects.filter(id__range=(rooms[0].id, rooms[-1].id))
+        TalkRoom.add_members(seeded_rooms)
+
+        # メッセージは件数が多くなるので、バッチごとに保存する
+        # 各トークルームの最後の3件以外は既読にする
+        plan_authors = {plan.id: plan.plan_author_id for plan in plans}
+        self.count = 0
+        self.messages = []
+        unread = []
+        for index, room in enumerate(rooms):
+            total = options['messages_per_room']
+            if index < options['large_rooms']:
+                total = options['large_room_messages']
+            members = [plan_authors[room.selected_plan_id], room.opponent_user_id]
+            for i in range(total):
+                message = Message(
+                    talking_room=room, sender_id=members[i % 2],
+                    text=self.sentence(rand.randint(2, 12)))
+                if i < total - 3:
+                    self.add_message(message)
+                else:
+                    unread.append(message)
+        self.add_message()
+        TalkRoomMember.mark_read(TalkRoomMember.objects.filter(talk_room__in=seeded_rooms))
+        for message in unread:
+            self.add_message(message)
+        self.add_message()
+        self.stdout.write('Message: {}件'.format(self.count))
+        # bulk_createではトークルームの最後のメッセージと未読数が更新されないので設定し直す
+        TalkRoom.refresh_last_message(seeded_rooms)
+        TalkRoomMember.refresh_unread_counts(
+            TalkRoomMember.objects.filter(talk_room__in=seeded_rooms))
+
+        reviews = []
+        ratings = {}
+        for user in students:
+            for customer in rand.sample(high_school_students,
+                                        min(options['reviews_per_student'],
+                                            len(high_school_students))):
+                stars = rand.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 5, 6])[0]
+                reviews.append(Review(provider=user, customer=customer,
+                                      review_text=self.sentence(), stars=stars))
+                ratings.setdefault(user.id, []).append(stars)
+        self.bulk_create(Review, reviews)
+
+        # レビューの集計を反映する
+        rated_profiles = []
+        for profile in profiles:
+            stars = ratings.get(profile.target_user_id)
+            if not stars:
+                continue
+            profile.review_count = len(stars)
+            profile.stars_sum = sum(stars)
+            profile.average_stars = profile.stars_sum / profile.review_count
+            for value in range(1, 6):
+                setattr(profile, 'stars_{}_count'.format(value), stars.count(value))
+            rated_profiles.append(profile)
+        Profile.objects.bulk_update(
+            rated_profiles, Profile.rating_fields, batch_size=self.batch_size)
+
+        self.bulk_create(Notification, [
+            Notification(notificator=rand.choice(users), receiver=user,
+                         notification_type=rand.choice(NOTIFICATION_TYPES),
+                         is_checked=rand.random() < 0.7)
+            for user in users for _ in range(options['notifications_per_user'])])
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.mail import MAX_ATTEMPTS, send_queued_mail
+
+
+# 送信待ちのメールを送信するワーカー
+# python manage.py send_queued_mail --loop で常駐させる
+class Command(BaseCommand):
+    help = '送信待ちのメールをまとめて送信します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true',
+                            help='終了せずに送信待ちのメールを監視し続ける')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='--loop時に送信待ちがなかった場合の待機秒数')
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                sent = send_queued_mail(options['batch_size'],
+                                        options['max_attempts'])
+                total += sent
+                if sent < options['batch_size']:
+                    break
+            if total:
+                self.stdout.write('{}件のメールを送信しました'.format(total))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.7 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_message_is_viewed'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['talking_room', 'created_at', 'id'], name='message_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_viewed', False)), fields=['talking_room', 'sender'], name='message_room_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['receiver', 'created_at', 'id'], name='notification_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_checked', False)), fields=['receiver', 'created_at'], name='notification_unchecked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plan',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['published_at', 'id'], name='plan_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('is_college_student', True)), fields=['id'], name='profile_college_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('is_college_student', False)), fields=['id'], name='profile_high_school_idx'),
+        ),
+    ]
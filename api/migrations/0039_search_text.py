@@ -0,0 +1,89 @@
+# Generated by Django 3.2.7 on 2026-10-18 09:52
+
+import unicodedata
+
+from django.db import migrations, models
+
+PROFILE_SEARCH_FIELDS = [
+    'profile_name', 'profile_text', 'school_name', 'undergraduate',
+    'department', 'club_activities', 'admission_format',
+    'favorite_subject', 'want_hear', 'problem',
+]
+PLAN_SEARCH_FIELDS = ['title', 'content']
+
+SEARCH_TABLES = ['api_profile', 'api_plan']
+
+# 検索用の文字列の作り方はこのマイグレーションの時点のものを使う（api.searchの変更の影響を受けない）
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def build_search_text(instance, field_names):
+    values = [getattr(instance, field_name) for field_name in field_names]
+    text = unicodedata.normalize('NFKC', ' '.join(value for value in values if value))
+    return text.translate(KATAKANA_TO_HIRAGANA).lower()
+
+
+# 既存のデータの検索用文字列を設定する
+def fill_search_text(apps, schema_editor):
+    for model_name, field_names in [('Profile', PROFILE_SEARCH_FIELDS),
+                                    ('Plan', PLAN_SEARCH_FIELDS)]:
+        model = apps.get_model('api', model_name)
+        instances = list(model.objects.all())
+        for instance in instances:
+            instance.search_text = build_search_text(instance, field_names)
+        model.objects.bulk_update(instances, ['search_text'], batch_size=500)
+
+
+# PostgreSQL: tsvectorとpg_trgmのGINインデックス
+# SQLite: FTS5（trigramトークナイザー）の仮想テーブル
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(
+                "CREATE INDEX {0}_search_tsv_idx ON {0} USING gin "
+                "(to_tsvector('simple'::regconfig, COALESCE(search_text, ''::text)))".format(table))
+            schema_editor.execute(
+                'CREATE INDEX {0}_search_trgm_idx ON {0} USING gin '
+                '(search_text gin_trgm_ops)'.format(table))
+        elif vendor == 'sqlite':
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE {0}_fts USING fts5(search_text, tokenize='trigram')".format(table))
+            schema_editor.execute(
+                'INSERT INTO {0}_fts (rowid, search_text) '
+                'SELECT id, search_text FROM {0}'.format(table))
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                'DROP INDEX IF EXISTS {0}_search_tsv_idx'.format(table))
+            schema_editor.execute(
+                'DROP INDEX IF EXISTS {0}_search_trgm_idx'.format(table))
+        elif vendor == 'sqlite':
+            schema_editor.execute('DROP TABLE IF EXISTS {0}_fts'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 3.2.7 on 2026-10-18 09:55
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# 既存のレビューからプロフィールの評価の集計を作る
+def fill_rating(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Review = apps.get_model('api', 'Review')
+    ratings = {}
+    for row in Review.objects.values('provider', 'stars').annotate(
+            count=Count('id'), total=Sum('stars')):
+        rating = ratings.setdefault(row['provider'], {'review_count': 0, 'stars_sum': 0})
+        rating['review_count'] += row['count']
+        rating['stars_sum'] += row['total']
+        if 1 <= row['stars'] <= 5:
+            rating['stars_{}_count'.format(row['stars'])] = row['count']
+
+    profiles = list(Profile.objects.filter(target_user__in=ratings))
+    fields = ['review_count', 'stars_sum', 'average_stars'] + [
+        'stars_{}_count'.format(stars) for stars in range(1, 6)]
+    for profile in profiles:
+        rating = ratings[profile.target_user_id]
+        for field in fields:
+            setattr(profile, field, rating.get(field, 0))
+        profile.average_stars = rating['stars_sum'] / rating['review_count']
+    Profile.objects.bulk_update(profiles, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='average_stars',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='stars_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('is_college_student', True)), fields=['-average_stars', 'id'], name='profile_college_rating_idx'),
+        ),
+        migrations.RunPython(fill_rating, migrations.RunPython.noop),
+    ]
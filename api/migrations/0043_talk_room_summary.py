@@ -0,0 +1,79 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+
+# 既存のメッセージからトークルームの最後のメッセージと未読数を設定する
+def fill_summary(apps, schema_editor):
+    TalkRoom = apps.get_model('api', 'TalkRoom')
+    Message = apps.get_model('api', 'Message')
+    last = Message.objects.filter(talking_room=OuterRef('pk')).order_by('-created_at', '-id')
+    unread = Message.objects.filter(talking_room=OuterRef('pk'), is_viewed=False).order_by()
+
+    def count(messages):
+        return Coalesce(Subquery(
+            messages.values('talking_room').annotate(count=Count('id')).values('count')), 0)
+
+    TalkRoom.objects.update(
+        last_activity_at=Coalesce(Subquery(last.values('created_at')[:1]), 'last_activity_at'),
+        last_message_at=Subquery(last.values('created_at')[:1]),
+        last_message_preview=Coalesce(
+            Substr(Subquery(last.values('text')[:1]), 1, 100), Value('')),
+        last_sender=Subquery(last.values('sender')[:1]),
+        author_unread_count=count(unread.filter(sender=OuterRef('opponent_user'))),
+        opponent_unread_count=count(unread.exclude(sender=OuterRef('opponent_user'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_image_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='talkroom',
+            name='author_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='talkroom',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='talkroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='talkroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='talkroom',
+            name='last_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='last_sent_talk_rooms', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='talkroom',
+            name='opponent_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='talkroom',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='talk_room_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='talkroom',
+            index=models.Index(fields=['opponent_user', '-last_activity_at', '-id'], name='talk_room_opponent_idx'),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
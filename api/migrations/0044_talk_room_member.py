@@ -0,0 +1,40 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# 既存のトークルームのプランの作成者と相手のユーザーを参加者として登録する
+def fill_members(apps, schema_editor):
+    TalkRoom = apps.get_model('api', 'TalkRoom')
+    TalkRoomMember = apps.get_model('api', 'TalkRoomMember')
+    members = []
+    for talk_room_id, *user_ids in TalkRoom.objects.values_list(
+            'id', 'selected_plan__plan_author', 'opponent_user').iterator():
+        members.extend(TalkRoomMember(talk_room_id=talk_room_id, user_id=user_id)
+                       for user_id in set(user_ids) if user_id is not None)
+    TalkRoomMember.objects.bulk_create(members, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_talk_room_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TalkRoomMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('talk_room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='api.talkroom')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='talk_room_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='talkroommember',
+            constraint=models.UniqueConstraint(fields=('user', 'talk_room'), name='talk_room_member_unique'),
+        ),
+        migrations.RunPython(fill_members, migrations.RunPython.noop),
+    ]
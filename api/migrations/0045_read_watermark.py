@@ -0,0 +1,65 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# メッセージごとの既読フラグから参加者ごとの既読の位置と未読数を設定する
+# 相手から送られた既読のメッセージのうち最後のものを既読の位置にする
+def fill_read_watermarks(apps, schema_editor):
+    TalkRoomMember = apps.get_model('api', 'TalkRoomMember')
+    Message = apps.get_model('api', 'Message')
+    received = Message.objects.filter(talking_room=OuterRef('talk_room')).exclude(
+        sender=OuterRef('user')).order_by()
+    TalkRoomMember.objects.update(last_read_message_id=Coalesce(Subquery(
+        received.filter(is_viewed=True).order_by('-id').values('id')[:1]), 0))
+    TalkRoomMember.objects.update(unread_count=Coalesce(Subquery(
+        received.filter(id__gt=OuterRef('last_read_message_id'))
+        .values('talking_room').annotate(count=Count('id')).values('count')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_talk_room_member'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='talkroommember',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='talkroommember',
+            name='last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='talkroommember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['talking_room', 'id'], name='message_room_id_idx'),
+        ),
+        migrations.RunPython(fill_read_watermarks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_room_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_viewed',
+        ),
+        migrations.RemoveField(
+            model_name='talkroom',
+            name='author_unread_count',
+        ),
+        migrations.RemoveField(
+            model_name='talkroom',
+            name='opponent_unread_count',
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.7 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+SEARCH_TABLES = ['api_profile', 'api_plan']
+
+
+# bigramの作り方はこのマイグレーションの時点のものを使う（api.searchの変更の影響を受けない）
+def build_search_bigrams(search_text):
+    bigrams = {}
+    for word in search_text.split():
+        for index in range(len(word) - 1):
+            bigrams[word[index:index + 2]] = None
+    return ' '.join(bigrams)
+
+
+# 既存のデータの検索用bigramを設定する
+def fill_search_bigrams(apps, schema_editor):
+    for model_name in ['Profile', 'Plan']:
+        model = apps.get_model('api', model_name)
+        instances = list(model.objects.all())
+        for instance in instances:
+            instance.search_bigrams = build_search_bigrams(instance.search_text)
+        model.objects.bulk_update(instances, ['search_bigrams'], batch_size=500)
+
+
+# PostgreSQL: bigramのtsvectorのGINインデックス
+# SQLite: FTS5（unicode61トークナイザーでスペース区切りのbigramを1語として扱う）の仮想テーブル
+def create_bigram_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                "CREATE INDEX {0}_search_bigram_idx ON {0} USING gin "
+                "(to_tsvector('simple'::regconfig, COALESCE(search_bigrams, ''::text)))".format(table))
+        elif vendor == 'sqlite':
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE {0}_bigram_fts USING fts5(search_bigrams, tokenize='unicode61')".format(table))
+            schema_editor.execute(
+                'INSERT INTO {0}_bigram_fts (rowid, search_bigrams) '
+                'SELECT id, search_bigrams FROM {0}'.format(table))
+
+
+def drop_bigram_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                'DROP INDEX IF EXISTS {0}_search_bigram_idx'.format(table))
+        elif vendor == 'sqlite':
+            schema_editor.execute('DROP TABLE IF EXISTS {0}_bigram_fts'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_read_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='search_bigrams',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='search_bigrams',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_bigrams, migrations.RunPython.noop),
+        migrations.RunPython(create_bigram_indexes, drop_bigram_indexes),
+    ]
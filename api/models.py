@@ -4,6 +4,10 @@ from django.conf import settings
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest, Substr
+from django.utils import timezone
+
+from .search import set_search_text
 
 # Create your models here.
 
@@ -99,6 +103,8 @@ class Profile(models.Model):
     # プロフィール画像
     profile_image = models.ImageField(
         blank=True, null=True, upload_to=upload_avatar_path)
+    # 加工したプロフィール画像（サムネイル、WebP）のファイル名（manage.py process_images で設定）
+    profile_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     # 年齢
     age = models.PositiveSmallIntegerField(default=0, blank=True, null=True)
 
@@ -135,10 +141,67 @@ class Profile(models.Model):
     )
     tags = models.ManyToManyField(
         Tag, related_name='tags', blank=True, default=[])
+    # 全文検索用に正規化した文字列と、2文字の語の検索用のbigram（保存時に自動で設定）
+    search_text = models.TextField(default='', blank=True, editable=False)
+    search_bigrams = models.TextField(default='', blank=True, editable=False)
+
+    # 受け取ったレビューの集計（レビュー作成時に更新）
+    rating_fields = ['review_count', 'stars_sum', 'average_stars'] + [
+        'stars_{}_count'.format(stars) for stars in range(1, 6)]
+    review_count = models.PositiveIntegerField(default=0)
+    stars_sum = models.PositiveIntegerField(default=0)
+    average_stars = models.FloatField(default=0)
+    # 星の数ごとの件数
+    stars_1_count = models.PositiveIntegerField(default=0)
+    stars_2_count = models.PositiveIntegerField(default=0)
+    stars_3_count = models.PositiveIntegerField(default=0)
+    stars_4_count = models.PositiveIntegerField(default=0)
+    stars_5_count = models.PositiveIntegerField(default=0)
+
+    # 全文検索の対象にするフィールド
+    search_fields = [
+        'profile_name', 'profile_text', 'school_name', 'undergraduate',
+        'department', 'club_activities', 'admission_format',
+        'favorite_subject', 'want_hear', 'problem',
+    ]
+
+    class Meta:
+        indexes = [
+            # 大学生・高校生ごとのプロフィール一覧（collegeProfiles, highSchoolProfiles）
+            models.Index(fields=['id'],
+                         condition=models.Q(is_college_student=True),
+                         name='profile_college_idx'),
+            models.Index(fields=['id'],
+                         condition=models.Q(is_college_student=False),
+                         name='profile_high_school_idx'),
+            # 評価の高い順の大学生一覧
+            models.Index(fields=['-average_stars', 'id'],
+                         condition=models.Q(is_college_student=True),
+                         name='profile_college_rating_idx'),
+        ]
 
     def __str__(self):
         return self.profile_name
 
+    def save(self, *args, **kwargs):
+        set_search_text(self)
+        super().save(*args, **kwargs)
+
+    # レビューの集計に1件分を加える（UPDATE文1回で加算するので同時に作成されても正しく集計される）
+    @classmethod
+    def add_review_stars(cls, user_id, stars):
+        if not 1 <= stars <= 5:
+            raise ValueError('stars must be between 1 and 5')
+        histogram_field = 'stars_{}_count'.format(stars)
+        cls.objects.filter(target_user_id=user_id).update(**{
+            'review_count': models.F('review_count') + 1,
+            'stars_sum': models.F('stars_sum') + stars,
+            'average_stars': models.ExpressionWrapper(
+                (models.F('stars_sum') + stars) * 1.0 / (models.F('review_count') + 1),
+                output_field=models.FloatField()),
+            histogram_field: models.F(histogram_field) + 1,
+        })
+
 
 # プランモデル
 class Plan(models.Model):
@@ -151,6 +214,8 @@ class Plan(models.Model):
     content = models.CharField(max_length=1000)
     plan_image = models.ImageField(
         blank=True, null=True, upload_to=upload_plan_path)
+    # 加工したプランの画像（サムネイル、WebP）のファイル名
+    plan_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     # 公開フラグ
     is_published = models.BooleanField(default=False)
     # 公開日時
@@ -159,10 +224,28 @@ class Plan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # プランの料金
     price = models.PositiveSmallIntegerField(default=0)
+    # 全文検索用に正規化した文字列と、2文字の語の検索用のbigram（保存時に自動で設定）
+    search_text = models.TextField(default='', blank=True, editable=False)
+    search_bigrams = models.TextField(default='', blank=True, editable=False)
+
+    # 全文検索の対象にするフィールド
+    search_fields = ['title', 'content']
+
+    class Meta:
+        indexes = [
+            # 公開中のプラン一覧
+            models.Index(fields=['published_at', 'id'],
+                         condition=models.Q(is_published=True),
+                         name='plan_published_idx'),
+        ]
 
     def __str__(self):
         return self.plan_author.email + ' のプラン名 ' + self.title
 
+    def save(self, *args, **kwargs):
+        set_search_text(self)
+        super().save(*args, **kwargs)
+
 
 # レビュー（ユーザーに対して）
 class Review(models.Model):
@@ -204,6 +287,17 @@ class Notification(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # 受け取った通知を新しい順に取得する
+            models.Index(fields=['receiver', 'created_at', 'id'],
+                         name='notification_receiver_idx'),
+            # 未確認の通知のみを対象にした部分インデックス
+            models.Index(fields=['receiver', 'created_at'],
+                         condition=models.Q(is_checked=False),
+                         name='notification_unchecked_idx'),
+        ]
+
     def __str__(self):
         return self.notificator.email + ' から ' + self.receiver.email + 'へ'
 
@@ -233,9 +327,133 @@ class TalkRoom(models.Model):
     # 承認フラグ
     is_approve = models.BooleanField(default=False)
 
+    # 最後にやりとりした日時（トークルームの一覧の並び替えに使う。メッセージがなければ作成日時）
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # 最後のメッセージ（トークルームの一覧の表示に使う）
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    last_message_preview = models.CharField(max_length=100, default='', blank=True)
+    last_sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='last_sent_talk_rooms',
+        on_delete=models.SET_NULL, blank=True, null=True
+    )
+    # 最近やりとりした順
+    activity_ordering = ['-last_activity_at', '-id']
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_activity_at', '-id'],
+                         name='talk_room_activity_idx'),
+            models.Index(fields=['opponent_user', '-last_activity_at', '-id'],
+                         name='talk_room_opponent_idx'),
+        ]
+
     def __str__(self):
         return str(self.talk_room_description)
 
+    # メッセージの送信をトークルームの最後のメッセージと、送信者以外の参加者の未読数に反映する
+    # 同時に送信された場合などに、後から反映した古いメッセージで最後のメッセージを戻さない
+    @classmethod
+    def add_message(cls, message):
+        cls.objects.filter(
+            models.Q(last_message_at__isnull=True)
+            | models.Q(last_message_at__lte=message.created_at),
+            pk=message.talking_room_id,
+        ).update(
+            last_activity_at=message.created_at,
+            last_message_at=message.created_at,
+            last_message_preview=message.text[:100],
+            last_sender=message.sender_id,
+        )
+        TalkRoomMember.objects.filter(talk_room=message.talking_room_id).exclude(
+            user=message.sender_id).update(unread_count=models.F('unread_count') + 1)
+
+    # 最後のメッセージをメッセージから設定し直す（まとめて作成した場合に使う）
+    @classmethod
+    def refresh_last_message(cls, queryset):
+        last = Message.objects.filter(
+            talking_room=models.OuterRef('pk')).order_by('-created_at', '-id')
+        queryset.update(
+            last_activity_at=Coalesce(
+                models.Subquery(last.values('created_at')[:1]), 'last_activity_at'),
+            last_message_at=models.Subquery(last.values('created_at')[:1]),
+            last_message_preview=Coalesce(
+                Substr(models.Subquery(last.values('text')[:1]), 1, 100),
+                models.Value('')),
+            last_sender=models.Subquery(last.values('sender')[:1]),
+        )
+
+    # 参加者（プランの作成者と相手のユーザー）を登録する（登録済みの参加者は無視する）
+    @classmethod
+    def add_members(cls, queryset):
+        members = []
+        for talk_room_id, *user_ids in queryset.values_list(
+                'id', 'selected_plan__plan_author', 'opponent_user'):
+            members.extend(TalkRoomMember(talk_room_id=talk_room_id, user_id=user_id)
+                           for user_id in set(user_ids) if user_id is not None)
+        TalkRoomMember.objects.bulk_create(members, ignore_conflicts=True)
+
+
+# トークルームの参加者
+# 「自分が参加しているトークルーム」をユーザーのインデックスの範囲で取得するためのテーブル
+class TalkRoomMember(models.Model):
+    id = models.BigAutoField(auto_created=True, primary_key=True)
+    talk_room = models.ForeignKey(
+        TalkRoom, related_name='members', on_delete=models.CASCADE
+    )
+    # (user, talk_room) の一意制約のインデックスを使うので、userだけのインデックスは作らない
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='talk_room_memberships',
+        on_delete=models.CASCADE, db_index=False
+    )
+    # 既読の位置（このIDまでのメッセージを読んだ）と既読にした日時
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(blank=True, null=True)
+    # 未読メッセージ数（既読の位置より後に、自分以外が送信したメッセージの数）
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'talk_room'],
+                                    name='talk_room_member_unique'),
+        ]
+
+    def __str__(self):
+        return str(self.user) + ' : ' + str(self.talk_room)
+
+    def has_read(self, message):
+        return message.id <= self.last_read_message_id
+
+    # 既読の位置を進める（既読の位置は戻さない）
+    # message_ids を指定しなければ、トークルームの最後のメッセージまで既読にし、更新した行数を返す
+    # message_ids を指定した場合は、既読の位置が進んだ行のみ更新し、その行数を返す
+    @classmethod
+    def mark_read(cls, queryset, message_ids=None):
+        messages = Message.objects.filter(talking_room=models.OuterRef('talk_room')).exclude(
+            sender=models.OuterRef('user'))
+        if message_ids is None:
+            last_read = Greatest('last_read_message_id', Coalesce(
+                models.Subquery(messages.order_by('-id').values('id')[:1]), 0))
+            # 相手のメッセージをすべて読んだので、未読数も同じUPDATEで0にする
+            return queryset.update(last_read_message_id=last_read, last_read_at=timezone.now(),
+                                   unread_count=0)
+        last_read = models.Subquery(
+            messages.filter(id__in=message_ids).order_by('-id').values('id')[:1])
+        updated = queryset.filter(last_read_message_id__lt=last_read).update(
+            last_read_message_id=last_read, last_read_at=timezone.now())
+        cls.refresh_unread_counts(queryset)
+        return updated
+
+    # 未読数を既読の位置からメッセージを数えて設定し直す
+    @classmethod
+    def refresh_unread_counts(cls, queryset):
+        unread = Message.objects.filter(
+            talking_room=models.OuterRef('talk_room'),
+            id__gt=models.OuterRef('last_read_message_id'),
+        ).exclude(sender=models.OuterRef('user')).order_by()
+        queryset.update(unread_count=Coalesce(models.Subquery(
+            unread.values('talking_room').annotate(count=models.Count('id'))
+            .values('count')), 0))
+
 
 # メッセージ
 class Message(models.Model):
@@ -250,9 +468,76 @@ class Message(models.Model):
     )
     # 内容
     text = models.CharField(max_length=1000)
-    is_viewed = models.BooleanField(default=False)
-    # 相手がメッセージを確認したかどうか
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # トークルーム内のメッセージを送信日時順に取得する
+            models.Index(fields=['talking_room', 'created_at', 'id'],
+                         name='message_room_created_idx'),
+            # 既読の位置より後のメッセージを数える・最後のメッセージを取得する
+            models.Index(fields=['talking_room', 'id'],
+                         name='message_room_id_idx'),
+        ]
+
     def __str__(self):
         return self.sender.target_user.profile_name + ' から ' + '"' + self.text + '"'
+
+
+# 送信待ちのメール（アウトボックス）
+# リクエスト内では保存のみ行い、manage.py send_queued_mail でまとめて送信する
+class OutgoingEmail(models.Model):
+    subject = models.CharField(max_length=200)
+    message = models.TextField()
+    html_message = models.TextField(blank=True, null=True)
+    from_email = models.CharField(max_length=200)
+    recipient_list = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 送信日時（未送信の場合はnull）
+    sent_at = models.DateTimeField(blank=True, null=True)
+    # 送信を試みた回数と次に送信を試みる日時
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # 送信待ちのメールを送信予定順に取得する
+            models.Index(fields=['next_attempt_at', 'id'],
+                         condition=models.Q(sent_at__isnull=True),
+                         name='outgoing_email_pending_idx'),
+        ]
+
+    def __str__(self):
+        return ', '.join(self.recipient_list) + ' へ ' + self.subject
+
+
+# 画像の加工待ち
+# リクエスト内では元の画像を一時保存するのみで、manage.py process_images で加工して設定する
+class ImageJob(models.Model):
+    # 加工した画像を設定するモデル（例: api.Profile）とフィールド
+    model_label = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    field_name = models.CharField(max_length=50)
+    # 元の画像のファイル名
+    source_name = models.CharField(max_length=255)
+    # 元の画像が一時保存用のストレージにあるか（既存の画像を加工し直す場合はFalse）
+    source_pending = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 加工が完了した日時（未完了の場合はnull）
+    processed_at = models.DateTimeField(blank=True, null=True)
+    # 加工を試みた回数と次に試みる日時
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # 加工待ちの画像を予定順に取得する
+            models.Index(fields=['next_attempt_at', 'id'],
+                         condition=models.Q(processed_at__isnull=True),
+                         name='image_job_pending_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {} の {}'.format(self.model_label, self.object_id, self.field_name)
@@ -0,0 +1,133 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.query import QuerySet
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.registry import get_global_registry
+from graphql.language.ast import Field, FragmentSpread, InlineFragment
+
+
+# フラグメントを展開して、選択されているフィールドのASTを列挙する
+def get_selected_fields(selection_set, fragments):
+    fields = []
+    if selection_set is None:
+        return fields
+    for selection in selection_set.selections:
+        if isinstance(selection, Field):
+            fields.append(selection)
+        elif isinstance(selection, FragmentSpread):
+            fragment = fragments[selection.name.value]
+            fields.extend(get_selected_fields(
+                fragment.selection_set, fragments))
+        elif isinstance(selection, InlineFragment):
+            fields.extend(get_selected_fields(
+                selection.selection_set, fragments))
+    return fields
+
+
+# connectionの edges { node { ... } } で選択されているフィールドを列挙する
+def get_node_fields(field_asts, fragments):
+    fields = []
+    for field_ast in field_asts:
+        for edges in get_selected_fields(field_ast.selection_set, fragments):
+            if edges.name.value != 'edges':
+                continue
+            for node in get_selected_fields(edges.selection_set, fragments):
+                if node.name.value == 'node':
+                    fields.extend(get_selected_fields(
+                        node.selection_set, fragments))
+    return fields
+
+
+# 同じフィールドが複数回選択されている場合（フラグメントの重複など）にまとめる
+def group_by_name(field_asts):
+    grouped = {}
+    for field_ast in field_asts:
+        grouped.setdefault(field_ast.name.value, []).append(field_ast)
+    return grouped
+
+
+# DjangoObjectTypeに optimizer_hints = {'フィールド名': ['必要なカラム', ...]} があれば
+# モデルのフィールドに対応しない項目が必要とするカラムとして使う
+def get_optimizer_hints(model):
+    node_type = get_global_registry().get_type_for_model(model)
+    return getattr(node_type, 'optimizer_hints', {})
+
+
+# 選択されたフィールドから、select_related/prefetch_relatedと
+# only()で読み込むカラムを集める
+def collect_lookups(model, field_asts, fragments, prefix=''):
+    select_related = []
+    prefetch_related = []
+    only_fields = []
+    # モデルのフィールドに対応しない項目が選択されていれば、そのモデルは全カラムを読み込む
+    prunable = True
+    hints = get_optimizer_hints(model)
+
+    for name, asts in group_by_name(field_asts).items():
+        if name == '__typename':
+            continue
+        try:
+            model_field = model._meta.get_field(to_snake_case(name))
+        except FieldDoesNotExist:
+            if to_snake_case(name) in hints:
+                only_fields.extend(
+                    prefix + field_name for field_name in hints[to_snake_case(name)])
+            else:
+                prunable = False
+            continue
+
+        path = prefix + model_field.name
+        if not model_field.is_relation:
+            only_fields.append(path)
+        elif model_field.many_to_many and not model_field.auto_created:
+            # ManyToManyFieldはconnectionとして公開されているので、関連先も最適化して先読みする
+            queryset = optimize_queryset(
+                model_field.related_model._default_manager.all(),
+                get_node_fields(asts, fragments), fragments)
+            prefetch_related.append(Prefetch(path, queryset=queryset))
+        elif model_field.many_to_one or model_field.one_to_one:
+            select_related.append(path)
+            only_fields.append(path)
+            if model_field.auto_created:
+                # 逆方向のOneToOneは関連先の外部キーも必要
+                only_fields.append(path + '__' + model_field.field.name)
+            children = []
+            for field_ast in asts:
+                children.extend(get_selected_fields(
+                    field_ast.selection_set, fragments))
+            child_select, child_prefetch, child_only = collect_lookups(
+                model_field.related_model, children, fragments,
+                prefix=path + '__')
+            select_related.extend(child_select)
+            prefetch_related.extend(child_prefetch)
+            only_fields.extend(child_only)
+        # 逆方向の外部キーはフィルター付きのconnectionなので対象外
+
+    if prunable:
+        only_fields.append(prefix + model._meta.pk.name)
+    else:
+        only_fields.extend(
+            prefix + field.name for field in model._meta.concrete_fields)
+    return select_related, prefetch_related, only_fields
+
+
+# 選択されたフィールドに合わせてクエリセットを最適化する
+# extra_fieldsには並び替えなど、選択されていなくても必要なカラムを指定する
+def optimize_queryset(queryset, field_asts, fragments, extra_fields=()):
+    select_related, prefetch_related, only_fields = collect_lookups(
+        queryset.model, field_asts, fragments)
+    only_fields.extend(extra_fields)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset.only(*only_fields)
+
+
+# GraphQLのconnectionで選択されているフィールドに合わせてクエリセットを最適化する
+def optimize_connection_queryset(queryset, info, extra_fields=()):
+    if not isinstance(queryset, QuerySet):
+        return queryset
+    node_fields = get_node_fields(info.field_asts, info.fragments)
+    return optimize_queryset(queryset, node_fields, info.fragments, extra_fields)
@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .documents import get_document_hash
+
+# Apolloの自動永続化クエリ（Automatic Persisted Queries）
+# クライアントはクエリ本文の代わりに extensions.persistedQuery.sha256Hash を送る
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+PERSISTED_QUERY_NOT_SUPPORTED = 'PersistedQueryNotSupported'
+
+
+class PersistedQueryError(Exception):
+    pass
+
+
+_manifest = None
+
+
+# フロントエンドのビルド時に出力した {sha256: クエリ} のJSON
+# （settings.GRAPHQL_PERSISTED_QUERIES_FILE）
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        path = getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_FILE', None)
+        if path:
+            with open(path, encoding='utf-8') as f:
+                _manifest = json.load(f)
+        else:
+            _manifest = {}
+    return _manifest
+
+
+# 本番用の設定。マニフェストに登録されたクエリ以外は実行しない
+def is_persisted_only():
+    return getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_ONLY', False)
+
+
+def get_query_cache():
+    return caches[getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_persisted_query(sha256_hash):
+    query = get_manifest().get(sha256_hash)
+    if query is None and not is_persisted_only():
+        query = get_query_cache().get('graphql-apq:' + sha256_hash)
+    return query
+
+
+# リクエストのクエリ本文と extensions から実行するクエリを決める
+def resolve_persisted_query(query, extensions):
+    persisted = (extensions or {}).get('persistedQuery')
+    if not persisted:
+        if query and is_persisted_only() and get_document_hash(query) not in get_manifest():
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_SUPPORTED)
+        return query
+
+    sha256_hash = persisted.get('sha256Hash') or ''
+    if persisted.get('version') != 1:
+        raise PersistedQueryError(PERSISTED_QUERY_NOT_SUPPORTED)
+
+    if not query:
+        query = get_persisted_query(sha256_hash)
+        if query is None:
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_FOUND)
+        return query
+
+    # クエリ本文付きで送られた場合はハッシュを確認して登録する
+    if get_document_hash(query) != sha256_hash:
+        raise PersistedQueryError('provided sha does not match query')
+    if is_persisted_only():
+        if sha256_hash not in get_manifest():
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_SUPPORTED)
+    else:
+        get_query_cache().set('graphql-apq:' + sha256_hash, query, timeout=None)
+    return query
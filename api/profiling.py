@@ -0,0 +1,117 @@
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger('api.graphql')
+
+# 同じSQLが1つのフィールドでこの回数以上実行されたらN+1として報告する
+N_PLUS_ONE_THRESHOLD = 5
+# ログに出力する時間のかかったフィールドの数
+SLOWEST_PATHS = 10
+# このヘッダーがあれば計測結果をレスポンスの extensions でも返す
+DEBUG_HEADER = 'HTTP_X_GRAPHQL_PROFILE'
+
+
+# extensionsで計測結果を返してよいリクエストか（開発環境かスタッフのみ）
+def is_debug_requested(request):
+    if not request.META.get(DEBUG_HEADER):
+        return False
+    return settings.DEBUG or getattr(request.user, 'is_staff', False)
+
+
+def should_profile(request):
+    if is_debug_requested(request):
+        return True
+    rate = getattr(settings, 'GRAPHQL_PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+# 1リクエスト分のリゾルバーごとの時間とSQLを集計する
+# connection.execute_wrapper() に渡してSQLの実行を記録する
+class QueryProfiler:
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.started_at = time.perf_counter()
+        self.paths = defaultdict(lambda: {
+            'calls': 0, 'time': 0.0, 'queries': 0, 'query_time': 0.0})
+        self.sql_counts = defaultdict(int)
+        self.current_paths = []
+        self.queries = 0
+        self.query_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started_at
+            # DataLoaderがまとめて実行するSQLなど、リゾルバーの外で実行されたもの
+            path = self.current_paths[-1] if self.current_paths else '(deferred)'
+            stats = self.paths[path]
+            stats['queries'] += 1
+            stats['query_time'] += duration
+            self.sql_counts[(path, sql)] += 1
+            self.queries += 1
+            self.query_time += duration
+
+    def enter(self, path):
+        self.current_paths.append(path)
+        return time.perf_counter()
+
+    def leave(self, path, started_at):
+        self.current_paths.pop()
+        stats = self.paths[path]
+        stats['calls'] += 1
+        stats['time'] += time.perf_counter() - started_at
+
+    def get_n_plus_one(self):
+        threshold = getattr(settings, 'GRAPHQL_N_PLUS_ONE_THRESHOLD', N_PLUS_ONE_THRESHOLD)
+        return [{'path': path, 'sql': sql, 'count': count}
+                for (path, sql), count in self.sql_counts.items() if count >= threshold]
+
+    def summary(self, operation_name=None):
+        paths = sorted(self.paths.items(), key=lambda item: item[1]['time'], reverse=True)
+        return {
+            'operation': operation_name,
+            'time_ms': round((time.perf_counter() - self.started_at) * 1000, 2),
+            'queries': self.queries,
+            'query_time_ms': round(self.query_time * 1000, 2),
+            'n_plus_one': self.get_n_plus_one(),
+            'resolvers': [{
+                'path': path,
+                'calls': stats['calls'],
+                'time_ms': round(stats['time'] * 1000, 2),
+                'queries': stats['queries'],
+                'query_time_ms': round(stats['query_time'] * 1000, 2),
+            } for path, stats in paths[:SLOWEST_PATHS]],
+        }
+
+    def log(self, operation_name=None):
+        summary = self.summary(operation_name)
+        logger.info(json.dumps(summary, ensure_ascii=False))
+        return summary
+
+
+# リストの番号を除いたフィールドのパス（例: collegeProfiles.edges.node.tags）
+def get_field_path(info):
+    return '.'.join(str(key) for key in info.path if not isinstance(key, int))
+
+
+# リゾルバーごとの時間とSQLを記録するgrapheneのミドルウェア
+# 計測対象のリクエスト（request.graphql_profiler がある場合）以外は何もしない
+class QueryProfilingMiddleware:
+    def resolve(self, next, root, info, **kwargs):
+        profiler = getattr(info.context, 'graphql_profiler', None)
+        if profiler is None:
+            return next(root, info, **kwargs)
+
+        path = get_field_path(info)
+        started_at = profiler.enter(path)
+        try:
+            return next(root, info, **kwargs)
+        finally:
+            profiler.leave(path, started_at)
@@ -0,0 +1,58 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+# プロセス内で完結するチャンネルレイヤー（テストや単一ノードでの運用向け）
+# 複数ノードで運用する場合は、同じインターフェースを持つクラスを
+# settings.GRAPHQL_CHANNEL_LAYER に指定する
+class InProcessChannelLayer:
+    def __init__(self):
+        self._groups = defaultdict(set)
+        self._lock = threading.Lock()
+
+    # グループにメッセージの受け取り先（callback(group, message)）を登録する
+    def group_add(self, group, callback):
+        with self._lock:
+            self._groups[group].add(callback)
+
+    def group_discard(self, group, callback):
+        with self._lock:
+            self._groups[group].discard(callback)
+            if not self._groups[group]:
+                del self._groups[group]
+
+    def group_send(self, group, message):
+        with self._lock:
+            callbacks = list(self._groups.get(group, ()))
+        for callback in callbacks:
+            callback(group, message)
+
+
+_channel_layer = None
+
+
+def get_channel_layer():
+    global _channel_layer
+    if _channel_layer is None:
+        backend = getattr(settings, 'GRAPHQL_CHANNEL_LAYER',
+                          'api.pubsub.InProcessChannelLayer')
+        _channel_layer = import_string(backend)()
+    return _channel_layer
+
+
+def talk_room_group(talk_room_id):
+    return 'talk_room.{}.messages'.format(talk_room_id)
+
+
+def notification_group(user_id):
+    return 'user.{}.notifications'.format(user_id)
+
+
+# トランザクションのコミット後にメッセージを配信する
+def publish(group, message):
+    transaction.on_commit(
+        lambda: get_channel_layer().group_send(group, message))
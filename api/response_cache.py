@@ -0,0 +1,140 @@
+import hashlib
+import json
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.language.visitor import TypeInfoVisitor, Visitor, visit
+from graphql.type.definition import get_named_type
+from graphql.utils.type_info import TypeInfo
+from graphql_jwt.utils import get_credentials
+
+from .documents import DOCUMENT_CACHE_SIZE, get_document_backend
+from .models import Address, Gender, Plan, Profile
+
+# 未ログインのユーザーに同じ結果を返す公開クエリと、結果が依存するモデル
+# （選択されたフィールドのモデルは別途クエリから取り出す）
+CACHEABLE_FIELDS = {
+    'allAddresses': [Address],
+    'allGenders': [Gender],
+    'allPlans': [Plan],
+    'collegeProfiles': [Profile],
+    'allProfilesCount': [Profile],
+}
+
+
+# Djangoのキャッシュ（locmem、ファイルなど）にレスポンスを保存する
+# 別の保存先を使う場合は、同じインターフェースを持つクラスを
+# settings.GRAPHQL_RESPONSE_CACHE に指定する
+class DjangoResponseCache:
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS', 'default')]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    # モデルごとの世代（ランダムな文字列）を返す
+    # キャッシュから消えていた場合も以前の世代に戻らないように新しい世代を作る
+    def get_versions(self, labels):
+        keys = {label: 'graphql-version:' + label for label in labels}
+        versions = self.cache.get_many(keys.values())
+        for key in keys.values():
+            if key not in versions:
+                self.cache.add(key, uuid.uuid4().hex, timeout=None)
+                versions[key] = self.cache.get(key)
+        return {label: versions[key] for label, key in keys.items()}
+
+    # モデルの世代を新しくして、そのモデルに依存するレスポンスを無効にする
+    def invalidate(self, label):
+        self.cache.set('graphql-version:' + label, uuid.uuid4().hex, timeout=None)
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        backend = getattr(settings, 'GRAPHQL_RESPONSE_CACHE',
+                          'api.response_cache.DjangoResponseCache')
+        _response_cache = import_string(backend)()
+    return _response_cache
+
+
+# トランザクションのコミット後にモデルのキャッシュを無効にする
+# （コミット前に無効にすると、その間に古いデータが再びキャッシュされることがある）
+def invalidate_model(model):
+    label = model._meta.label
+    transaction.on_commit(lambda: get_response_cache().invalidate(label))
+
+
+# クエリで選択された型に対応するモデルを集める
+class ModelCollector(Visitor):
+    def __init__(self, type_info):
+        self.type_info = type_info
+        self.models = set()
+
+    def enter(self, node, *args):
+        if not isinstance(node, (ast.Field, ast.InlineFragment, ast.FragmentDefinition)):
+            return
+        graphene_type = getattr(get_named_type(self.type_info.get_type()),
+                                'graphene_type', None)
+        model = getattr(getattr(graphene_type, '_meta', None), 'model', None)
+        if model is not None:
+            self.models.add(model)
+
+
+# キャッシュできるクエリであれば (正規化したクエリ, 依存するモデル) を返す
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def get_cacheable_document(schema, query, operation_name):
+    try:
+        document = get_document_backend().document_from_string(
+            schema, query).document_ast
+    except Exception:
+        return None
+
+    operations = [definition for definition in document.definitions
+                  if isinstance(definition, ast.OperationDefinition)]
+    if len(operations) != 1 or operations[0].operation != 'query':
+        return None
+    if operation_name and operations[0].name and operations[0].name.value != operation_name:
+        return None
+
+    models = set()
+    for selection in operations[0].selection_set.selections:
+        if not isinstance(selection, ast.Field):
+            return None
+        name = selection.name.value
+        if name == '__typename':
+            continue
+        if name not in CACHEABLE_FIELDS:
+            return None
+        models.update(CACHEABLE_FIELDS[name])
+
+    type_info = TypeInfo(schema)
+    collector = ModelCollector(type_info)
+    visit(document, TypeInfoVisitor(type_info, collector))
+    models.update(collector.models)
+    return print_ast(document), frozenset(models)
+
+
+# 未ログインのリクエストだけをキャッシュする（ログイン中のユーザーごとの結果は保存しない）
+def get_auth_scope(request):
+    if get_credentials(request) or request.user.is_authenticated:
+        return None
+    return 'anonymous'
+
+
+def get_cache_key(document, variables, operation_name, scope, versions):
+    payload = json.dumps([document, variables or {}, operation_name, scope,
+                          sorted(versions.items())],
+                         sort_keys=True, default=str)
+    return 'graphql-response:' + hashlib.sha256(payload.encode()).hexdigest()
@@ -4,19 +4,28 @@ import graphene
 import graphql_jwt
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
 from django.core.signing import BadSignature, dumps, loads
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Sum
 from django.http import HttpResponseBadRequest
 from graphene import relay
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
 from graphene_file_upload.scalars import Upload
-from graphql_jwt.decorators import login_required
+from graphql import GraphQLError
 from graphql_relay import from_global_id
 
+from .auth import login_required
+from .bulk import bulk_create
+from .fields import FilterConnectionField, KeysetConnectionField
+from .filters import ProfileFilter, TalkRoomFilter
+from .images import get_thumbnail_url, queue_image
+from .loaders import get_talk_room_members_loader, load_related
+from .mail import queue_mail
 from .models import (Address, Gender, Message, Notification, Plan, Profile,
-                     Review, Tag, TalkRoom, User)
+                     Review, Tag, TalkRoom, TalkRoomMember, User)
+from .pubsub import notification_group, publish, talk_room_group
+from .response_cache import invalidate_model
+from .search import search_queryset
 
 
 class UserNode(DjangoObjectType):
@@ -27,6 +36,9 @@ class UserNode(DjangoObjectType):
         }
         interfaces = (relay.Node,)
 
+    def resolve_target_user(self, info, **kwargs):
+        return load_related(info, self, 'target_user')
+
 
 class TagNode(DjangoObjectType):
     class Meta:
@@ -55,32 +67,53 @@ class AddressNode(DjangoObjectType):
         interfaces = (relay.Node,)
 
 
+class ImageFormat(graphene.Enum):
+    JPEG = 'jpeg'
+    WEBP = 'webp'
+
+
 class ProfileNode(DjangoObjectType):
     class Meta:
         model = Profile
-        filter_fields = {
-            # 本人確認が済んでいるユーザーをフィルタリング
-            'target_user__is_active': ['exact'],
-
-            'profile_name': ['exact', 'icontains'],
-            'profile_text': ['exact', 'icontains'],
-            'age': ['exact'],
-            'is_college_student': ['exact'],
-            'school_name': ['exact', 'icontains'],
-
-            'undergraduate': ['exact', 'icontains'],
-            'department': ['exact', 'icontains'],
-            'club_activities': ['exact', 'icontains'],
-            'admission_format': ['exact', 'icontains'],
-            'favorite_subject': ['exact', 'icontains'],
-            'want_hear': ['exact', 'icontains'],
-            'problem': ['exact', 'icontains'],
-
-            'selected_address': ['exact'],
-            'selected_gender': ['exact'],
-        }
+        filterset_class = ProfileFilter
+        exclude = ('search_text', 'search_bigrams', 'profile_image_variants')
         interfaces = (relay.Node,)
 
+    tags = FilterConnectionField(TagNode, required=True)
+    following_users = FilterConnectionField(UserNode, required=True)
+    # 星1〜5それぞれのレビュー数
+    stars_histogram = graphene.List(graphene.NonNull(graphene.Int), required=True)
+    # 指定した大きさ（px）以上で最も小さいサムネイルのURL
+    profile_image_thumb = graphene.String(
+        size=graphene.Int(required=True), format=ImageFormat(default_value='webp'))
+
+    optimizer_hints = {
+        'stars_histogram': ['stars_{}_count'.format(stars) for stars in range(1, 6)],
+        'profile_image_thumb': ['profile_image', 'profile_image_variants'],
+    }
+
+    # 関連フィールドはDataLoaderでまとめて取得する
+    def resolve_target_user(self, info, **kwargs):
+        return load_related(info, self, 'target_user')
+
+    def resolve_selected_address(self, info, **kwargs):
+        return load_related(info, self, 'selected_address')
+
+    def resolve_selected_gender(self, info, **kwargs):
+        return load_related(info, self, 'selected_gender')
+
+    def resolve_tags(self, info, **kwargs):
+        return load_related(info, self, 'tags')
+
+    def resolve_following_users(self, info, **kwargs):
+        return load_related(info, self, 'following_users')
+
+    def resolve_stars_histogram(self, info, **kwargs):
+        return [getattr(self, 'stars_{}_count'.format(stars)) for stars in range(1, 6)]
+
+    def resolve_profile_image_thumb(self, info, size, format='webp', **kwargs):
+        return get_thumbnail_url(self, 'profile_image', size, format)
+
 
 class PlanNode(DjangoObjectType):
     class Meta:
@@ -91,18 +124,57 @@ class PlanNode(DjangoObjectType):
             'is_published': ['exact'],
             'price': ['exact']
         }
+        exclude = ('search_text', 'search_bigrams', 'plan_image_variants')
         interfaces = (relay.Node,)
 
+    # 指定した大きさ（px）以上で最も小さいサムネイルのURL
+    plan_image_thumb = graphene.String(
+        size=graphene.Int(required=True), format=ImageFormat(default_value='webp'))
+
+    optimizer_hints = {
+        'plan_image_thumb': ['plan_image', 'plan_image_variants'],
+    }
+
+    def resolve_plan_author(self, info, **kwargs):
+        return load_related(info, self, 'plan_author')
+
+    def resolve_plan_image_thumb(self, info, size, format='webp', **kwargs):
+        return get_thumbnail_url(self, 'plan_image', size, format)
+
 
 class TalkRoomNode(DjangoObjectType):
     class Meta:
         model = TalkRoom
-        filter_fields = {
-            # 'join_users': ['exact', 'icontains'],
-            'selected_plan': ['exact'],
-        }
+        filterset_class = TalkRoomFilter
         interfaces = (relay.Node,)
 
+    # ログインユーザーにとっての未読メッセージ数
+    unread_count = graphene.Int()
+    # トークルーム内のメッセージ（送信日時順、カーソルでページング）
+    messages = KeysetConnectionField(
+        lambda: MessageNode, ordering=('created_at', 'id'))
+
+    optimizer_hints = {'unread_count': [], 'messages': []}
+
+    def resolve_unread_count(self, info, **kwargs):
+        if not info.context.user.is_authenticated:
+            return None
+        user_id = info.context.user.id
+        return get_talk_room_members_loader(info).load(self.id).then(
+            lambda members: members[user_id].unread_count if user_id in members else 0)
+
+    def resolve_messages(self, info, **kwargs):
+        return Message.objects.filter(talking_room=self.id)
+
+    def resolve_selected_plan(self, info, **kwargs):
+        return load_related(info, self, 'selected_plan')
+
+    def resolve_opponent_user(self, info, **kwargs):
+        return load_related(info, self, 'opponent_user')
+
+    def resolve_last_sender(self, info, **kwargs):
+        return load_related(info, self, 'last_sender')
+
 
 class MessageNode(DjangoObjectType):
     class Meta:
@@ -113,6 +185,22 @@ class MessageNode(DjangoObjectType):
         }
         interfaces = (relay.Node,)
 
+    # 相手がメッセージを確認したかどうか（送信者以外の参加者の既読の位置から求める）
+    is_viewed = graphene.Boolean()
+
+    optimizer_hints = {'is_viewed': ['talking_room', 'sender']}
+
+    def resolve_is_viewed(self, info, **kwargs):
+        return get_talk_room_members_loader(info).load(self.talking_room_id).then(
+            lambda members: any(member.has_read(self) for user_id, member in members.items()
+                                if user_id != self.sender_id))
+
+    def resolve_sender(self, info, **kwargs):
+        return load_related(info, self, 'sender')
+
+    def resolve_talking_room(self, info, **kwargs):
+        return load_related(info, self, 'talking_room')
+
 
 class ReviewNode(DjangoObjectType):
     class Meta:
@@ -124,6 +212,12 @@ class ReviewNode(DjangoObjectType):
         }
         interfaces = (relay.Node,)
 
+    def resolve_provider(self, info, **kwargs):
+        return load_related(info, self, 'provider')
+
+    def resolve_customer(self, info, **kwargs):
+        return load_related(info, self, 'customer')
+
 
 class NotificationNode(DjangoObjectType):
     class Meta:
@@ -134,6 +228,12 @@ class NotificationNode(DjangoObjectType):
         }
         interfaces = (relay.Node,)
 
+    def resolve_notificator(self, info, **kwargs):
+        return load_related(info, self, 'notificator')
+
+    def resolve_receiver(self, info, **kwargs):
+        return load_related(info, self, 'receiver')
+
 # ユーザー作成
 class CreateUserMutation(relay.ClientIDMutation):
     class Input:
@@ -142,6 +242,7 @@ class CreateUserMutation(relay.ClientIDMutation):
 
     user = graphene.Field(UserNode)
 
+    @transaction.atomic
     def mutate_and_get_payload(root, info, **input):
         user = User(
             email=input.get('email'),
@@ -159,9 +260,10 @@ class CreateUserMutation(relay.ClientIDMutation):
         <h1>ユーザー作成時にメール送信しています</h1>\n
                 <p><a href="http://localhost:3000/auth/verify?token={token}&exp={exp}">こちらのリンク</a>をクリックして本登録をしてください。</p>
                     '''
-        # 作成されたメールアドレスに対してメールを送信
-        send_mail(subject='ハルスマイル | 本登録のご案内', message="本登録のご案内です。", html_message=html_message, from_email="harusmile@email.com",
-                recipient_list=[input.get('email')], fail_silently=False)
+        # 作成されたメールアドレスに対してメールを送信（ユーザーと同じトランザクションで送信待ちに登録し、
+        # manage.py send_queued_mail で送信する）
+        queue_mail(subject='ハルスマイル | 本登録のご案内', message="本登録のご案内です。", html_message=html_message, from_email="harusmile@email.com",
+                recipient_list=[input.get('email')])
 
         return CreateUserMutation(user=user)
         
@@ -241,12 +343,23 @@ class CreateProfileMutation(relay.ClientIDMutation):
             telephone_number=input.get('telephone_number'),
             want_hear=input.get('want_hear'),
             problem=input.get('problem'),
-            profile_image=input.get('profile_image'),
         )
         profile.save()
+        # 画像はワーカーで加工してから設定する
+        if input.get('profile_image') is not None:
+            queue_image(profile, 'profile_image', input.get('profile_image'))
         return CreateProfileMutation(profile=profile)
 
 # プロフィールの更新
+# プロフィールの更新で保存する項目（画像とレビューの集計は含めない）
+PROFILE_UPDATE_FIELDS = [
+    'target_user', 'profile_name', 'profile_text', 'is_college_student', 'school_name',
+    'age', 'undergraduate', 'department', 'club_activities', 'admission_format',
+    'favorite_subject', 'telephone_number', 'want_hear', 'problem',
+    'selected_gender', 'selected_address', 'search_text', 'search_bigrams',
+]
+
+
 class UpdateProfileMutation(relay.ClientIDMutation):
     class Input:
         id = graphene.ID(required=True)
@@ -296,13 +409,14 @@ class UpdateProfileMutation(relay.ClientIDMutation):
             # profile_image=input.get('profile_image'),
         )
 
-        # プロフィール画像が設定されていなかったら以前のまま更新しない
+        # プロフィール画像とレビューの集計は以前のまま更新しない
+        # 新しいプロフィール画像はワーカーで加工してから設定する
+        # 集計は同時に作成されたレビューで更新されることがあるので、保存する項目に含めない
+        my_profile = Profile.objects.get(id=profile.id)
+        for field_name in ['profile_image', 'profile_image_variants'] + Profile.rating_fields:
+            setattr(profile, field_name, getattr(my_profile, field_name))
         if input.get('profile_image') is not None:
-            profile.profile_image = input.get('profile_image')
-        else:
-            my_profile = Profile.objects.get(
-                id=from_global_id(input.get('id'))[1])
-            profile.profile_image = my_profile.profile_image
+            queue_image(profile, 'profile_image', input.get('profile_image'))
 
         if input.get('following_users') is not None:
             followings_set = []
@@ -311,7 +425,7 @@ class UpdateProfileMutation(relay.ClientIDMutation):
                 user_object = User.objects.get(id=followings_id)
                 followings_set.append(user_object)
                 profile.followings.set(followings_set)
-            profile.save()
+            profile.save(update_fields=PROFILE_UPDATE_FIELDS)
 
         if input.get('tags') is not None:
             tag_set = []
@@ -320,8 +434,8 @@ class UpdateProfileMutation(relay.ClientIDMutation):
                 tag_object = Tag.objects.get(id=tag_id)
                 tag_set.append(tag_object)
                 profile.tags.set(tag_set)
-            profile.save()
-        profile.save()
+            profile.save(update_fields=PROFILE_UPDATE_FIELDS)
+        profile.save(update_fields=PROFILE_UPDATE_FIELDS)
 
         return UpdateProfileMutation(profile=profile)
 
@@ -343,11 +457,13 @@ class CreatePlanMutation(relay.ClientIDMutation):
             plan_author_id=info.context.user.id,
             title=input.get('title'),
             content=input.get('content'),
-            plan_image=input.get('plan_image'),
             price=input.get('price'),
             is_published=input.get('is_published'),
         )
         plan.save()
+        # 画像はワーカーで加工してから設定する
+        if input.get('plan_image') is not None:
+            queue_image(plan, 'plan_image', input.get('plan_image'))
 
         return CreatePlanMutation(plan=plan)
 
@@ -372,15 +488,10 @@ class UpdatePlanMutation(relay.ClientIDMutation):
         plan.price=input.get('price')
         plan.is_published=input.get('is_published')
 
-        # 新しいプランの画像があればそれを設定し、なければもとのプランの画像のままにする
-        if input.get('plan_image') is not None:
-            plan.plan_image = input.get('plan_image')
-        else:
-            selected_plan = Plan.objects.get(
-                id=from_global_id(input.get('id'))[1])
-            plan.plan_image = selected_plan.plan_image
-
+        # 新しいプランの画像はワーカーで加工してから設定し、それまではもとの画像のままにする
         plan.save()
+        if input.get('plan_image') is not None:
+            queue_image(plan, 'plan_image', input.get('plan_image'))
         return UpdatePlanMutation(plan=plan)
 
 # プランの削除
@@ -419,6 +530,8 @@ class CreateTalkRoomMutation(relay.ClientIDMutation):
         )
         # ManyToMany時は↓で一旦saveが必要
         talk_room.save()
+        # プランの作成者と相手のユーザーを参加者として登録
+        TalkRoom.add_members(TalkRoom.objects.filter(pk=talk_room.pk))
 
         # if input.get('join_users') is not None:
         #     join_users_set = []
@@ -453,6 +566,14 @@ class UpdateTalkRoomMutation(relay.ClientIDMutation):
         return UpdateTalkRoomMutation(talk_room=talk_room)
 
 
+# グローバルIDから主キーを取り出す（不正なIDは内部エラーではなくクライアント向けのエラーにする）
+def decode_id(global_id):
+    try:
+        return int(from_global_id(global_id)[1])
+    except (TypeError, ValueError):
+        raise GraphQLError('IDが不正です: {}'.format(global_id))
+
+
 # メッセージ作成
 class CreateMessageMutation(relay.ClientIDMutation):
     class Input:
@@ -463,33 +584,137 @@ class CreateMessageMutation(relay.ClientIDMutation):
 
     @login_required
     def mutate_and_get_payload(root, info, **input):
+        talking_room_id = decode_id(input.get('talking_room_id'))
+        if not TalkRoomMember.objects.filter(
+                user=info.context.user.id, talk_room=talking_room_id).exists():
+            raise GraphQLError('参加していないトークルームです')
         message = Message(
             text=input.get('text'),
-            talking_room_id=from_global_id(input.get('talking_room_id'))[1],
+            talking_room_id=talking_room_id,
             sender_id=info.context.user.id,
         )
-        message.save()
+        with transaction.atomic():
+            message.save()
+            TalkRoom.add_message(message)
+        # update()ではシグナルが送られないので、レスポンスのキャッシュを直接無効にする
+        invalidate_model(TalkRoom)
+        invalidate_model(TalkRoomMember)
+        # トークルームを購読しているクライアントに配信
+        publish(talk_room_group(message.talking_room_id), {'id': message.id})
         return CreateMessageMutation(message=message)
 
+# 1回のミューテーションでまとめて作成できる件数の上限
+BULK_CREATE_MAX_SIZE = 100
+
+
+def check_bulk_size(items):
+    if not items:
+        raise GraphQLError('作成する項目がありません')
+    if len(items) > BULK_CREATE_MAX_SIZE:
+        raise GraphQLError(
+            '一度に作成できるのは{}件までです'.format(BULK_CREATE_MAX_SIZE))
+
+
+class MessageItemInput(graphene.InputObjectType):
+    talking_room_id = graphene.ID(required=True)
+    text = graphene.String(required=True)
+
+
+# 複数のメッセージをまとめて作成（複数のトークルームに同じ内容を送る場合など）
+class CreateMessagesMutation(relay.ClientIDMutation):
+    class Input:
+        items = graphene.List(graphene.NonNull(MessageItemInput), required=True)
+
+    messages = graphene.List(MessageNode)
+
+    @login_required
+    def mutate_and_get_payload(root, info, **input):
+        user_id = info.context.user.id
+        items = input.get('items')
+        check_bulk_size(items)
+        text_length = Message._meta.get_field('text').max_length
+        if any(len(item.text) > text_length for item in items):
+            raise GraphQLError('メッセージは{}文字以内で入力してください'.format(text_length))
+
+        # 送信先のトークルームにすべて参加しているかを1クエリで確認する
+        item_room_ids = [decode_id(item.talking_room_id) for item in items]
+        room_ids = set(item_room_ids)
+        if TalkRoomMember.objects.filter(user=user_id, talk_room__in=room_ids).count() \
+                != len(room_ids):
+            raise GraphQLError('参加していないトークルームが含まれています')
+
+        with transaction.atomic():
+            messages = bulk_create(Message, [
+                Message(text=item.text, sender_id=user_id, talking_room_id=room_id)
+                for item, room_id in zip(items, item_room_ids)])
+            # トークルームの最後のメッセージと、受信した参加者の未読数を設定し直す
+            TalkRoom.refresh_last_message(TalkRoom.objects.filter(id__in=room_ids))
+            TalkRoomMember.refresh_unread_counts(TalkRoomMember.objects.filter(
+                talk_room__in=room_ids).exclude(user=user_id))
+        # bulk_create()・update()ではシグナルが送られないので、レスポンスのキャッシュを直接無効にする
+        for model in [Message, TalkRoom, TalkRoomMember]:
+            invalidate_model(model)
+        for message in messages:
+            publish(talk_room_group(message.talking_room_id), {'id': message.id})
+        return CreateMessagesMutation(messages=messages)
+
+
+# 既読・確認済みにする対象を1回のUPDATEで扱う件数の上限
+BULK_UPDATE_CHUNK_SIZE = 500
+
+
+def get_unread_message_total(user_id):
+    return TalkRoomMember.objects.filter(user=user_id).aggregate(
+        total=Sum('unread_count'))['total'] or 0
+
+
 # メッセージをみたらメッセージを更新
+# 受け取ったメッセージまでトークルームの既読の位置を進める（それより前のメッセージも既読になる）
 class UpdateMessagesMutation(relay.ClientIDMutation):
     class Input:
         # 未読のメッセージをIDのリスト形式でうけとる
         message_ids = graphene.List(graphene.ID)
 
     ok = graphene.Boolean()
+    # 既読の位置を進めたトークルームの件数
+    count = graphene.Int()
 
     @login_required
     def mutate_and_get_payload(root, info, **input):
-        try:
-            for messege_id in input.get('message_ids'):
-                message: Message=Message.objects.get(id=from_global_id(messege_id)[1])
-                message.is_viewed=True
-                message.save()
-            ok = True
-            return UpdateMessagesMutation(ok=ok)
-        except:
-            raise
+        user_id = info.context.user.id
+        message_ids = [from_global_id(message_id)[1]
+                       for message_id in input.get('message_ids') or []]
+
+        # 自分が参加しているトークルームの、相手から送られたメッセージのみ対象にする
+        count = 0
+        with transaction.atomic():
+            for start in range(0, len(message_ids), BULK_UPDATE_CHUNK_SIZE):
+                chunk = message_ids[start:start + BULK_UPDATE_CHUNK_SIZE]
+                count += TalkRoomMember.mark_read(TalkRoomMember.objects.filter(
+                    user=user_id,
+                    talk_room__in=Message.objects.filter(id__in=chunk).values('talking_room'),
+                ), chunk)
+        # update()ではシグナルが送られないので、レスポンスのキャッシュを直接無効にする
+        invalidate_model(Message)
+        invalidate_model(TalkRoomMember)
+
+        return UpdateMessagesMutation(ok=True, count=count)
+
+
+# トークルームを開いたら、最後のメッセージまで既読にする（参加者の行を1行更新するのみ）
+class ReadTalkRoomMutation(relay.ClientIDMutation):
+    class Input:
+        talk_room_id = graphene.ID(required=True)
+
+    ok = graphene.Boolean()
+
+    @login_required
+    def mutate_and_get_payload(root, info, **input):
+        updated = TalkRoomMember.mark_read(TalkRoomMember.objects.filter(
+            user=info.context.user.id, talk_room=from_global_id(input.get('talk_room_id'))[1]))
+        invalidate_model(Message)
+        invalidate_model(TalkRoomMember)
+        return ReadTalkRoomMutation(ok=updated > 0)
 
 # レビューの作成
 class CreateReviewMutation(relay.ClientIDMutation):
@@ -509,7 +734,13 @@ class CreateReviewMutation(relay.ClientIDMutation):
             review_text=input.get('review_text'),
             stars=input.get('stars'),
         )
-        review.save()
+        if not 1 <= review.stars <= 5:
+            raise GraphQLError('評価は1から5の整数で入力してください')
+        # レビューの保存と評価の集計の更新を同時に行う
+        with transaction.atomic():
+            review.save()
+            Profile.add_review_stars(review.provider_id, review.stars)
+            invalidate_model(Profile)
         return CreateReviewMutation(review=review)
 
 # 通知の作成
@@ -530,32 +761,94 @@ class CreateNotificationMutation(relay.ClientIDMutation):
         )
 
         notification.save()
+        # 受け取ったユーザーに配信
+        publish(notification_group(notification.receiver_id),
+                {'id': notification.id})
         return CreateNotificationMutation(notification=notification)
 
+# 複数のユーザーへの通知をまとめて作成
+class CreateNotificationsMutation(relay.ClientIDMutation):
+    class Input:
+        receivers = graphene.List(graphene.NonNull(graphene.ID), required=True)
+        notification_type = graphene.String(required=True)
+
+    notifications = graphene.List(NotificationNode)
+
+    @login_required
+    def mutate_and_get_payload(root, info, **input):
+        receiver_ids = list(dict.fromkeys(
+            decode_id(receiver) for receiver in input.get('receivers')))
+        check_bulk_size(receiver_ids)
+        if User.objects.filter(id__in=receiver_ids).count() != len(receiver_ids):
+            raise GraphQLError('存在しないユーザーが含まれています')
+
+        with transaction.atomic():
+            notifications = bulk_create(Notification, [
+                Notification(is_checked=False, notificator_id=info.context.user.id,
+                             receiver_id=receiver_id,
+                             notification_type=input.get('notification_type'))
+                for receiver_id in receiver_ids])
+        # bulk_createではシグナルが送られないので、レスポンスのキャッシュを直接無効にする
+        invalidate_model(Notification)
+        # 受け取ったユーザーごとに配信
+        for notification in notifications:
+            publish(notification_group(notification.receiver_id), {'id': notification.id})
+        return CreateNotificationsMutation(notifications=notifications)
+
+
 # 通知を更新
 class UpdateNotificationsMutation(relay.ClientIDMutation):
     # リスト形式でIDを受け取る
     class Input:
         notification_ids = graphene.List(graphene.ID)
 
-    notification = graphene.Field(NotificationNode)
+    notification = graphene.Field(
+        NotificationNode, deprecation_reason='countを使用してください')
+    ok = graphene.Boolean()
+    # 確認済みに更新した通知の件数
+    count = graphene.Int()
 
     @login_required
     def mutate_and_get_payload(root, info, **input):
-        notification = Notification()
-        if input.get('notification_ids') is not None:
-            for notification_id in input.get('notification_ids'):
-                notification = ''
-                notification_object = Notification.objects.get(
-                    id=from_global_id(notification_id)[1])
-                # チェックしたかのフラグをTrueに更新
-                notification_object.is_checked = True
-                notification_object.notificator_id = notification_object.notificator_id
-                notification_object.receiver_id = notification_object.receiver_id
-                notification = notification_object
-                notification.save()
-        notification.save()
-        return UpdateNotificationsMutation(notification=notification)
+        notification_ids = [from_global_id(notification_id)[1]
+                            for notification_id in input.get('notification_ids') or []]
+
+        # 自分が受け取った未確認の通知のみ更新する
+        count = 0
+        for start in range(0, len(notification_ids), BULK_UPDATE_CHUNK_SIZE):
+            count += Notification.objects.filter(
+                receiver=info.context.user.id,
+                id__in=notification_ids[start:start + BULK_UPDATE_CHUNK_SIZE],
+                is_checked=False,
+            ).update(is_checked=True)
+        invalidate_model(Notification)
+
+        # 非推奨のnotificationには、これまでどおり指定された通知のうち自分が受け取った最後のものを返す
+        notification = Notification.objects.filter(
+            receiver=info.context.user.id, id__in=notification_ids).order_by('id').last()
+        return UpdateNotificationsMutation(
+            notification=notification, ok=True, count=count)
+
+
+# 指定日時までに受け取った通知をすべて確認済みにする
+class CheckAllNotificationsMutation(relay.ClientIDMutation):
+    class Input:
+        # 指定がなければ現在までのすべての通知
+        created_before = graphene.DateTime(required=False)
+
+    ok = graphene.Boolean()
+    count = graphene.Int()
+
+    @login_required
+    def mutate_and_get_payload(root, info, **input):
+        notifications = Notification.objects.filter(
+            receiver=info.context.user.id, is_checked=False)
+        if input.get('created_before') is not None:
+            notifications = notifications.filter(
+                created_at__lte=input.get('created_before'))
+        count = notifications.update(is_checked=True)
+        invalidate_model(Notification)
+        return CheckAllNotificationsMutation(ok=True, count=count)
 
 
 class Mutation(graphene.ObjectType):
@@ -571,12 +864,16 @@ class Mutation(graphene.ObjectType):
     create_talk_room = CreateTalkRoomMutation().Field()
     update_talk_room = UpdateTalkRoomMutation().Field()
     create_message = CreateMessageMutation.Field()
+    create_messages = CreateMessagesMutation.Field()
     update_messages = UpdateMessagesMutation.Field()
+    read_talk_room = ReadTalkRoomMutation.Field()
 
     create_review = CreateReviewMutation.Field()
 
     create_notification = CreateNotificationMutation.Field()
+    create_notifications = CreateNotificationsMutation.Field()
     update_notifications = UpdateNotificationsMutation.Field()
+    check_all_notifications = CheckAllNotificationsMutation.Field()
 
     # python manage.py cleartokens コマンドで無効なtokenを削除できる
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
@@ -587,35 +884,44 @@ class Mutation(graphene.ObjectType):
 class Query(graphene.ObjectType):
     login_user = graphene.Field(UserNode)
     user = graphene.Field(UserNode, id=graphene.NonNull(graphene.ID))
-    all_users = DjangoFilterConnectionField(UserNode)
+    all_users = FilterConnectionField(UserNode)
     profile = graphene.Field(ProfileNode, id=graphene.NonNull(graphene.ID))
-    all_profiles = DjangoFilterConnectionField(ProfileNode)
-    high_school_profiles = DjangoFilterConnectionField(ProfileNode)
-    college_profiles = DjangoFilterConnectionField(ProfileNode)
+    all_profiles = FilterConnectionField(ProfileNode)
+    high_school_profiles = FilterConnectionField(ProfileNode)
+    college_profiles = FilterConnectionField(ProfileNode)
     plan = graphene.Field(PlanNode, id=graphene.NonNull(graphene.ID))
-    all_plans = DjangoFilterConnectionField(PlanNode)
-    login_user_plans = DjangoFilterConnectionField(PlanNode)
+    all_plans = FilterConnectionField(PlanNode)
+    login_user_plans = FilterConnectionField(PlanNode)
     tag = graphene.Field(TagNode, id=graphene.NonNull(graphene.ID))
-    all_tags = DjangoFilterConnectionField(TagNode)
+    all_tags = FilterConnectionField(TagNode)
     review = graphene.Field(ReviewNode, id=graphene.NonNull(graphene.ID))
-    all_reviews = DjangoFilterConnectionField(ReviewNode)
-    login_user_reviews = DjangoFilterConnectionField(ReviewNode)
-    login_user_send_reviews = DjangoFilterConnectionField(ReviewNode)
-    # login_user_written_reviews = DjangoFilterConnectionField(ReviewNode)
+    all_reviews = FilterConnectionField(ReviewNode)
+    login_user_reviews = FilterConnectionField(ReviewNode)
+    login_user_send_reviews = FilterConnectionField(ReviewNode)
+    # login_user_written_reviews = FilterConnectionField(ReviewNode)
     gender = graphene.Field(GenderNode, id=graphene.NonNull(graphene.ID))
-    all_genders = DjangoFilterConnectionField(GenderNode)
+    all_genders = FilterConnectionField(GenderNode)
     address = graphene.Field(AddressNode, id=graphene.NonNull(graphene.ID))
-    all_addresses = DjangoFilterConnectionField(AddressNode)
+    all_addresses = FilterConnectionField(AddressNode)
     talk_room = graphene.Field(TalkRoomNode, id=graphene.NonNull(graphene.ID))
-    all_talk_rooms = DjangoFilterConnectionField(TalkRoomNode)
-    login_user_talk_rooms = DjangoFilterConnectionField(TalkRoomNode)
+    all_talk_rooms = FilterConnectionField(TalkRoomNode)
+    login_user_talk_rooms = FilterConnectionField(TalkRoomNode)
     message = graphene.Field(MessageNode, id=graphene.NonNull(graphene.ID))
-    all_messages = DjangoFilterConnectionField(MessageNode)
-    login_user_messages = DjangoFilterConnectionField(MessageNode)
+    all_messages = FilterConnectionField(MessageNode)
+    login_user_messages = FilterConnectionField(MessageNode)
     notification = graphene.Field(
         NotificationNode, id=graphene.NonNull(graphene.ID))
-    login_user_notifications = DjangoFilterConnectionField(NotificationNode)
+    # 新しい順、カーソルでページング
+    login_user_notifications = KeysetConnectionField(
+        NotificationNode, ordering=('-created_at', '-id'))
     all_profiles_count = graphene.Int()
+    # キーワードで検索（関連度順）
+    search_profiles = FilterConnectionField(
+        ProfileNode, query=graphene.String(required=True))
+    search_plans = FilterConnectionField(
+        PlanNode, query=graphene.String(required=True))
+    unread_message_total = graphene.Int()
+    unread_notification_count = graphene.Int()
 
 
     # 全てのプロフィールの件数を取得
@@ -658,6 +964,9 @@ class Query(graphene.ObjectType):
     def resolve_college_profiles(self, info, **kwargs):
         return Profile.objects.filter(is_college_student=True)
 
+    def resolve_search_profiles(self, info, query, **kwargs):
+        return search_queryset(Profile.objects.all(), query)
+
     # plan
     def resolve_plan(self, info, **kwargs):
         id = kwargs.get('id')
@@ -670,6 +979,9 @@ class Query(graphene.ObjectType):
     def resolve_login_user_plans(self, info, **kwargs):
         return Plan.objects.filter(plan_author=info.context.user.id)
 
+    def resolve_search_plans(self, info, query, **kwargs):
+        return search_queryset(Plan.objects.all(), query)
+
     # gender
 
     def resolve_gender(self, info, **kwargs):
@@ -725,7 +1037,8 @@ class Query(graphene.ObjectType):
 
     @login_required
     def resolve_login_user_talk_rooms(self, info, **kwargs):
-        return TalkRoom.objects.filter(Q(selected_plan__plan_author=info.context.user.id) | Q(opponent_user=info.context.user.id))
+        # 最近やりとりしたトークルームから順に返す（orderByの指定があればそちらを優先）
+        return TalkRoom.objects.filter(members__user=info.context.user.id).order_by(*TalkRoom.activity_ordering)
 
     # login_required
     # 自分が受け取ったレビュー
@@ -760,6 +1073,39 @@ class Query(graphene.ObjectType):
         if id is not None:
             return Notification.objects.get(id=from_global_id(id)[1])
 
+    # 参加しているトークルーム全体の未読メッセージ数
+    @login_required
+    def resolve_unread_message_total(self, info, **kwargs):
+        # 参加者ごとに保持している未読数を合計する
+        return get_unread_message_total(info.context.user.id)
+
+    # 未確認の通知数
+    @login_required
+    def resolve_unread_notification_count(self, info, **kwargs):
+        return Notification.objects.filter(
+            receiver=info.context.user.id, is_checked=False).count()
+
     # @login_required
     def resolve_login_user_notifications(self, info, **kwargs):
         return Notification.objects.filter(receiver=info.context.user.id)
+
+
+class Subscription(graphene.ObjectType):
+    # トークルームに新しいメッセージが送信された
+    message_added = graphene.Field(
+        MessageNode, talk_room_id=graphene.ID(required=True))
+    # ログインユーザーが通知を受け取った
+    notification_received = graphene.Field(NotificationNode)
+
+    @login_required
+    def resolve_message_added(root, info, talk_room_id):
+        user_id = info.context.user.id
+        talk_room = TalkRoom.objects.get(
+            members__user=user_id, id=from_global_id(talk_room_id)[1])
+        return info.context.subscribe(talk_room_group(talk_room.id)).map(
+            lambda message: Message.objects.filter(id=message['id']).first())
+
+    @login_required
+    def resolve_notification_received(root, info):
+        return info.context.subscribe(notification_group(info.context.user.id)).map(
+            lambda message: Notification.objects.filter(id=message['id']).first())
@@ -0,0 +1,177 @@
+import unicodedata
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, When
+
+# SQLiteの全文検索で取得する件数の上限
+SEARCH_RESULT_LIMIT = 1000
+# SQLiteのtrigramトークナイザーで検索できる最小の文字数（これより短い語はbigramで検索する）
+TRIGRAM_MIN_LENGTH = 3
+# 検索に使う語の最小の文字数（1文字の語はほぼすべてに一致するので無視する）
+SEARCH_MIN_LENGTH = 2
+
+# カタカナ（ァ〜ヶ）をひらがなに変換するテーブル
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+# 検索用に文字列を正規化する
+# 全角英数字を半角に、半角カナを全角に揃え（NFKC）、カタカナをひらがなに、英字を小文字にする
+def normalize_search_text(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text)
+    return text.translate(KATAKANA_TO_HIRAGANA).lower()
+
+
+# モデルの指定したフィールドをまとめて、検索用の文字列を作る
+def build_search_text(instance, field_names):
+    values = [getattr(instance, field_name) for field_name in field_names]
+    return normalize_search_text(' '.join(value for value in values if value))
+
+
+# 2文字の語を検索するために、語ごとに重複しない2文字ずつの組をスペース区切りで並べる
+# 例: 'すうがく 数学' -> 'すう うが がく 数学'
+def build_search_bigrams(search_text):
+    bigrams = {}
+    for word in search_text.split():
+        for index in range(len(word) - 1):
+            bigrams[word[index:index + 2]] = None
+    return ' '.join(bigrams)
+
+
+# モデルのsearch_fieldsから検索用の文字列とbigramを設定する
+def set_search_text(instance):
+    instance.search_text = build_search_text(instance, instance.search_fields)
+    instance.search_bigrams = build_search_bigrams(instance.search_text)
+
+
+def get_fts_table(model):
+    return model._meta.db_table + '_fts'
+
+
+def get_bigram_fts_table(model):
+    return model._meta.db_table + '_bigram_fts'
+
+
+# SQLiteの全文検索用テーブルを更新する（PostgreSQLは元のテーブルのインデックスを使う）
+def sync_search_index(instance, deleted=False):
+    connection = connections[instance._state.db or 'default']
+    if connection.vendor != 'sqlite':
+        return
+    tables = [(get_fts_table(type(instance)), 'search_text'),
+              (get_bigram_fts_table(type(instance)), 'search_bigrams')]
+    with connection.cursor() as cursor:
+        for table, column in tables:
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid = %s'.format(table), [instance.pk])
+            if not deleted:
+                cursor.execute(
+                    'INSERT INTO {} (rowid, {}) VALUES (%s, %s)'.format(
+                        table, column),
+                    [instance.pk, getattr(instance, column)])
+
+
+# bulk_createなどでシグナルを通さずに保存した場合に、全文検索用のテーブルを作り直す
+def rebuild_search_index(model, using='default'):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    tables = [(get_fts_table(model), 'search_text'),
+              (get_bigram_fts_table(model), 'search_bigrams')]
+    with connection.cursor() as cursor:
+        for table, column in tables:
+            cursor.execute('DELETE FROM {}'.format(table))
+            cursor.execute(
+                'INSERT INTO {0} (rowid, {1}) SELECT id, {1} FROM {2}'.format(
+                    table, column, model._meta.db_table))
+
+
+# キーワードで絞り込み、関連度の高い順に並べたクエリセットを返す
+# SEARCH_MIN_LENGTH未満の語は無視し、3文字以上の語はtrigram、2文字の語はbigramのインデックスで検索する
+def search_queryset(queryset, keyword):
+    terms = [term for term in normalize_search_text(keyword).split()
+             if len(term) >= SEARCH_MIN_LENGTH]
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return search_postgresql(queryset, terms)
+    if vendor == 'sqlite':
+        return search_sqlite(queryset, terms)
+
+    # 全文検索が使えない場合は部分一致で絞り込む
+    for term in terms:
+        queryset = queryset.filter(search_text__contains=term)
+    return queryset.order_by('id')
+
+
+# 3文字以上の語と2文字の語に分ける
+def split_terms(terms):
+    long_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+    short_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH]
+    return long_terms, short_terms
+
+
+# tsvector（単語単位）とpg_trgm（日本語のn-gram）のGINインデックスを使う
+# pg_trgmは2文字の語にインデックスを使えないので、2文字の語はbigramのtsvectorで検索する
+def search_postgresql(queryset, terms):
+    from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                               SearchVector,
+                                               TrigramSimilarity)
+
+    long_terms, short_terms = split_terms(terms)
+    vector = SearchVector('search_text', config='simple')
+    query = SearchQuery(' '.join(terms), config='simple')
+    rank = SearchRank(vector, query) + TrigramSimilarity(
+        'search_text', ' '.join(terms))
+    queryset = queryset.annotate(search_vector=vector)
+
+    if long_terms:
+        long_query = SearchQuery(' '.join(long_terms), config='simple')
+        contains_all = Q()
+        for term in long_terms:
+            contains_all &= Q(search_text__contains=term)
+        queryset = queryset.filter(Q(search_vector=long_query) | contains_all)
+    if short_terms:
+        bigram_vector = SearchVector('search_bigrams', config='simple')
+        bigram_query = SearchQuery(' '.join(short_terms), config='simple')
+        rank = rank + SearchRank(bigram_vector, bigram_query)
+        queryset = queryset.annotate(search_bigram_vector=bigram_vector).filter(
+            search_bigram_vector=bigram_query)
+
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+
+def build_match(terms):
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+# FTS5の仮想テーブルから関連度順にIDを取得する
+# 3文字以上の語はtrigramトークナイザーのテーブル、2文字の語はbigramのテーブルで検索する
+def search_sqlite(queryset, terms):
+    long_terms, short_terms = split_terms(terms)
+    matches = []
+    if long_terms:
+        matches.append((get_fts_table(queryset.model), build_match(long_terms)))
+    if short_terms:
+        matches.append((get_bigram_fts_table(queryset.model), build_match(short_terms)))
+
+    # 関連度は最初のテーブルのbm25で並べ、残りのテーブルはrowidの絞り込みに使う
+    (table, match), rest = matches[0], matches[1:]
+    sql = 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(table)
+    params = [match]
+    for other_table, other_match in rest:
+        sql += ' AND rowid IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'.format(
+            other_table)
+        params.append(other_match)
+    sql += ' ORDER BY bm25({0}) LIMIT %s'.format(table)
+    params.append(SEARCH_RESULT_LIMIT)
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+                output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(rank)
@@ -0,0 +1,46 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import get_token_user_cache
+from .models import Plan, Profile, User
+from .response_cache import invalidate_model
+from .search import sync_search_index
+
+
+# 全文検索用のテーブルをプロフィール・プランの保存/削除に合わせて更新する
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=Plan)
+def update_search_index(sender, instance, **kwargs):
+    sync_search_index(instance)
+
+
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=Plan)
+def delete_search_index(sender, instance, **kwargs):
+    sync_search_index(instance, deleted=True)
+
+
+# apiアプリのモデルが変更されたら、そのモデルに依存するレスポンスのキャッシュを無効にする
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_response_cache(sender, **kwargs):
+    if sender._meta.app_label == 'api':
+        invalidate_model(sender)
+
+
+@receiver(m2m_changed)
+def invalidate_response_cache_m2m(sender, instance, action, model, **kwargs):
+    if not action.startswith('post_'):
+        return
+    for changed in (type(instance), model):
+        if changed._meta.app_label == 'api':
+            invalidate_model(changed)
+
+
+# ユーザーが変更（無効化・削除など）されたら、このワーカーが保持するトークンの対応を破棄する
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def discard_token_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    get_token_user_cache().discard_user(instance.pk)
@@ -1,3 +1,1744 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import re
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import (Client, RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+from graphql_relay.utils import base64
+from PIL import Image
+from promise import Promise
+
+from harusmile.schema import schema
+
+from .async_views import AsyncGraphQLView, shutdown_orm_executor
+from .auth import get_token_user_cache
+from .benchmarks import OPERATIONS, run_benchmarks, run_throughput
+from .documents import get_document_backend, get_document_hash
+from .fields import KeysetConnectionField
+from .loaders import load_related
+from .models import (Address, Gender, ImageJob, Message, Notification,
+                     OutgoingEmail, Plan, Profile, Review, Tag, TalkRoom,
+                     TalkRoomMember, User)
+from .pubsub import (InProcessChannelLayer, get_channel_layer, publish,
+                     talk_room_group)
+from .schema import PROFILE_UPDATE_FIELDS
+from .search import (build_search_bigrams, normalize_search_text,
+                     search_queryset)
+from .views import CachedGraphQLView
+from .websocket import (GQL_COMPLETE, GQL_CONNECTION_ACK, GQL_CONNECTION_INIT,
+                        GQL_CONNECTION_TERMINATE, GQL_DATA, GQL_ERROR,
+                        GQL_START, GQL_STOP, GRAPHQL_WS,
+                        GraphQLWebSocketApplication)
+
+
+# GraphQLのクエリを実行し、実行結果と発行されたSQLを返す
+def execute_graphql(query, user=None, variables=None):
+    request = RequestFactory().post('/graphql/')
+    request.user = user or AnonymousUser()
+    with CaptureQueriesContext(connection) as context:
+        result = schema.execute(
+            query, context_value=request, variables=variables)
+    return result, [query['sql'] for query in context.captured_queries]
+
+
+# GraphQLのクエリを実行し、発行されたSQLを返す
+def execute_and_capture(query, user=None, variables=None):
+    result, queries = execute_graphql(query, user, variables)
+    assert result.errors is None, result.errors
+    return queries
+
+
+def create_user(name):
+    return User.objects.create(email='{}@example.com'.format(name), is_active=True)
+
+
+# プランの作成者（author）と相手のユーザー（opponents）のトークルーム（rooms）を使うテストの共通部分
+class TalkRoomFixtureMixin:
+    create_message = '''mutation($id: ID!, $text: String!) {
+        createMessage(input: {talkingRoomId: $id, text: $text}) { message { id } }
+    }'''
+
+    # room_count件のトークルームを作成し、相手のユーザーにはopponentsを順に割り当てる
+    @classmethod
+    def create_talk_rooms(cls, room_count=1, opponent_count=1):
+        cls.author = create_user('author')
+        cls.opponents = [create_user('opponent{}'.format(i or ''))
+                         for i in range(opponent_count)]
+        cls.opponent = cls.opponents[0]
+        cls.plan = Plan.objects.create(plan_author=cls.author, title='plan', content='content')
+        cls.rooms = [TalkRoom.objects.create(selected_plan=cls.plan,
+                                             opponent_user=cls.opponents[i % opponent_count])
+                     for i in range(room_count)]
+        cls.room = cls.rooms[0] if cls.rooms else None
+        TalkRoom.add_members(TalkRoom.objects.filter(selected_plan=cls.plan))
+
+    # エラーがないことを確認して、実行結果のデータを返す
+    def execute(self, query, user, variables=None):
+        result, _ = execute_graphql(query, user, variables)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def send_message(self, room, user, text):
+        data = self.execute(self.create_message, user, {
+            'id': to_global_id('TalkRoomNode', room.id), 'text': text})
+        return data['createMessage']['message']['id']
+
+
+# 主要なクエリがインデックスを使っているか（シーケンシャルスキャンになっていないか）を確認する
+class QueryPlanTest(TestCase):
+    # インデックスで絞り込まれるべきテーブル
+    indexed_tables = ['api_message', 'api_notification', 'api_review',
+                      'api_plan', 'api_profile', 'api_talkroommember']
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(address_name='東京都')
+        gender = Gender.objects.create(gender_name='女性')
+        cls.users = []
+        for i in range(30):
+            user = User.objects.create(
+                email='user{}@example.com'.format(i), is_active=True)
+            cls.users.append(user)
+            Profile.objects.create(
+                target_user=user, profile_name='user{}'.format(i),
+                is_college_student=i % 2 == 0,
+                selected_address=address, selected_gender=gender)
+            Plan.objects.create(
+                plan_author=user, title='plan{}'.format(i), content='content',
+                is_published=i % 3 != 0)
+        for i in range(29):
+            talk_room = TalkRoom.objects.create(
+                selected_plan=Plan.objects.get(title='plan{}'.format(i)),
+                opponent_user=cls.users[i + 1])
+            for j in range(10):
+                Message.objects.create(
+                    talking_room=talk_room, sender=cls.users[i + j % 2],
+                    text='message{}'.format(j))
+            Review.objects.create(
+                provider=cls.users[i], customer=cls.users[i + 1],
+                review_text='review', stars=i % 5 + 1)
+            Notification.objects.create(
+                notificator=cls.users[i], receiver=cls.users[i + 1],
+                notification_type='message')
+        TalkRoom.add_members(TalkRoom.objects.all())
+        TalkRoomMember.refresh_unread_counts(TalkRoomMember.objects.all())
+        cls.talk_room = TalkRoom.objects.first()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # データ量が少ないとシーケンシャルスキャンが選ばれやすいため無効にして確認する
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def is_sequential_scan(self, line):
+        for table in self.indexed_tables:
+            if connection.vendor == 'postgresql':
+                if re.search(r'Seq Scan on {}\b'.format(table), line):
+                    return True
+            elif re.search(r'\bSCAN (TABLE )?{}\b(?!.*\bUSING\b)'.format(table), line):
+                return True
+        return False
+
+    def assertNoSequentialScan(self, query, user=None, variables=None):
+        for sql in execute_and_capture(query, user, variables):
+            if not sql.startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            scans = [line for line in plan if self.is_sequential_scan(line)]
+            self.assertEqual(scans, [], '{}\n{}'.format(sql, '\n'.join(plan)))
+
+    def test_talk_room_messages(self):
+        self.assertNoSequentialScan(
+            '''query($id: ID!) {
+                talkRoom(id: $id) {
+                    unreadCount
+                    messages(last: 20) { edges { node { text } } }
+                }
+            }''',
+            user=self.users[0],
+            variables={'id': to_global_id('TalkRoomNode', self.talk_room.id)})
+
+    def test_login_user_talk_rooms(self):
+        self.assertNoSequentialScan(
+            '''{
+                loginUserTalkRooms(first: 20) { edges { node { unreadCount } } }
+                unreadMessageTotal
+            }''',
+            user=self.users[1])
+
+    def test_login_user_notifications(self):
+        self.assertNoSequentialScan(
+            '''{
+                loginUserNotifications(first: 20) { edges { node { notificationType } } }
+                unreadNotificationCount
+            }''',
+            user=self.users[1])
+
+    def test_login_user_reviews(self):
+        self.assertNoSequentialScan(
+            '''{
+                loginUserReviews { edges { node { stars } } }
+                loginUserSendReviews { edges { node { stars } } }
+            }''',
+            user=self.users[1])
+
+    def test_published_plans(self):
+        self.assertNoSequentialScan(
+            '{ allPlans(isPublished: true, first: 20) { edges { node { title } } } }')
+
+    def test_profiles_by_student_type(self):
+        self.assertNoSequentialScan(
+            '''{
+                collegeProfiles(first: 20) { edges { node { profileName } } }
+                highSchoolProfiles(first: 20) { edges { node { profileName } } }
+            }''')
+
+    def test_college_profiles_by_rating(self):
+        self.assertNoSequentialScan(
+            '''{
+                collegeProfiles(first: 20, orderBy: "-averageStars") {
+                    edges { node { profileName averageStars reviewCount } }
+                }
+            }''')
+
+
+# ユーザー作成時のメールが送信待ちに登録され、ワーカーで送信されることを確認する
+class OutgoingEmailTest(TestCase):
+    create_user = '''mutation {
+        createUser(input: {email: "new@example.com", password: "password"}) {
+            user { email }
+        }
+    }'''
+
+    def test_create_user_queues_mail(self):
+        execute_and_capture(self.create_user)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipient_list, ['new@example.com'])
+
+        call_command('send_queued_mail', stdout=mock.Mock())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        email.refresh_from_db()
+        self.assertIsNotNone(email.sent_at)
+
+    def test_failed_mail_is_retried_later(self):
+        execute_and_capture(self.create_user)
+        with mock.patch('django.core.mail.EmailMultiAlternatives.send',
+                        side_effect=ConnectionError):
+            call_command('send_queued_mail', stdout=mock.Mock())
+        email = OutgoingEmail.objects.get()
+        self.assertIsNone(email.sent_at)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('ConnectionError', email.last_error)
+
+        # 再送の時刻になるまでは送信しない
+        call_command('send_queued_mail', stdout=mock.Mock())
+        self.assertEqual(len(mail.outbox), 0)
+
+
+# 未ログインの公開クエリがキャッシュされ、モデルの変更で無効になることを確認する
+class ResponseCacheTest(TestCase):
+    query = '''{
+        allAddresses { edges { node { addressName } } }
+        collegeProfiles(first: 10) { edges { node { profileName } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.address = Address.objects.create(address_name='東京都')
+        cls.user = User.objects.create(email='user@example.com', is_active=True)
+        Profile.objects.create(target_user=cls.user, profile_name='user',
+                               is_college_student=True)
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def post(self, query, **extra):
+        with CaptureQueriesContext(connection) as context:
+            response = Client().post('/graphql/', json.dumps({'query': query}),
+                                     content_type='application/json', **extra)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content), len(context.captured_queries)
+
+    def test_anonymous_query_is_cached(self):
+        first, _ = self.post(self.query)
+        # 空白の違いは同じクエリとして扱う
+        second, query_count = self.post(' '.join(self.query.split()))
+        self.assertEqual(first, second)
+        self.assertEqual(query_count, 0)
+
+    def test_model_change_invalidates_cache(self):
+        self.post(self.query)
+        self.address.address_name = '大阪府'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.save()
+        data, query_count = self.post(self.query)
+        self.assertGreater(query_count, 0)
+        self.assertEqual(
+            data['data']['allAddresses']['edges'][0]['node']['addressName'], '大阪府')
+
+    def test_authenticated_query_is_not_cached(self):
+        token = get_token(self.user)
+        self.post(self.query, HTTP_AUTHORIZATION='JWT ' + token)
+        _, query_count = self.post(self.query, HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertGreater(query_count, 0)
+
+
+# 検証済みクエリのキャッシュと永続化クエリを確認する
+class PersistedQueryTest(TestCase):
+    query = '{ allGenders { edges { node { genderName } } } }'
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def post(self, body):
+        response = Client().post('/graphql/', json.dumps(body),
+                                 content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def persisted(self, query=None):
+        body = {'extensions': {'persistedQuery': {
+            'version': 1, 'sha256Hash': get_document_hash(self.query)}}}
+        if query:
+            body['query'] = query
+        return body
+
+    def test_document_is_parsed_once(self):
+        backend = get_document_backend()
+        document = backend.document_from_string(schema, self.query)
+        self.assertIs(backend.document_from_string(schema, self.query), document)
+
+    def test_persisted_query_is_registered(self):
+        status, data = self.post(self.persisted())
+        self.assertEqual(data['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        status, data = self.post(self.persisted(self.query))
+        self.assertEqual((status, data['data']), (200, {'allGenders': {'edges': []}}))
+
+        status, data = self.post(self.persisted())
+        self.assertEqual((status, data['data']), (200, {'allGenders': {'edges': []}}))
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES_ONLY=True)
+    def test_unregistered_query_is_rejected(self):
+        status, data = self.post({'query': self.query})
+        self.assertEqual(status, 400)
+        self.assertEqual(data['errors'][0]['message'], 'PersistedQueryNotSupported')
+
+        status, _ = self.post(self.persisted(self.query))
+        self.assertEqual(status, 400)
+
+
+# クエリのコストの計算と上限を確認する
+class QueryCostTest(TestCase):
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def post(self, query, variables=None):
+        response = Client().post('/graphql/', json.dumps({'query': query, 'variables': variables}),
+                                 content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def test_cost_is_reported(self):
+        status, data = self.post(
+            '{ allGenders(first: 10) { edges { node { genderName } } } }')
+        self.assertEqual(status, 200)
+        # allGenders + 10件 × (edges + node + genderName)
+        self.assertEqual(data['extensions'], {'cost': 31})
+
+    @override_settings(GRAPHQL_MAX_QUERY_COST=1000)
+    def test_nested_connections_over_budget_are_rejected(self):
+        status, data = self.post('''{
+            collegeProfiles(first: 50) { edges { node {
+                tags(first: 50) { edges { node { tagName } } }
+            } } }
+        }''')
+        self.assertEqual(status, 400)
+        self.assertIn('コスト', data['errors'][0]['message'])
+
+    def test_variable_page_size_is_counted_at_max(self):
+        # 既定値を小さくしても、送られた変数の値で取得できる件数の上限で数える
+        query = '''query($n: Int = 1) {
+            collegeProfiles(first: $n) { edges { node {
+                tags(first: $n) { edges { node {
+                    tags(first: $n) { edges { node { profileName } } }
+                } } }
+            } } }
+        }'''
+        for variables in [{'n': 100}, None]:
+            status, data = self.post(query, variables)
+            self.assertEqual(status, 400)
+            self.assertIn('コスト', data['errors'][0]['message'])
+
+    def test_default_page_size(self):
+        Gender.objects.bulk_create(
+            [Gender(gender_name='gender{}'.format(i)) for i in range(5)])
+        with override_settings(GRAPHQL_DEFAULT_PAGE_SIZE=3):
+            status, data = self.post('{ allGenders { edges { node { genderName } } } }')
+        self.assertEqual(len(data['data']['allGenders']['edges']), 3)
+
+
+# リゾルバーごとの計測とN+1の検出を確認する
+@override_settings(DEBUG=True, GRAPHQL_N_PLUS_ONE_THRESHOLD=3)
+class QueryProfilingTest(TestCase):
+    query = '''{
+        loginUserTalkRooms { edges { node {
+            messages(first: 5) { edges { node { text } } }
+        } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@example.com', is_active=True)
+        for i in range(3):
+            author = User.objects.create(
+                email='author{}@example.com'.format(i), is_active=True)
+            plan = Plan.objects.create(
+                plan_author=author, title='plan{}'.format(i), content='content')
+            talk_room = TalkRoom.objects.create(selected_plan=plan, opponent_user=cls.user)
+            Message.objects.create(talking_room=talk_room, sender=author, text='hello')
+        TalkRoom.add_members(TalkRoom.objects.all())
+
+    def post(self, **extra):
+        response = Client().post(
+            '/graphql/', json.dumps({'query': self.query}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='JWT ' + get_token(self.user), **extra)
+        return json.loads(response.content)
+
+    def test_profile_is_returned_with_debug_header(self):
+        with self.assertLogs('api.graphql', 'INFO'):
+            data = self.post(HTTP_X_GRAPHQL_PROFILE='1')
+        profile = data['extensions']['profile']
+        self.assertGreater(profile['queries'], 0)
+        # トークルームごとにメッセージを取得しているのでN+1として報告される
+        self.assertEqual(
+            [(item['path'], item['count']) for item in profile['n_plus_one']],
+            [('loginUserTalkRooms.edges.node.messages', 3)])
+
+    def test_profile_is_not_returned_without_header(self):
+        data = self.post()
+        self.assertNotIn('profile', data.get('extensions', {}))
+
+
+# 性能確認用のデータ作成とベンチマークが動くことを確認する
+class BenchmarkTest(TestCase):
+    def test_seed_scale_and_run_benchmarks(self):
+        call_command('seed_scale', users=20, large_room_messages=50,
+                     notifications_per_user=2, stdout=mock.Mock())
+        self.assertEqual(Profile.objects.filter(is_college_student=True).count(), 10)
+        self.assertTrue(Profile.objects.filter(review_count__gt=0).exists())
+
+        results = run_benchmarks(schema, iterations=1, warmup=0)
+        self.assertEqual(list(results), [operation['name'] for operation in OPERATIONS])
+        for result in results.values():
+            self.assertGreater(result['queries'], 0)
+
+
+# アップロードした画像がワーカーで加工され、サムネイルが作成されることを確認する
+class ImageJobTest(TestCase):
+    create_plan = '''mutation CreatePlan($image: Upload) {
+        createPlan(input: {title: "title", content: "content", price: 0,
+                           isPublished: true, planImage: $image}) {
+            plan { id planImage }
+        }
+    }'''
+    plan_thumb = '''query Plan($id: ID!) {
+        plan(id: $id) {
+            planImageThumb(size: 100)
+            jpeg: planImageThumb(size: 600, format: JPEG)
+        }
+    }'''
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=media_root.name,
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(email='student@example.com', password='password')
+
+    def create_image(self):
+        # 横長の画像をEXIFで90度回転させて表示するように指定する
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'camera'
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (255, 0, 0)).save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_uploaded_image_is_processed_by_worker(self):
+        execute_and_capture(self.create_plan, self.user, {'image': self.create_image()})
+        plan = Plan.objects.get()
+        # リクエスト中には加工しない
+        self.assertFalse(plan.plan_image)
+        self.assertEqual(ImageJob.objects.filter(processed_at__isnull=True).count(), 1)
+        # 加工前の画像はワーカーからも読める画像のフィールドと同じストレージに保存する
+        job = ImageJob.objects.get()
+        storage = Plan._meta.get_field('plan_image').storage
+        self.assertTrue(job.source_name.startswith('pending/'))
+        self.assertTrue(storage.exists(job.source_name))
+
+        call_command('process_images', stdout=mock.Mock())
+        self.assertFalse(storage.exists(job.source_name))
+        plan.refresh_from_db()
+        self.assertEqual(sorted(plan.plan_image_variants), ['128', '256', '512', '64', 'original'])
+        with plan.plan_image.open('rb') as file:
+            image = Image.open(file)
+            # EXIFの向きが反映され、EXIFは削除されている
+            self.assertEqual(image.size, (800, 1200))
+            self.assertEqual(len(image.getexif()), 0)
+        with plan.plan_image.storage.open(plan.plan_image_variants['128']['webp']) as file:
+            self.assertEqual(Image.open(file).size, (85, 128))
+
+        id = to_global_id('PlanNode', plan.id)
+        request = RequestFactory().post('/graphql/')
+        request.user = AnonymousUser()
+        data = schema.execute(self.plan_thumb, context_value=request,
+                              variables={'id': id}).data['plan']
+        self.assertTrue(data['planImageThumb'].endswith('_128.webp'))
+        self.assertEqual(data['jpeg'], plan.plan_image.url)
+
+
+
+# マルチパートのアップロードが上限を超えたら、ミューテーションを実行する前に拒否されることを確認する
+@override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024, UPLOAD_MAX_FILE_SIZE=4096,
+                   UPLOAD_MAX_REQUEST_SIZE=6144, UPLOAD_MAX_FILES=2)
+class UploadLimitTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=media_root.name,
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create(email='student@example.com', is_active=True)
+
+    def upload(self, *sizes):
+        operations = {'query': ImageJobTest.create_plan, 'variables': {'image': None}}
+        data = {'operations': json.dumps(operations),
+                'map': json.dumps({str(i): ['variables.image'] for i in range(len(sizes))})}
+        for i, size in enumerate(sizes):
+            data[str(i)] = SimpleUploadedFile('photo.jpg', b'x' * size, content_type='image/jpeg')
+        return Client().post('/graphql/', data,
+                             HTTP_AUTHORIZATION='JWT ' + get_token(self.user))
+
+    def test_upload_is_hashed_while_streaming(self):
+        response = self.upload(3000)
+        self.assertEqual(response.status_code, 200)
+        job = ImageJob.objects.get()
+        self.assertIn(hashlib.sha256(b'x' * 3000).hexdigest(), job.source_name)
+
+    def test_too_large_file_is_rejected(self):
+        response = self.upload(5000)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('errors', json.loads(response.content))
+        self.assertFalse(Plan.objects.exists())
+
+    def test_too_large_request_and_too_many_files_are_rejected(self):
+        self.assertEqual(self.upload(4000, 4000).status_code, 413)
+        self.assertEqual(self.upload(10, 10, 10).status_code, 413)
+        self.assertFalse(ImageJob.objects.exists())
+
+
+# JWTの認証がリクエストごとに1回だけ行われ、トークンとユーザーの対応が再利用されることを確認する
+class JSONWebTokenMiddlewareTest(TestCase):
+    query = '''{
+        loginUserPlans { edges { node { id } } }
+        loginUserNotifications { edges { node { id } } }
+    }'''
+
+    def setUp(self):
+        get_token_user_cache().clear()
+        self.user = User.objects.create(email='user@example.com', is_active=True)
+        Plan.objects.create(plan_author=self.user, title='plan', content='content')
+
+    def post(self, query, token):
+        with CaptureQueriesContext(connection) as context:
+            response = Client().post('/graphql/', json.dumps({'query': query}),
+                                     content_type='application/json',
+                                     HTTP_AUTHORIZATION='JWT ' + token)
+        users = [query['sql'] for query in context.captured_queries
+                 if 'FROM "api_user"' in query['sql']]
+        return json.loads(response.content), users
+
+    def test_user_table_is_not_read_for_cached_token(self):
+        token = get_token(self.user)
+        data, users = self.post(self.query, token)
+        self.assertEqual(len(data['data']['loginUserPlans']['edges']), 1)
+        self.assertEqual(len(users), 1)
+
+        data, users = self.post(self.query, token)
+        self.assertEqual(len(data['data']['loginUserPlans']['edges']), 1)
+        self.assertEqual(users, [])
+
+    def test_disabled_user_is_discarded_from_cache(self):
+        token = get_token(self.user)
+        self.post(self.query, token)
+        self.user.is_active = False
+        self.user.save()
+        data, _ = self.post('{ loginUserTalkRooms { edges { node { id } } } }', token)
+        self.assertEqual(data['errors'][0]['message'], 'User is disabled')
+
+    def test_expired_token_error_is_returned_for_login_required_field(self):
+        with mock.patch('graphql_jwt.utils.jwt_settings.JWT_EXPIRATION_DELTA',
+                        timedelta(seconds=-1)):
+            token = get_token(self.user)
+        data, _ = self.post(
+            '{ loginUserTalkRooms { edges { node { id } } } allPlans { edges { node { id } } } }', token)
+        self.assertEqual(data['errors'][0]['message'], 'Signature has expired')
+        self.assertEqual(len(data['data']['allPlans']['edges']), 1)
+
+
+# 非同期のビューがルートフィールドを並行して実行し、同期のビューと同じ結果を返すことを確認する
+# ORM用のスレッドからデータが見えるように、トランザクションを使わないテストにする
+class AsyncGraphQLViewTest(TransactionTestCase):
+    query = '''{
+        loginUserPlans { edges { node { title } } }
+        loginUserNotifications { edges { node { notificationType } } }
+        unreadNotificationCount
+    }'''
+
+    def setUp(self):
+        self.user = User.objects.create(email='user@example.com', is_active=True)
+        other = User.objects.create(email='other@example.com', is_active=True)
+        Plan.objects.create(plan_author=self.user, title='plan', content='content')
+        Notification.objects.create(notificator=other, receiver=self.user,
+                                    notification_type='follow')
+        self.addCleanup(shutdown_orm_executor)
+
+    def post(self, view, query):
+        request = RequestFactory().post('/graphql/', json.dumps({'query': query}),
+                                        content_type='application/json')
+        request.user = self.user
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        return json.loads(view(request).content)
+
+    def test_root_fields_are_executed_concurrently(self):
+        async_view = AsyncGraphQLView.as_async_view(schema=schema)
+        sync_view = CachedGraphQLView.as_view(schema=schema)
+        with mock.patch.object(AsyncGraphQLView, 'execute_root_field', autospec=True,
+                               side_effect=AsyncGraphQLView.execute_root_field) as execute:
+            data = self.post(async_view, self.query)
+        self.assertEqual(execute.call_count, 3)
+        self.assertEqual(data['data'], self.post(sync_view, self.query)['data'])
+        self.assertEqual(data['data']['unreadNotificationCount'], 1)
+        self.assertIn('cost', data['extensions'])
+
+    def test_mutation_is_executed_by_sync_view(self):
+        async_view = AsyncGraphQLView.as_async_view(schema=schema)
+        data = self.post(async_view, '''mutation {
+            createPlan(input: {title: "new", content: "content", price: 0, isPublished: true}) {
+                plan { title }
+            }
+        }''')
+        self.assertEqual(data['data']['createPlan']['plan']['title'], 'new')
+        self.assertTrue(Plan.objects.filter(title='new').exists())
+
+    def test_run_throughput(self):
+        call_command('seed_scale', users=10, large_room_messages=20,
+                     notifications_per_user=2, stdout=mock.Mock())
+        results = run_throughput(schema, ['login_user_notifications', 'landing'],
+                                 total=6, workers=2, concurrency=4)
+        self.assertEqual(results['wsgi']['requests'], 6)
+        self.assertEqual(results['asgi']['requests'], 6)
+
+
+# メッセージの送信と既読がトークルームの最後のメッセージと未読数に反映されることを確認する
+class TalkRoomSummaryTest(TalkRoomFixtureMixin, TestCase):
+    talk_rooms = '''{
+        loginUserTalkRooms {
+            edges { node { id unreadCount lastMessagePreview lastSender { email } } }
+        }
+        unreadMessageTotal
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_talk_rooms(room_count=2)
+
+    def test_summary_is_updated_by_messages(self):
+        self.send_message(self.rooms[0], self.author, 'hello')
+        ids = [self.send_message(self.rooms[1], self.author, 'message{}'.format(i))
+               for i in range(3)]
+        self.send_message(self.rooms[1], self.opponent, 'x' * 150)
+
+        data = self.execute(self.talk_rooms, self.opponent)
+        nodes = [edge['node'] for edge in data['loginUserTalkRooms']['edges']]
+        # 最近メッセージのあったトークルームが先頭
+        self.assertEqual(nodes[0]['id'], to_global_id('TalkRoomNode', self.rooms[1].id))
+        self.assertEqual(nodes[0]['lastMessagePreview'], 'x' * 100)
+        self.assertEqual(nodes[0]['lastSender']['email'], 'opponent@example.com')
+        self.assertEqual([node['unreadCount'] for node in nodes], [3, 1])
+        self.assertEqual(data['unreadMessageTotal'], 4)
+        self.assertEqual(self.execute(self.talk_rooms, self.author)['unreadMessageTotal'], 1)
+
+        data = self.execute('''mutation($ids: [ID]) {
+            updateMessages(input: {messageIds: $ids}) { count }
+        }''', self.opponent, {'ids': ids[:2]})
+        self.assertEqual(data['updateMessages']['count'], 1)
+        data = self.execute(self.talk_rooms, self.opponent)
+        self.assertEqual([edge['node']['unreadCount']
+                          for edge in data['loginUserTalkRooms']['edges']], [1, 1])
+        self.assertEqual(data['unreadMessageTotal'], 2)
+
+    def test_refresh_matches_messages(self):
+        Message.objects.bulk_create([
+            Message(talking_room=self.rooms[0], sender=self.opponent, text='a'),
+            Message(talking_room=self.rooms[0], sender=self.author, text='b'),
+        ])
+        TalkRoom.refresh_last_message(TalkRoom.objects.all())
+        TalkRoomMember.refresh_unread_counts(TalkRoomMember.objects.all())
+        room = TalkRoom.objects.get(id=self.rooms[0].id)
+        self.assertEqual(room.last_message_preview, 'b')
+        self.assertEqual(
+            dict(room.members.values_list('user', 'unread_count')),
+            {self.author.id: 1, self.opponent.id: 1})
+        self.assertIsNone(TalkRoom.objects.get(id=self.rooms[1].id).last_message_at)
+
+    def test_older_message_does_not_move_summary_back(self):
+        room = TalkRoom.objects.get(id=self.room.id)
+        newer = Message.objects.create(talking_room=room, sender=self.author, text='newer')
+        older = Message.objects.create(talking_room=room, sender=self.opponent, text='older')
+        Message.objects.filter(id=older.id).update(
+            created_at=newer.created_at - timedelta(seconds=1))
+        older.refresh_from_db()
+        # 後から送信されたメッセージの反映が先に行われた場合
+        TalkRoom.add_message(newer)
+        TalkRoom.add_message(older)
+
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_preview, 'newer')
+        self.assertEqual(room.last_sender_id, self.author.id)
+        self.assertEqual(room.last_message_at, newer.created_at)
+        self.assertEqual(room.last_activity_at, newer.created_at)
+        # 未読数はどちらのメッセージも数える
+        self.assertEqual(
+            dict(room.members.values_list('user', 'unread_count')),
+            {self.author.id: 1, self.opponent.id: 1})
+
+
+# トークルームの作成時に参加者が登録され、参加者のみがトークルームを取得できることを確認する
+class TalkRoomMemberTest(TalkRoomFixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # トークルームはミューテーションで作成する
+        cls.create_talk_rooms(room_count=0)
+        cls.other = create_user('other')
+
+    def test_members_are_registered_on_create(self):
+        self.execute('''mutation($plan: ID!, $opponent: ID!) {
+            createTalkRoom(input: {selectedPlan: $plan, opponentUser: $opponent}) {
+                talkRoom { id }
+            }
+        }''', self.opponent, {'plan': to_global_id('PlanNode', self.plan.id),
+                              'opponent': to_global_id('UserNode', self.opponent.id)})
+        talk_room = TalkRoom.objects.get()
+        self.assertEqual(
+            set(TalkRoomMember.objects.filter(talk_room=talk_room)
+                .values_list('user', flat=True)),
+            {self.author.id, self.opponent.id})
+
+        # 登録済みの参加者は重複しない
+        TalkRoom.add_members(TalkRoom.objects.all())
+        self.assertEqual(TalkRoomMember.objects.count(), 2)
+
+        query = '{ loginUserTalkRooms { edges { node { id } } } }'
+        for user, count in [(self.author, 1), (self.opponent, 1), (self.other, 0)]:
+            self.assertEqual(len(self.execute(query, user)['loginUserTalkRooms']['edges']), count)
+
+
+# 既読の位置からメッセージの既読と未読数が求められることを確認する
+class ReadWatermarkTest(TalkRoomFixtureMixin, TestCase):
+    messages = '''query($id: ID!) {
+        talkRoom(id: $id) {
+            unreadCount
+            messages(first: 10) { edges { node { text isViewed } } }
+        }
+        unreadMessageTotal
+    }'''
+
+    def setUp(self):
+        self.create_talk_rooms()
+        self.room_id = to_global_id('TalkRoomNode', self.room.id)
+        for i in range(3):
+            self.send_message(self.room, self.author if i < 2 else self.opponent,
+                              'message{}'.format(i))
+
+    def test_read_talk_room(self):
+        data = self.execute(self.messages, self.opponent, {'id': self.room_id})
+        self.assertEqual(data['talkRoom']['unreadCount'], 2)
+        self.assertEqual(data['unreadMessageTotal'], 2)
+
+        with CaptureQueriesContext(connection) as context:
+            data = self.execute('''mutation($id: ID!) {
+                readTalkRoom(input: {talkRoomId: $id}) { ok }
+            }''', self.opponent, {'id': self.room_id})
+        self.assertTrue(data['readTalkRoom']['ok'])
+        # 参加者の1行を更新するのみ
+        self.assertEqual(len(context.captured_queries), 1)
+
+        data = self.execute(self.messages, self.author, {'id': self.room_id})
+        # 相手が読んだ自分のメッセージは既読、相手から受け取ったメッセージは未読
+        self.assertEqual([edge['node']['isViewed']
+                          for edge in data['talkRoom']['messages']['edges']],
+                         [True, True, False])
+        self.assertEqual(data['talkRoom']['unreadCount'], 1)
+        self.assertEqual(
+            self.execute(self.messages, self.opponent, {'id': self.room_id})
+            ['talkRoom']['unreadCount'], 0)
+
+    def test_watermark_does_not_move_back(self):
+        member = TalkRoomMember.objects.filter(user=self.opponent)
+        last_id = Message.objects.filter(sender=self.author).latest('id').id
+        TalkRoomMember.mark_read(member)
+        TalkRoomMember.mark_read(member, [Message.objects.earliest('id').id])
+        self.assertEqual(member.get().last_read_message_id, last_id)
+        self.assertEqual(member.get().unread_count, 0)
+
+
+# メッセージと通知をまとめて作成できることを確認する
+class BulkCreateMutationTest(TalkRoomFixtureMixin, TestCase):
+    create_messages = '''mutation($items: [MessageItemInput!]!) {
+        createMessages(input: {items: $items}) { messages { id text } }
+    }'''
+    create_notifications = '''mutation($receivers: [ID!]!) {
+        createNotifications(input: {receivers: $receivers, notificationType: "follow"}) {
+            notifications { id receiver { email } }
+        }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_talk_rooms(room_count=3, opponent_count=3)
+
+    # 作成者としてミューテーションを実行する
+    def mutate(self, query, variables):
+        return execute_graphql(query, self.author, variables)[0]
+
+    def message_items(self, rooms):
+        return [{'talkingRoomId': to_global_id('TalkRoomNode', room.id),
+                 'text': 'hello{}'.format(i)} for i, room in enumerate(rooms)]
+
+    def test_create_messages(self):
+        small = execute_and_capture(self.create_messages, self.author,
+                                    {'items': self.message_items(self.rooms[:1])})
+        result, queries = execute_graphql(self.create_messages, self.author,
+                                          {'items': self.message_items(self.rooms * 2)})
+        self.assertIsNone(result.errors)
+        # 件数によらずクエリ数は変わらない
+        self.assertEqual(len(queries), len(small))
+        messages = result.data['createMessages']['messages']
+        self.assertEqual([message['text'] for message in messages],
+                         ['hello{}'.format(i) for i in range(6)])
+        self.assertEqual(
+            [message['id'] for message in messages],
+            [to_global_id('MessageNode', message.id)
+             for message in Message.objects.order_by('id')[1:]])
+
+        room = TalkRoom.objects.get(id=self.rooms[2].id)
+        self.assertEqual(room.last_message_preview, 'hello5')
+        self.assertEqual(
+            dict(room.members.values_list('user', 'unread_count')),
+            {self.author.id: 0, self.opponents[2].id: 2})
+
+    def test_create_messages_to_other_room(self):
+        other = create_user('other')
+        plan = Plan.objects.create(plan_author=other, title='other', content='content')
+        room = TalkRoom.objects.create(selected_plan=plan, opponent_user=other)
+        result = self.mutate(self.create_messages,
+                              {'items': self.message_items([self.rooms[0], room])})
+        self.assertEqual(result.errors[0].message, '参加していないトークルームが含まれています')
+        self.assertFalse(Message.objects.exists())
+
+    def test_malformed_ids(self):
+        for global_id in ['invalid', to_global_id('TalkRoomNode', 'x')]:
+            result = self.mutate(self.create_messages, {'items': [
+                {'talkingRoomId': global_id, 'text': 'hello'}]})
+            self.assertEqual(result.errors[0].message, 'IDが不正です: {}'.format(global_id))
+            result = self.mutate(self.create_notifications, {'receivers': [global_id]})
+            self.assertEqual(result.errors[0].message, 'IDが不正です: {}'.format(global_id))
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+    def test_create_message_requires_membership(self):
+        result, _ = execute_graphql(self.create_message, create_user('other'), {
+            'id': to_global_id('TalkRoomNode', self.room.id), 'text': 'hello'})
+        self.assertEqual(result.errors[0].message, '参加していないトークルームです')
+        self.assertFalse(Message.objects.exists())
+
+    def test_create_notifications(self):
+        receivers = [to_global_id('UserNode', user.id)
+                     for user in self.opponents + self.opponents[:1]]
+        result = self.mutate(self.create_notifications, {'receivers': receivers})
+        self.assertIsNone(result.errors)
+        # 同じユーザーには1件のみ
+        self.assertEqual(
+            [notification['receiver']['email']
+             for notification in result.data['createNotifications']['notifications']],
+            [user.email for user in self.opponents])
+        self.assertEqual(Notification.objects.filter(notificator=self.author).count(), 3)
+
+        result = self.mutate(self.create_notifications,
+                             {'receivers': [to_global_id('UserNode', 0)]})
+        self.assertEqual(result.errors[0].message, '存在しないユーザーが含まれています')
+
+
+# レビューの作成で評価の集計が更新され、プロフィールの更新で消えないことを確認する
+class ReviewRatingTest(TestCase):
+    create_review = '''mutation($provider: ID!, $stars: Int!) {
+        createReview(input: {provider: $provider, reviewText: "review", stars: $stars}) {
+            review { id }
+        }
+    }'''
+
+    def setUp(self):
+        self.address = Address.objects.create(address_name='東京都')
+        self.gender = Gender.objects.create(gender_name='女性')
+        self.provider = create_user('provider')
+        self.customer = create_user('customer')
+        self.profile = Profile.objects.create(
+            target_user=self.provider, profile_name='provider', is_college_student=True,
+            selected_address=self.address, selected_gender=self.gender)
+
+    def review(self, stars):
+        return execute_graphql(self.create_review, self.customer, {
+            'provider': to_global_id('UserNode', self.provider.id), 'stars': stars})[0]
+
+    def assertRating(self, count, total, histogram):
+        profile = Profile.objects.get(id=self.profile.id)
+        self.assertEqual(profile.review_count, count)
+        self.assertEqual(profile.stars_sum, total)
+        self.assertAlmostEqual(profile.average_stars, total / count)
+        self.assertEqual([getattr(profile, 'stars_{}_count'.format(stars))
+                          for stars in range(1, 6)], histogram)
+
+    def test_rating_is_aggregated(self):
+        for stars in [5, 3, 5]:
+            self.assertIsNone(self.review(stars).errors)
+        self.assertRating(3, 13, [0, 0, 1, 0, 2])
+
+        # 範囲外の評価はレビューも集計も作成しない
+        for stars in [0, 6, -1]:
+            result = self.review(stars)
+            self.assertEqual(result.errors[0].message, '評価は1から5の整数で入力してください')
+        self.assertEqual(Review.objects.count(), 3)
+        self.assertRating(3, 13, [0, 0, 1, 0, 2])
+
+    def test_update_profile_keeps_rating(self):
+        self.review(4)
+        result, _ = execute_graphql('''mutation($id: ID!, $gender: ID!, $address: ID!) {
+            updateProfile(input: {id: $id, profileName: "new name", isCollegeStudent: true,
+                                  selectedGender: $gender, selectedAddress: $address}) {
+                profile { profileName reviewCount }
+            }
+        }''', self.provider, {
+            'id': to_global_id('ProfileNode', self.profile.id),
+            'gender': to_global_id('GenderNode', self.gender.id),
+            'address': to_global_id('AddressNode', self.address.id)})
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['updateProfile']['profile'],
+                         {'profileName': 'new name', 'reviewCount': 1})
+        self.assertRating(1, 4, [0, 0, 0, 1, 0])
+
+    def test_update_profile_does_not_overwrite_concurrent_review(self):
+        profile = Profile.objects.get(id=self.profile.id)
+        # 読み込んだ後に別のリクエストでレビューが作成された
+        Profile.add_review_stars(self.provider.id, 5)
+        profile.profile_name = 'new name'
+        profile.save(update_fields=PROFILE_UPDATE_FIELDS)
+        self.assertRating(1, 5, [0, 0, 0, 0, 1])
+
+
+# 検索用の文字列の正規化と、データベースごとの検索の方法を確認する
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(email='author@example.com', is_active=True)
+        cls.plans = [
+            Plan.objects.create(plan_author=user, title=title, content=content)
+            for title, content in [
+                ('オンライン相談', '受験の勉強法をオンラインで相談できます（オンライン限定）'),
+                ('ｵﾝﾗｲﾝ面接練習', '面接の練習'),
+                ('英検対策', 'ＴＯＥＩＣと英検の対策'),
+            ]]
+
+    def search(self, keyword):
+        with CaptureQueriesContext(connection) as context:
+            plans = list(search_queryset(Plan.objects.all(), keyword))
+        return plans, ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_normalize_search_text(self):
+        # 全角英数字は半角、半角カナは全角、カタカナはひらがな、英字は小文字にする
+        self.assertEqual(normalize_search_text('ＴＯＥＩＣ ｵﾝﾗｲﾝ カタカナ ABC'),
+                         'toeic おんらいん かたかな abc')
+        self.assertEqual(normalize_search_text(None), '')
+        self.assertEqual(self.plans[2].search_text, '英検対策 toeicと英検の対策')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLiteの全文検索')
+    def test_sqlite_trigram_search(self):
+        plans, sql = self.search('オンライン')
+        self.assertIn('api_plan_fts MATCH', sql)
+        # 表記の違い（半角カナ・ひらがな）も一致し、多く含むものが先になる
+        self.assertEqual(plans, self.plans[:2])
+        self.assertEqual(self.search('toeic 対策')[0], [self.plans[2]])
+        self.assertEqual(self.search('存在しない')[0], [])
+
+    def test_build_search_bigrams(self):
+        self.assertEqual(build_search_bigrams('すうがく 数学 a'), 'すう うが がく 数学')
+        self.assertEqual(self.plans[2].search_bigrams.split()[:3], ['英検', '検対', '対策'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLiteの全文検索')
+    def test_sqlite_bigram_search(self):
+        # 2文字の語はtrigramのテーブルでは検索できないのでbigramのテーブルで検索する
+        plans, sql = self.search('英検')
+        self.assertIn('api_plan_bigram_fts MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+        self.assertEqual(plans, [self.plans[2]])
+        # 3文字以上の語と2文字の語を組み合わせた場合は両方に一致するものだけを返す
+        plans, sql = self.search('オンライン 面接')
+        self.assertIn('api_plan_fts MATCH', sql)
+        self.assertIn('api_plan_bigram_fts MATCH', sql)
+        self.assertEqual(plans, [self.plans[1]])
+        self.assertEqual(self.search('数学')[0], [])
+
+    def test_short_terms_are_ignored(self):
+        # SEARCH_MIN_LENGTH未満の語は無視する
+        self.assertEqual(self.search('英検 の')[0], [self.plans[2]])
+        self.assertEqual(self.search('の')[0], [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLiteの全文検索')
+    def test_sqlite_index_follows_updates(self):
+        plan = self.plans[2]
+        plan.title = 'ＴＯＥＦＬ対策'
+        plan.content = ''
+        plan.save()
+        self.assertEqual(self.search('toefl')[0], [plan])
+        self.assertEqual(self.search('toeic')[0], [])
+        self.assertEqual(self.search('英検')[0], [])
+        plan.delete()
+        self.assertEqual(self.search('toefl')[0], [])
+        self.assertEqual(self.search('対策')[0], [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQLの全文検索')
+    def test_postgresql_search(self):
+        plans, sql = self.search('オンライン')
+        self.assertIn('to_tsvector', sql)
+        self.assertEqual(set(plans), set(self.plans[:2]))
+        self.assertEqual(self.search('toeic 対策')[0], [self.plans[2]])
+        plans, sql = self.search('英検')
+        self.assertIn('search_bigrams', sql)
+        self.assertEqual(plans, [self.plans[2]])
+
+    def test_like_fallback(self):
+        # 全文検索に対応していないデータベースでは部分一致で絞り込む
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            plans, sql = self.search('オンライン 相談')
+        self.assertIn('LIKE', sql)
+        self.assertEqual(plans, [self.plans[0]])
+
+    def test_empty_keyword(self):
+        self.assertEqual(self.search('  ')[0], [])
+
+
+# subscriptions-transport-ws（graphql-ws）プロトコルでの購読と配信を確認する
+class GraphQLWebSocketTest(TalkRoomFixtureMixin, TransactionTestCase):
+    message_added = '''subscription($id: ID!) {
+        messageAdded(talkRoomId: $id) { text sender { email } }
+    }'''
+
+    def setUp(self):
+        self.create_talk_rooms()
+        self.group = talk_room_group(self.room.id)
+        self.layer = get_channel_layer()
+        group_add = mock.patch.object(self.layer, 'group_add', wraps=self.layer.group_add)
+        self.group_add = group_add.start()
+        self.addCleanup(group_add.stop)
+
+    def connect(self, subprotocols=(GRAPHQL_WS,), query_string=b''):
+        return ApplicationCommunicator(GraphQLWebSocketApplication(schema), {
+            'type': 'websocket', 'subprotocols': list(subprotocols),
+            'query_string': query_string})
+
+    async def open(self, user=None, **kwargs):
+        communicator = self.connect(**kwargs)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual(await communicator.receive_output(),
+                         {'type': 'websocket.accept', 'subprotocol': GRAPHQL_WS})
+        payload = {'authToken': get_token(user)} if user else {}
+        await self.send(communicator, {'type': GQL_CONNECTION_INIT, 'payload': payload})
+        self.assertEqual(await self.receive(communicator), {'type': GQL_CONNECTION_ACK})
+        return communicator
+
+    async def send(self, communicator, message):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output(timeout=5))['text'])
+
+    async def subscribe(self, communicator, op_id='1'):
+        count = self.group_add.call_count
+        await self.send(communicator, {'type': GQL_START, 'id': op_id, 'payload': {
+            'query': self.message_added,
+            'variables': {'id': to_global_id('TalkRoomNode', self.room.id)}}})
+        # startには応答がないので、チャンネルレイヤーに登録されるまで待つ
+        for _ in range(100):
+            if self.group_add.call_count > count:
+                return
+            await asyncio.sleep(0.05)
+        self.fail('購読が登録されませんでした')
+
+    async def post_message(self, user, text):
+        await sync_to_async(self.send_message)(self.room, user, text)
+
+    async def test_requires_graphql_ws_subprotocol(self):
+        communicator = self.connect(subprotocols=())
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual(await communicator.receive_output(),
+                         {'type': 'websocket.close', 'code': 1002})
+
+    async def test_subscription_requires_authentication(self):
+        communicator = await self.open()
+        await self.send(communicator, {'type': GQL_START, 'id': '1', 'payload': {
+            'query': self.message_added,
+            'variables': {'id': to_global_id('TalkRoomNode', self.room.id)}}})
+        message = await self.receive(communicator)
+        self.assertEqual(message['type'], GQL_ERROR)
+        self.assertEqual(message['id'], '1')
+        self.assertNotIn(self.group, self.layer._groups)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+    async def test_publish_is_sent_to_every_subscriber(self):
+        # connection_initのpayloadとクエリパラメーターのどちらのトークンでも認証できる
+        author = await self.open(self.author)
+        opponent = await self.open(query_string='token={}'.format(
+            get_token(self.opponent)).encode())
+        await self.subscribe(author)
+        await self.subscribe(opponent)
+
+        await self.post_message(self.opponent, 'hello')
+        for communicator in [author, opponent]:
+            self.assertEqual(await self.receive(communicator), {
+                'type': GQL_DATA, 'id': '1', 'payload': {'data': {'messageAdded': {
+                    'text': 'hello', 'sender': {'email': 'opponent@example.com'}}}}})
+
+        # stopした接続には配信されない
+        await self.send(author, {'type': GQL_STOP, 'id': '1'})
+        self.assertEqual(await self.receive(author), {'type': GQL_COMPLETE, 'id': '1'})
+        self.assertEqual(len(self.layer._groups[self.group]), 1)
+        await self.post_message(self.author, 'again')
+        self.assertEqual((await self.receive(opponent))['payload']['data']['messageAdded']['text'],
+                         'again')
+        self.assertTrue(await author.receive_nothing(timeout=0.2))
+
+        for communicator in [author, opponent]:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=5)
+
+    async def test_stop_keeps_other_operations_on_same_group(self):
+        communicator = await self.open(self.author)
+        await self.subscribe(communicator, op_id='1')
+        await self.subscribe(communicator, op_id='2')
+        await self.send(communicator, {'type': GQL_STOP, 'id': '1'})
+        self.assertEqual(await self.receive(communicator), {'type': GQL_COMPLETE, 'id': '1'})
+
+        await self.post_message(self.opponent, 'hello')
+        message = await self.receive(communicator)
+        self.assertEqual(message['id'], '2')
+        self.assertEqual(message['payload']['data']['messageAdded']['text'], 'hello')
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        self.assertNotIn(self.group, self.layer._groups)
+
+    async def test_disconnect_discards_subscriptions(self):
+        communicator = await self.open(self.author)
+        await self.subscribe(communicator, op_id='1')
+        await self.subscribe(communicator, op_id='2')
+        self.assertEqual(len(self.layer._groups[self.group]), 2)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        self.assertNotIn(self.group, self.layer._groups)
+
+    async def test_connection_terminate_closes_socket(self):
+        communicator = await self.open(self.author)
+        await self.subscribe(communicator)
+        await self.send(communicator, {'type': GQL_CONNECTION_TERMINATE})
+        self.assertEqual(await communicator.receive_output(timeout=5),
+                         {'type': 'websocket.close'})
+        await communicator.wait(timeout=5)
+        self.assertNotIn(self.group, self.layer._groups)
+
+
+# チャンネルレイヤーがグループの全員に配信し、解除した受け取り先を削除することを確認する
+class InProcessChannelLayerTest(TestCase):
+    def test_group_send_fans_out_to_every_callback(self):
+        layer = InProcessChannelLayer()
+        first, second, other = mock.Mock(), mock.Mock(), mock.Mock()
+        layer.group_add('group', first)
+        layer.group_add('group', second)
+        layer.group_add('other', other)
+        layer.group_send('group', {'id': 1})
+        first.assert_called_once_with('group', {'id': 1})
+        second.assert_called_once_with('group', {'id': 1})
+        other.assert_not_called()
+
+        # 登録を解除したものには送られず、空になったグループは削除される
+        layer.group_discard('group', first)
+        layer.group_send('group', {'id': 2})
+        self.assertEqual(first.call_count, 1)
+        second.assert_called_with('group', {'id': 2})
+        layer.group_discard('group', second)
+        self.assertNotIn('group', layer._groups)
+        layer.group_send('group', {'id': 3})
+
+    def test_publish_after_commit(self):
+        callback = mock.Mock()
+        layer = get_channel_layer()
+        layer.group_add('group', callback)
+        self.addCleanup(layer.group_discard, 'group', callback)
+        with self.captureOnCommitCallbacks(execute=True):
+            publish('group', {'id': 1})
+            callback.assert_not_called()
+        callback.assert_called_once_with('group', {'id': 1})
+
+
+# 関連先をDataLoaderでまとめて1クエリで取得し、リクエストごとにキャッシュすることを確認する
+class DataLoaderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.address = Address.objects.create(address_name='東京都')
+        tags = [Tag.objects.create(tag_name='tag{}'.format(i)) for i in range(3)]
+        cls.users = []
+        for i in range(5):
+            user = User.objects.create(email='user{}@example.com'.format(i), is_active=True)
+            cls.users.append(user)
+            Plan.objects.create(plan_author=user, title='plan{}'.format(i), content='content')
+            if i < 4:
+                profile = Profile.objects.create(
+                    target_user=user, profile_name='user{}'.format(i), is_college_student=True,
+                    selected_address=cls.address if i % 2 else None)
+                profile.tags.set(tags[:i])
+
+    def info(self):
+        return SimpleNamespace(context=SimpleNamespace())
+
+    # GraphQLの実行と同じようにPromiseの中で読み込み、まとめて取得させる
+    def load(self, info, instances, field_name):
+        return Promise.resolve(None).then(lambda _: Promise.all([
+            load_related(info, instance, field_name) for instance in instances])).get()
+
+    def test_foreign_keys_are_loaded_in_one_query(self):
+        plans = list(Plan.objects.order_by('id'))
+        info = self.info()
+        with self.assertNumQueries(1):
+            authors = self.load(info, plans, 'plan_author')
+        self.assertEqual(authors, self.users)
+
+        # 同じリクエストではキャッシュを使い、別のリクエストでは取得し直す
+        with self.assertNumQueries(0):
+            self.load(info, plans, 'plan_author')
+        with self.assertNumQueries(1):
+            self.load(self.info(), plans, 'plan_author')
+
+    def test_null_and_cached_relations_are_not_queried(self):
+        profiles = list(Profile.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            addresses = self.load(self.info(), profiles, 'selected_address')
+        self.assertEqual(addresses, [None, self.address, None, self.address])
+        profiles = list(Profile.objects.filter(selected_address=None))
+        with self.assertNumQueries(0):
+            self.load(self.info(), profiles, 'selected_address')
+
+        # select_related/prefetch_related済みの関連はそのまま使う
+        profiles = list(Profile.objects.select_related('target_user')
+                        .prefetch_related('tags').order_by('id'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.load(self.info(), profiles, 'target_user'), self.users[:4])
+            self.assertEqual([len(tags) for tags in self.load(self.info(), profiles, 'tags')],
+                             [0, 1, 2, 3])
+
+    def test_many_to_many_is_grouped_by_instance(self):
+        profiles = list(Profile.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            tags = self.load(self.info(), profiles, 'tags')
+        self.assertEqual([[tag.tag_name for tag in profile_tags] for profile_tags in tags],
+                         [[], ['tag0'], ['tag0', 'tag1'], ['tag0', 'tag1', 'tag2']])
+
+    def test_reverse_one_to_one_is_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            profiles = self.load(self.info(), self.users, 'target_user')
+        self.assertEqual([profile and profile.profile_name for profile in profiles],
+                         ['user0', 'user1', 'user2', 'user3', None])
+
+    def test_list_fields_do_not_query_per_item(self):
+        # connectionではないリストのフィールドも、関連先は件数によらず1クエリで取得する
+        query = '''mutation($receivers: [ID!]!) {
+            createNotifications(input: {receivers: $receivers, notificationType: "follow"}) {
+                notifications { receiver { email targetUser { profileName } } }
+            }
+        }'''
+        counts = []
+        for users in [self.users[1:3], self.users[1:]]:
+            result, queries = execute_graphql(query, self.users[0], {
+                'receivers': [to_global_id('UserNode', user.id) for user in users]})
+            self.assertIsNone(result.errors)
+            self.assertEqual(
+                [item['receiver']['email'] for item in
+                 result.data['createNotifications']['notifications']],
+                [user.email for user in users])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+# 選択された関連フィールドに合わせてselect_related/prefetch_relatedが付与されることを確認する
+class SelectionOptimizerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(address_name='東京都')
+        tags = [Tag.objects.create(tag_name='tag{}'.format(i)) for i in range(3)]
+        for i in range(6):
+            user = User.objects.create(email='user{}@example.com'.format(i), is_active=True)
+            profile = Profile.objects.create(
+                target_user=user, profile_name='user{}'.format(i), is_college_student=True,
+                selected_address=address)
+            profile.tags.set(tags[:i % 3 + 1])
+            Plan.objects.create(plan_author=user, title='plan{}'.format(i), content='content')
+
+    # first: 2 と first: 6 で発行されるクエリを比べ、件数によらないことを確認する
+    def capture(self, query):
+        queries = [execute_and_capture(query.replace('$first', str(first)))
+                   for first in [2, 6]]
+        self.assertEqual(len(queries[0]), len(queries[1]))
+        return [sql for sql in queries[1] if not sql.startswith('SELECT COUNT')]
+
+    def test_forward_relations_are_joined(self):
+        queries = self.capture('''{
+            allPlans(first: $first) { edges { node {
+                title
+                planAuthor { email targetUser { profileName selectedAddress { addressName } } }
+            } } }
+        }''')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('INNER JOIN "api_user"', queries[0])
+        self.assertIn('LEFT OUTER JOIN "api_profile"', queries[0])
+        self.assertIn('LEFT OUTER JOIN "api_address"', queries[0])
+
+    def test_unselected_relations_are_not_joined(self):
+        queries = self.capture('{ allPlans(first: $first) { edges { node { title } } } }')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0])
+
+    def test_many_to_many_is_prefetched(self):
+        queries = self.capture('''{
+            allProfiles(first: $first) { edges { node {
+                profileName tags { edges { node { tagName } } }
+            } } }
+        }''')
+        self.assertEqual(len(queries), 2)
+        self.assertIn('FROM "api_profile"', queries[0])
+        self.assertIn('"api_profile_tags"."profile_id" IN', queries[1])
+        # DataLoaderではなくprefetch_relatedで取得している
+        self.assertIn('_prefetch_related_val', queries[1])
+
+    def test_fragments_are_followed(self):
+        queries = self.capture('''
+            query { allPlans(first: $first) { edges { node { ...PlanFields } } } }
+            fragment PlanFields on PlanNode {
+                planAuthor { ... on UserNode { targetUser { profileName } } }
+            }
+        ''')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('INNER JOIN "api_user"', queries[0])
+        self.assertIn('LEFT OUTER JOIN "api_profile"', queries[0])
+
+
+# 選択されたフィールドに必要なカラムだけを読み込み、読み込まなかったカラムを後から取得しないことを確認する
+class ColumnPruningTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = []
+        for i in range(3):
+            user = User.objects.create(email='user{}@example.com'.format(i), is_active=True)
+            cls.users.append(user)
+            Profile.objects.create(target_user=user, profile_name='user{}'.format(i),
+                                   profile_text='text', is_college_student=True)
+            Plan.objects.create(plan_author=user, title='plan{}'.format(i), content='content')
+            Notification.objects.create(notificator=user, receiver=cls.users[0],
+                                        notification_type='follow')
+
+    def selected_columns(self, query, user=None):
+        queries = [sql for sql in execute_and_capture(query, user)
+                   if not sql.startswith('SELECT COUNT')]
+        # 読み込まなかったカラムを行ごとに取得し直していれば、ここでクエリの数が増える
+        self.assertEqual(len(queries), 1, queries)
+        columns = re.match(r'SELECT (.*?) FROM ', queries[0]).group(1)
+        return set(column.strip() for column in columns.split(','))
+
+    def test_only_selected_columns_are_loaded(self):
+        self.assertEqual(
+            self.selected_columns('{ allPlans { edges { node { title } } } }'),
+            {'"api_plan"."id"', '"api_plan"."title"'})
+
+    def test_related_columns_are_pruned(self):
+        self.assertEqual(
+            self.selected_columns('{ allPlans { edges { node { title planAuthor { email } } } } }'),
+            {'"api_plan"."id"', '"api_plan"."title"', '"api_plan"."plan_author_id"',
+             '"api_user"."id"', '"api_user"."email"'})
+
+    def test_hinted_columns_are_loaded(self):
+        columns = self.selected_columns('{ allProfiles { edges { node { starsHistogram } } } }')
+        self.assertTrue({'"api_profile"."stars_{}_count"'.format(stars)
+                         for stars in range(1, 6)} <= columns)
+        self.assertNotIn('"api_profile"."profile_text"', columns)
+        self.assertNotIn('"api_profile"."search_text"', columns)
+
+    def test_ordering_columns_are_loaded(self):
+        columns = self.selected_columns(
+            '{ loginUserNotifications(first: 2) { edges { cursor node { notificationType } } } }',
+            self.users[0])
+        self.assertEqual(columns, {
+            '"api_notification"."id"', '"api_notification"."notification_type"',
+            '"api_notification"."created_at"'})
+
+
+# メッセージの既読が、リクエストしたユーザーが参加しているトークルームの受け取ったメッセージに限られることを確認する
+class UpdateMessagesTest(TalkRoomFixtureMixin, TestCase):
+    update_messages = '''mutation($ids: [ID]) {
+        updateMessages(input: {messageIds: $ids}) { ok count }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_talk_rooms(room_count=2, opponent_count=2)
+        cls.other, cls.other_room = cls.opponents[1], cls.rooms[1]
+        cls.messages = {}
+        for room, sender, count in [(cls.room, cls.author, 6), (cls.room, cls.opponent, 1),
+                                    (cls.other_room, cls.other, 2)]:
+            cls.messages[room.id, sender.id] = [
+                Message.objects.create(talking_room=room, sender=sender, text='message')
+                for _ in range(count)]
+            for message in cls.messages[room.id, sender.id]:
+                TalkRoom.add_message(message)
+
+    def variables(self, messages):
+        return {'ids': [to_global_id('MessageNode', message.id) for message in messages]}
+
+    def update(self, user, messages):
+        result, queries = execute_graphql(self.update_messages, user, self.variables(messages))
+        self.assertIsNone(result.errors)
+        return result.data['updateMessages']['count'], queries
+
+    def member(self, room, user):
+        return TalkRoomMember.objects.get(talk_room=room, user=user)
+
+    def test_only_received_messages_in_own_rooms_are_read(self):
+        received = self.messages[self.room.id, self.author.id][:3]
+        sent = self.messages[self.room.id, self.opponent.id]
+        others = self.messages[self.other_room.id, self.other.id]
+        count, _ = self.update(self.opponent, received + sent + others)
+        # 既読の位置を進めたトークルームの件数
+        self.assertEqual(count, 1)
+
+        member = self.member(self.room, self.opponent)
+        self.assertEqual(member.last_read_message_id, received[-1].id)
+        self.assertEqual(member.unread_count, 3)
+        # 参加していないトークルームや、他の参加者の既読の位置は変わらない
+        self.assertEqual(self.member(self.room, self.author).last_read_message_id, 0)
+        self.assertEqual(self.member(self.room, self.author).unread_count, 1)
+        self.assertEqual(self.member(self.other_room, self.author).unread_count, 2)
+        self.assertEqual(self.member(self.other_room, self.other).last_read_message_id, 0)
+
+        # 既読の位置より前のメッセージでは何も更新しない
+        self.assertEqual(self.update(self.opponent, received[:2])[0], 0)
+        self.assertEqual(self.member(self.room, self.opponent).last_read_message_id,
+                         received[-1].id)
+
+    def test_failed_chunk_rolls_back_earlier_chunks(self):
+        messages = self.messages[self.room.id, self.author.id]
+        mark_read = TalkRoomMember.mark_read
+        calls = []
+
+        def fail_second_chunk(queryset, message_ids=None):
+            calls.append(message_ids)
+            if len(calls) == 2:
+                raise ValueError('failed')
+            return mark_read(queryset, message_ids)
+
+        with mock.patch('api.schema.BULK_UPDATE_CHUNK_SIZE', 2), \
+                mock.patch.object(TalkRoomMember, 'mark_read', side_effect=fail_second_chunk):
+            result, _ = execute_graphql(self.update_messages, self.opponent,
+                                        self.variables(messages))
+        self.assertIsNotNone(result.errors)
+        self.assertEqual(len(calls), 2)
+        # 最初の単位の更新も取り消される
+        self.assertEqual(self.member(self.room, self.opponent).last_read_message_id, 0)
+        self.assertEqual(self.member(self.room, self.opponent).unread_count, 6)
+
+    def test_own_messages_are_not_read(self):
+        count, _ = self.update(self.author, self.messages[self.room.id, self.author.id])
+        self.assertEqual(count, 0)
+        self.assertEqual(self.member(self.room, self.author).last_read_message_id, 0)
+        self.assertEqual(self.member(self.room, self.opponent).unread_count, 6)
+
+    def test_query_count_does_not_depend_on_message_count(self):
+        messages = self.messages[self.room.id, self.author.id]
+        counts = [len(self.update(self.opponent, messages[:size])[1]) for size in [1, 6]]
+        self.assertEqual(counts[0], counts[1])
+
+        # 上限を超える件数はまとめて更新する単位ごとに分ける
+        TalkRoomMember.objects.update(last_read_message_id=0, unread_count=6)
+        with mock.patch('api.schema.BULK_UPDATE_CHUNK_SIZE', 2):
+            count, queries = self.update(self.opponent, messages)
+        self.assertEqual(count, 3)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE')]), 3 * 2)
+
+    def test_requires_login(self):
+        result, _ = execute_graphql(self.update_messages, variables=self.variables(
+            self.messages[self.room.id, self.author.id][:1]))
+        self.assertIsNotNone(result.errors)
+        self.assertEqual(self.member(self.room, self.opponent).last_read_message_id, 0)
+
+
+# 通知の確認済みへの更新が、リクエストしたユーザーが受け取った通知に限られることを確認する
+class CheckNotificationsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other = create_user('other')
+        cls.received = [Notification.objects.create(
+            notificator=cls.other, receiver=cls.user, notification_type='follow')
+            for _ in range(6)]
+        cls.others = [Notification.objects.create(
+            notificator=cls.user, receiver=cls.other, notification_type='follow')
+            for _ in range(2)]
+        # 古い通知
+        Notification.objects.filter(id__in=[n.id for n in cls.received[:2]]).update(
+            created_at=timezone.now() - timedelta(days=7))
+
+    def update(self, user, notifications):
+        result, queries = execute_graphql('''mutation($ids: [ID]) {
+            updateNotifications(input: {notificationIds: $ids}) { ok count }
+        }''', user, {'ids': [to_global_id('NotificationNode', n.id) for n in notifications]})
+        self.assertIsNone(result.errors)
+        return result.data['updateNotifications']['count'], queries
+
+    def unchecked(self, user):
+        return Notification.objects.filter(receiver=user, is_checked=False).count()
+
+    def test_only_received_notifications_are_checked(self):
+        count, _ = self.update(self.user, self.received[:3] + self.others)
+        self.assertEqual(count, 3)
+        self.assertEqual(self.unchecked(self.user), 3)
+        self.assertEqual(self.unchecked(self.other), 2)
+        # 確認済みの通知は数えない
+        self.assertEqual(self.update(self.user, self.received[:4])[0], 1)
+        # 受け取っていない通知は更新できない
+        self.assertEqual(self.update(self.other, self.received[4:])[0], 0)
+        self.assertEqual(self.unchecked(self.user), 2)
+
+    def test_deprecated_notification_field(self):
+        query = '''mutation($ids: [ID]) {
+            updateNotifications(input: {notificationIds: $ids}) {
+                notification { id isChecked } count
+            }
+        }'''
+        ids = [to_global_id('NotificationNode', n.id) for n in self.received[:3] + self.others]
+        result, _ = execute_graphql(query, self.user, {'ids': ids})
+        # 受け取っていない通知は返さない
+        self.assertEqual(result.data['updateNotifications']['notification'], {
+            'id': ids[2], 'isChecked': True})
+        result, _ = execute_graphql(query, self.other, {'ids': ids[:3]})
+        self.assertIsNone(result.data['updateNotifications']['notification'])
+
+    def test_query_count_does_not_depend_on_notification_count(self):
+        counts = [len(self.update(self.user, self.received[:size])[1]) for size in [1, 3]]
+        self.assertEqual(counts[0], counts[1])
+
+        # 上限を超える件数はまとめて更新する単位ごとに分ける
+        with mock.patch('api.schema.BULK_UPDATE_CHUNK_SIZE', 2):
+            count, queries = self.update(self.user, self.received)
+        self.assertEqual(count, 3)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE')]), 3)
+
+    def test_check_all_notifications(self):
+        query = '''mutation($before: DateTime) {
+            checkAllNotifications(input: {createdBefore: $before}) { ok count }
+        }'''
+        result, queries = execute_graphql(query, self.user, {
+            'before': (timezone.now() - timedelta(days=1)).isoformat()})
+        self.assertEqual(result.data['checkAllNotifications']['count'], 2)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE')]), 1)
+        result, _ = execute_graphql(query, self.user)
+        self.assertEqual(result.data['checkAllNotifications']['count'], 4)
+        self.assertEqual(self.unchecked(self.user), 0)
+        self.assertEqual(self.unchecked(self.other), 2)
+
+    def test_requires_login(self):
+        result, _ = execute_graphql('mutation { checkAllNotifications(input: {}) { count } }')
+        self.assertIsNotNone(result.errors)
+        self.assertEqual(self.unchecked(self.user), 6)
+
+
+# 未読数がユーザーごとに正しく、トークルームの数によらない回数のクエリで取得できることを確認する
+class UnreadCounterTest(TalkRoomFixtureMixin, TestCase):
+    query = '''{
+        loginUserTalkRooms(first: 20) { edges { node { unreadCount } } }
+        unreadMessageTotal
+        unreadNotificationCount
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_talk_rooms(room_count=6, opponent_count=6)
+        cls.users = cls.opponents
+        # トークルームiでは、作成者が i + 1 件、相手が1件送信する
+        for i, (room, user) in enumerate(zip(cls.rooms, cls.users)):
+            for sender in [cls.author] * (i + 1) + [user]:
+                TalkRoom.add_message(Message.objects.create(
+                    talking_room=room, sender=sender, text='message'))
+            Notification.objects.create(notificator=cls.author, receiver=user,
+                                        notification_type='message')
+        Notification.objects.create(notificator=cls.users[0], receiver=cls.author,
+                                    notification_type='follow', is_checked=True)
+
+    def counts(self, user):
+        result, queries = execute_graphql(self.query, user)
+        self.assertIsNone(result.errors)
+        return result.data, len(queries)
+
+    def test_counts_are_per_user(self):
+        data, _ = self.counts(self.author)
+        self.assertEqual([edge['node']['unreadCount']
+                          for edge in data['loginUserTalkRooms']['edges']], [1] * 6)
+        self.assertEqual(data['unreadMessageTotal'], 6)
+        self.assertEqual(data['unreadNotificationCount'], 0)
+
+        for i, user in enumerate(self.users):
+            data, _ = self.counts(user)
+            self.assertEqual([edge['node']['unreadCount']
+                              for edge in data['loginUserTalkRooms']['edges']], [i + 1])
+            self.assertEqual(data['unreadMessageTotal'], i + 1)
+            self.assertEqual(data['unreadNotificationCount'], 1)
+
+    def test_query_count_does_not_depend_on_room_count(self):
+        _, one_room = self.counts(self.users[0])
+        _, six_rooms = self.counts(self.author)
+        self.assertEqual(one_room, six_rooms)
+
+    def test_counts_follow_reads_and_messages(self):
+        member = TalkRoomMember.objects.filter(user=self.users[5])
+        TalkRoomMember.mark_read(member)
+        self.assertEqual(self.counts(self.users[5])[0]['unreadMessageTotal'], 0)
+        TalkRoom.add_message(Message.objects.create(
+            talking_room=member.get().talk_room, sender=self.author, text='message'))
+        self.assertEqual(self.counts(self.users[5])[0]['unreadMessageTotal'], 1)
+        self.assertEqual(self.counts(self.author)[0]['unreadMessageTotal'], 6)
+
+    def test_anonymous_user(self):
+        result, _ = execute_graphql('{ unreadMessageTotal unreadNotificationCount }')
+        self.assertIsNotNone(result.errors)
+        self.assertEqual(result.data, {'unreadMessageTotal': None,
+                                       'unreadNotificationCount': None})
+
+
+# カーソルの変換と、カーソルを使ったページングで行の抜けや重複がないことを確認する
+class KeysetPaginationTest(TestCase):
+    query = '''query($first: Int, $after: String, $last: Int, $before: String) {
+        loginUserNotifications(first: $first, after: $after, last: $last, before: $before) {
+            edges { cursor node { id } }
+            pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+        }
+    }'''
+    ordering = ('-created_at', '-id')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        other = create_user('other')
+        for _ in range(7):
+            Notification.objects.create(notificator=other, receiver=cls.user,
+                                        notification_type='follow')
+        Notification.objects.create(notificator=cls.user, receiver=other,
+                                    notification_type='follow')
+        # 同じ日時の通知はIDで並べる
+        created_at = timezone.now()
+        Notification.objects.filter(id__in=list(
+            Notification.objects.order_by('id').values_list('id', flat=True)[2:5])).update(
+            created_at=created_at)
+        cls.expected = [to_global_id('NotificationNode', pk) for pk in
+                        Notification.objects.filter(receiver=cls.user)
+                        .order_by(*cls.ordering).values_list('id', flat=True)]
+
+    def page(self, **variables):
+        result, queries = execute_graphql(self.query, self.user, variables)
+        self.assertIsNone(result.errors)
+        return result.data['loginUserNotifications'], queries
+
+    def test_cursor_round_trip(self):
+        notification = Notification.objects.first()
+        cursor = KeysetConnectionField.encode_cursor(notification, self.ordering)
+        self.assertEqual(
+            KeysetConnectionField.decode_cursor(cursor, Notification, self.ordering),
+            [notification.created_at, notification.id])
+
+    def test_invalid_cursor(self):
+        for cursor in ['invalid', base64('arrayconnection:1'), base64('keyset:[1]'),
+                       base64('keyset:{')]:
+            with self.assertRaises(ValueError):
+                KeysetConnectionField.decode_cursor(cursor, Notification, self.ordering)
+        result, _ = execute_graphql(self.query, self.user, {'first': 2, 'after': 'invalid'})
+        self.assertIn('カーソルが不正です', str(result.errors[0]))
+
+    def test_forward_pages(self):
+        ids, after, counts = [], None, set()
+        while True:
+            page, queries = self.page(first=2, after=after)
+            ids.extend(edge['node']['id'] for edge in page['edges'])
+            self.assertEqual(page['pageInfo']['hasPreviousPage'], after is not None)
+            # COUNT(*)とOFFSETを使わない
+            self.assertFalse(any('COUNT' in sql or 'OFFSET' in sql for sql in queries))
+            counts.add(len(queries))
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(counts), 1)
+
+    def test_backward_pages(self):
+        ids, before = [], None
+        while True:
+            page, _ = self.page(last=3, before=before)
+            ids[:0] = [edge['node']['id'] for edge in page['edges']]
+            if not page['pageInfo']['hasPreviousPage']:
+                break
+            before = page['pageInfo']['startCursor']
+        self.assertEqual(ids, self.expected)
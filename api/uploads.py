@@ -0,0 +1,87 @@
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+# 1ファイルの最大サイズ（10MB）
+UPLOAD_MAX_FILE_SIZE = 10 * 1024 * 1024
+# 1リクエストのファイルの合計の最大サイズ（25MB）
+UPLOAD_MAX_REQUEST_SIZE = 25 * 1024 * 1024
+# 1リクエストの最大ファイル数
+UPLOAD_MAX_FILES = 5
+
+
+class UploadTooLarge(RequestDataTooBig):
+    pass
+
+
+def get_max_file_size():
+    return getattr(settings, 'UPLOAD_MAX_FILE_SIZE', UPLOAD_MAX_FILE_SIZE)
+
+
+def get_max_request_size():
+    return getattr(settings, 'UPLOAD_MAX_REQUEST_SIZE', UPLOAD_MAX_REQUEST_SIZE)
+
+
+def get_max_files():
+    return getattr(settings, 'UPLOAD_MAX_FILES', UPLOAD_MAX_FILES)
+
+
+# FILE_UPLOAD_MAX_MEMORY_SIZE を超えたら一時ファイルに書き出すアップロードファイル
+# sha256 には受信しながら計算した内容のハッシュが入る
+class SpooledUploadedFile(UploadedFile):
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR)
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+# アップロードを受信しながら一時ファイルに書き出し、サイズと数の上限を確認するハンドラー
+# 上限を超えたら残りを読まずに UploadTooLarge を送出する
+class StreamingUploadHandler(FileUploadHandler):
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.total_size = 0
+        self.file_count = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Content-Lengthで上限を超えていれば本文を読む前に拒否する
+        if content_length > get_max_request_size():
+            raise UploadTooLarge('アップロードの合計サイズが上限を超えています')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_count += 1
+        if self.file_count > get_max_files():
+            raise UploadTooLarge('アップロードできるファイル数を超えています')
+        self.file = SpooledUploadedFile(self.file_name, self.content_type, 0,
+                                        self.charset, self.content_type_extra)
+        self.hash = hashlib.sha256()
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.total_size += len(raw_data)
+        if self.file_size > get_max_file_size():
+            self.file.close()
+            raise UploadTooLarge('ファイルのサイズが上限を超えています')
+        if self.total_size > get_max_request_size():
+            self.file.close()
+            raise UploadTooLarge('アップロードの合計サイズが上限を超えています')
+        self.hash.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hash.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
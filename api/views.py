@@ -1,3 +1,105 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.db import connection
+from django.http import HttpResponse, HttpResponseBadRequest
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+
+from .documents import get_document_backend
+from .persisted_queries import (PERSISTED_QUERY_NOT_FOUND,
+                                PersistedQueryError, resolve_persisted_query)
+from .profiling import QueryProfiler, is_debug_requested, should_profile
+from .response_cache import (get_auth_scope, get_cache_key,
+                             get_cacheable_document, get_response_cache)
+from .uploads import UploadTooLarge
+
+
+# 未ログインで実行される公開クエリのレスポンスをキャッシュするGraphQLView
+# 永続化クエリ（sha256のみの送信）と、検証済みクエリのキャッシュにも対応する
+class CachedGraphQLView(FileUploadGraphQLView):
+    def get_backend(self, request):
+        return get_document_backend()
+
+    def parse_body(self, request):
+        try:
+            return super().parse_body(request)
+        except UploadTooLarge as e:
+            raise HttpError(HttpResponse(status=413), str(e))
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name,
+                                show_graphiql=False):
+        if should_profile(request):
+            # リゾルバーごとの時間とSQLを計測してログに出力する
+            profiler = QueryProfiler(debug=is_debug_requested(request))
+            request.graphql_profiler = profiler
+            with connection.execute_wrapper(profiler):
+                result = super().execute_graphql_request(
+                    request, data, query, variables, operation_name, show_graphiql)
+            summary = profiler.log(operation_name)
+            if profiler.debug:
+                request.graphql_profile = summary
+        else:
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql)
+        if query and result is not None and not result.invalid:
+            self.record_cost(request, self.get_backend(request).document_from_string(
+                self.schema, query), operation_name)
+        return result
+
+    def record_cost(self, request, document, operation_name):
+        costs = document.costs
+        if operation_name in costs:
+            request.graphql_cost = costs[operation_name]
+        elif len(costs) == 1:
+            request.graphql_cost = next(iter(costs.values()))
+
+    # 計算したクエリのコスト（と計測結果）をレスポンスの extensions で返す
+    def json_encode(self, request, d, pretty=False):
+        extensions = {}
+        if getattr(request, 'graphql_cost', None) is not None and 'data' in d:
+            extensions['cost'] = request.graphql_cost
+        if getattr(request, 'graphql_profile', None) is not None:
+            extensions['profile'] = request.graphql_profile
+        if extensions:
+            d = dict(d, extensions=extensions)
+        return super().json_encode(request, d, pretty)
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        try:
+            if isinstance(extensions, str):
+                extensions = json.loads(extensions)
+            query = resolve_persisted_query(query, extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        except PersistedQueryError as e:
+            # 未登録のハッシュはクライアントがクエリ本文を付けて再送する
+            status = 200 if str(e) == PERSISTED_QUERY_NOT_FOUND else 400
+            raise HttpError(HttpResponse(status=status), str(e))
+        return query, variables, operation_name, id
+
+    def get_response(self, request, data, show_graphiql=False):
+        if show_graphiql or self.batch or is_debug_requested(request):
+            return super().get_response(request, data, show_graphiql)
+
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        scope = get_auth_scope(request)
+        cacheable = get_cacheable_document(self.schema, query, operation_name) \
+            if query and scope else None
+        if cacheable is None:
+            return super().get_response(request, data, show_graphiql)
+
+        document, models = cacheable
+        cache = get_response_cache()
+        versions = cache.get_versions([model._meta.label for model in models])
+        key = get_cache_key(document, variables, operation_name, scope, versions)
+        result = cache.get(key)
+        if result is not None:
+            return result, 200
+
+        result, status_code = super().get_response(request, data, show_graphiql)
+        # エラーを含むレスポンスは保存しない
+        if status_code == 200 and result and 'errors' not in json.loads(result):
+            cache.set(key, result)
+        return result, status_code
@@ -0,0 +1,221 @@
+import asyncio
+import json
+from functools import partial
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.shortcuts import get_user_by_token
+from promise import Promise
+from rx import Observable
+from rx.subjects import Subject
+
+from .documents import get_document_backend
+from .pubsub import get_channel_layer
+
+# subscriptions-transport-ws（Apolloのgraphql-ws）プロトコル
+GRAPHQL_WS = 'graphql-ws'
+GQL_CONNECTION_INIT = 'connection_init'
+GQL_CONNECTION_ACK = 'connection_ack'
+GQL_CONNECTION_ERROR = 'connection_error'
+GQL_CONNECTION_TERMINATE = 'connection_terminate'
+GQL_START = 'start'
+GQL_DATA = 'data'
+GQL_ERROR = 'error'
+GQL_COMPLETE = 'complete'
+GQL_STOP = 'stop'
+
+
+# サブスクリプションのリゾルバーに渡すコンテキスト
+# info.context.user で認証済みユーザー、info.context.subscribe(group) で配信を受け取る
+class SubscriptionContext:
+    def __init__(self, user, on_subscribe):
+        self.user = user
+        self._on_subscribe = on_subscribe
+
+    def subscribe(self, group):
+        subject = Subject()
+        self._on_subscribe(group, subject)
+        return subject
+
+
+def format_errors(errors):
+    return [{'message': str(error)} for error in errors]
+
+
+# 1つのWebSocket接続を処理する
+class GraphQLWebSocketConnection:
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.user = AnonymousUser()
+        # op_id -> (context, [(group, subject, callback), ...])
+        self.operations = {}
+        self.layer = get_channel_layer()
+
+    # チャンネルレイヤーからの配信（別スレッドから呼ばれる）
+    # 購読ごとに op_id と subject を束縛した別の受け取り先として登録するので、
+    # 同じ接続で同じグループを複数購読していても、1つをstopしたときに他の購読は解除されない
+    def on_channel_message(self, op_id, subject, group, message):
+        self.loop.call_soon_threadsafe(
+            self.queue.put_nowait, ('channel', op_id, subject, message))
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def run(self):
+        reader = asyncio.ensure_future(self.read_client())
+        try:
+            while True:
+                item = await self.queue.get()
+                if item[0] == 'disconnect':
+                    break
+                if item[0] == 'client':
+                    if not await self.handle_client_message(item[1]):
+                        break
+                elif item[0] == 'channel':
+                    await self.handle_channel_message(item[1], item[2], item[3])
+                elif item[0] == 'result':
+                    await self.send_result(item[1], item[2])
+        finally:
+            reader.cancel()
+            for op_id in list(self.operations):
+                self.stop_operation(op_id)
+
+    async def read_client(self):
+        while True:
+            event = await self.receive()
+            if event['type'] == 'websocket.receive':
+                await self.queue.put(('client', event.get('text') or ''))
+            elif event['type'] == 'websocket.disconnect':
+                await self.queue.put(('disconnect',))
+                return
+
+    async def handle_client_message(self, text):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            await self.send_json({'type': GQL_CONNECTION_ERROR,
+                                  'payload': {'message': 'JSONの形式が不正です'}})
+            return True
+
+        op_type = message.get('type')
+        op_id = message.get('id')
+        payload = message.get('payload') or {}
+
+        if op_type == GQL_CONNECTION_INIT:
+            self.user = await sync_to_async(self.authenticate)(payload)
+            await self.send_json({'type': GQL_CONNECTION_ACK})
+        elif op_type == GQL_START:
+            self.stop_operation(op_id)
+            await self.start_operation(op_id, payload)
+        elif op_type == GQL_STOP:
+            self.stop_operation(op_id)
+            await self.send_json({'type': GQL_COMPLETE, 'id': op_id})
+        elif op_type == GQL_CONNECTION_TERMINATE:
+            await self.send({'type': 'websocket.close'})
+            return False
+        return True
+
+    # connection_initのpayload、またはクエリパラメーターのtokenでJWT認証する
+    def authenticate(self, payload):
+        token = payload.get('authToken') or payload.get('Authorization') or ''
+        if not token:
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            token = (query.get('token') or [''])[0]
+        if token.startswith('JWT '):
+            token = token[len('JWT '):]
+        if not token:
+            return AnonymousUser()
+        try:
+            return get_user_by_token(token) or AnonymousUser()
+        except JSONWebTokenError:
+            return AnonymousUser()
+
+    async def start_operation(self, op_id, payload):
+        subscriptions = []
+
+        def on_subscribe(group, subject):
+            callback = partial(self.on_channel_message, op_id, subject)
+            self.layer.group_add(group, callback)
+            subscriptions.append((group, subject, callback))
+
+        context = SubscriptionContext(self.user, on_subscribe)
+        result = await sync_to_async(self.schema.execute)(
+            payload.get('query'),
+            variables=payload.get('variables'),
+            operation_name=payload.get('operationName'),
+            context_value=context,
+            allow_subscriptions=True,
+            backend=get_document_backend(),
+        )
+
+        if not isinstance(result, Observable):
+            for group, subject, callback in subscriptions:
+                self.layer.group_discard(group, callback)
+            if result.errors:
+                await self.send_json({'type': GQL_ERROR, 'id': op_id,
+                                      'payload': format_errors(result.errors)})
+            else:
+                await self.send_result(op_id, result)
+                await self.send_json({'type': GQL_COMPLETE, 'id': op_id})
+            return
+
+        self.operations[op_id] = (context, subscriptions)
+        result.subscribe(
+            on_next=lambda execution_result: self.loop.call_soon_threadsafe(
+                self.queue.put_nowait, ('result', op_id, execution_result)))
+
+    def stop_operation(self, op_id):
+        _, subscriptions = self.operations.pop(op_id, (None, []))
+        for group, subject, callback in subscriptions:
+            self.layer.group_discard(group, callback)
+            subject.on_completed()
+
+    async def handle_channel_message(self, op_id, subject, message):
+        # stopした後に届いた配信は無視する
+        context, subscriptions = self.operations.get(op_id, (None, []))
+        if any(subscribed is subject for _, subscribed, _ in subscriptions):
+            await sync_to_async(self.dispatch)(context, subject, message)
+
+    # 配信されたメッセージでサブスクリプションのクエリを実行する（DBアクセスがあるので同期で）
+    def dispatch(self, context, subject, message):
+        # DataLoaderのキャッシュは配信ごとに作り直す
+        context.dataloaders = None
+        subject.on_next(message)
+
+    async def send_result(self, op_id, result):
+        data = await sync_to_async(self.resolve_data)(result.data)
+        payload = {'data': data}
+        if result.errors:
+            payload['errors'] = format_errors(result.errors)
+        await self.send_json({'type': GQL_DATA, 'id': op_id, 'payload': payload})
+
+    # DataLoaderのPromiseが含まれている場合は解決する
+    def resolve_data(self, data):
+        if data is None:
+            return None
+        return {key: Promise.resolve(value).get() if Promise.is_thenable(value) else value
+                for key, value in data.items()}
+
+
+# GraphQLのサブスクリプションをWebSocketで提供するASGIアプリケーション
+class GraphQLWebSocketApplication:
+    def __init__(self, schema):
+        self.schema = schema
+
+    async def __call__(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        subprotocols = scope.get('subprotocols') or []
+        if GRAPHQL_WS not in subprotocols:
+            await send({'type': 'websocket.close', 'code': 1002})
+            return
+        await send({'type': 'websocket.accept', 'subprotocol': GRAPHQL_WS})
+        await GraphQLWebSocketConnection(self.schema, scope, receive, send).run()
@@ -12,5 +12,23 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'harusmile.settings')
+# GraphQLのHTTPリクエストも非同期のビューで処理する
+os.environ.setdefault('GRAPHQL_ASYNC', 'True')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Djangoの初期化後にスキーマを読み込む
+from api.websocket import GraphQLWebSocketApplication  # noqa: E402
+from harusmile.schema import schema  # noqa: E402
+
+websocket_application = GraphQLWebSocketApplication(schema)
+
+
+# HTTPはDjango、/graphql/ へのWebSocketはGraphQLのサブスクリプションで処理する
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].rstrip('/') != '/graphql':
+            await send({'type': 'websocket.close'})
+            return
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
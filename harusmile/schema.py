@@ -7,4 +7,7 @@ class Query(api.schema.Query, graphene.ObjectType):
 class Mutation(api.schema.Mutation, graphene.ObjectType):
     pass
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+class Subscription(api.schema.Subscription, graphene.ObjectType):
+    pass
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
\ No newline at end of file
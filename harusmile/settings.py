@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.auth.JSONWebTokenMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +70,8 @@ GRAPHQL_JWT = {
     'JWT_EXPIRATION_DELTA': timedelta(minutes=30),
     'JWT_REFRESH_EXPIRATION_DELTA': timedelta(days=14),
 }
+# トークンとユーザーの対応をワーカーごとに保持する秒数（api.auth）
+JWT_USER_CACHE_TTL = 60
 
 
 CORS_ALLOWED_ORIGINS = [
@@ -119,12 +122,59 @@ DATABASES = {
 }
 
 
+# 公開クエリのレスポンスのキャッシュ（api.response_cache）
+# キャッシュのヒット時にデータベースへ問い合わせないよう、既定はプロセスごとのlocmemを使う
+# locmemでは書き込みによる無効化が他のプロセスに伝わらない（TIMEOUTの間は古い結果を返しうる）ので、
+# 複数のワーカーで運用する場合は共有のキャッシュを環境変数で指定する
+# 例: GRAPHQL_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+#     GRAPHQL_CACHE_LOCATION=127.0.0.1:11211
+# （DatabaseCacheを指定する場合は manage.py createcachetable でテーブルを作成する）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'graphql': {
+        'BACKEND': config('GRAPHQL_CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('GRAPHQL_CACHE_LOCATION', default='graphql_response_cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+GRAPHQL_RESPONSE_CACHE_ALIAS = 'graphql'
+
+# 永続化クエリ（api.persisted_queries）
+# 本番ではマニフェスト（{sha256: クエリ} のJSON）に登録されたクエリのみ実行する
+GRAPHQL_PERSISTED_QUERIES_FILE = config('GRAPHQL_PERSISTED_QUERIES_FILE', default=None)
+GRAPHQL_PERSISTED_QUERIES_ONLY = config(
+    'GRAPHQL_PERSISTED_QUERIES_ONLY', default=False, cast=bool)
+
+
 GRAPHENE = {'SCHEMA': 'harusmile.schema.schema',
+            # JWTの認証はリクエストごとに1回だけ api.auth.JSONWebTokenMiddleware で行う
             'MIDDLEWARE': [
-                'graphql_jwt.middleware.JSONWebTokenMiddleware',
+                'api.profiling.QueryProfilingMiddleware',
             ],
+            # connectionで1回に取得できる件数の上限
+            'RELAY_CONNECTION_MAX_LIMIT': 100,
             }
 
+# クエリのコストの上限（api.cost）
+GRAPHQL_MAX_QUERY_COST = 100000
+GRAPHQL_MAX_QUERY_DEPTH = 15
+# first/lastの指定がないconnectionで返す件数
+GRAPHQL_DEFAULT_PAGE_SIZE = 100
+
+# ASGI（harusmile.asgi）で動かす場合に、GraphQLを非同期のビューで実行する（api.async_views）
+# 例: gunicorn harusmile.asgi:application -k uvicorn.workers.UvicornWorker
+GRAPHQL_ASYNC = config('GRAPHQL_ASYNC', default=False, cast=bool)
+# 非同期のビューでORMを実行するスレッド数（プロセスあたりのDB接続数の上限）
+GRAPHQL_ORM_THREADS = config('GRAPHQL_ORM_THREADS', default=8, cast=int)
+
+# リゾルバーごとの時間とSQLを計測するリクエストの割合（api.profiling）
+# X-GraphQL-Profile ヘッダーがあれば開発環境・スタッフは常に計測し、結果をextensionsで返す
+GRAPHQL_PROFILE_SAMPLE_RATE = config('GRAPHQL_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+
 
 AUTHENTICATION_BACKENDS = [
     'graphql_jwt.backends.JSONWebTokenBackend',
@@ -188,7 +238,18 @@ CLOUDINARY_STORAGE = {
     'API_SECRET': config("CLOUDINARY_API_SECRET"),
 }
 
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+DEFAULT_FILE_STORAGE = config(
+    'DEFAULT_FILE_STORAGE', default='cloudinary_storage.storage.MediaCloudinaryStorage')
+# 加工前の画像を一時保存するストレージ（未指定ならDEFAULT_FILE_STORAGEの pending/ 以下）
+# Webとワーカーの両方から読み書きできるストレージを指定する
+IMAGE_PENDING_STORAGE = config('IMAGE_PENDING_STORAGE', default=None)
+
+# アップロードは受信しながら上限を確認し、256KBを超えたら一時ファイルに書き出す
+FILE_UPLOAD_HANDLERS = ['api.uploads.StreamingUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+UPLOAD_MAX_FILE_SIZE = config('UPLOAD_MAX_FILE_SIZE', default=10 * 1024 * 1024, cast=int)
+UPLOAD_MAX_REQUEST_SIZE = config('UPLOAD_MAX_REQUEST_SIZE', default=25 * 1024 * 1024, cast=int)
+UPLOAD_MAX_FILES = config('UPLOAD_MAX_FILES', default=5, cast=int)
 
 EMAIL_HOST = config('EMAIL_HOST')
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
@@ -3,13 +3,20 @@ from django.urls import path
 from graphene_django.views import GraphQLView
 from harusmile.schema import schema
 from django.views.decorators.csrf import csrf_exempt
-from graphene_file_upload.django import FileUploadGraphQLView
+from api.async_views import AsyncGraphQLView
+from api.views import CachedGraphQLView
 from django.conf.urls.static import static
 from django.conf import settings
 
 
+# ASGIで動かす場合はクエリを非同期で実行するビューを使う
+if settings.GRAPHQL_ASYNC:
+    graphql_view = AsyncGraphQLView.as_async_view(graphiql=True, schema=schema)
+else:
+    graphql_view = csrf_exempt(CachedGraphQLView.as_view(graphiql=True, schema=schema))
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql/', graphql_view),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
 + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file